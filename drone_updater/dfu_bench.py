@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# --- START OF FILE dfu_bench.py ---
+
+import asyncio
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+from dfu_lib import NordicLegacyDFU, DeviceRegistry
+from dfu_sim import SimWorld, SimLinkProfile, legacy_init_packet
+
+logger = logging.getLogger("DFU_BENCH")
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for suffix, factor in (("K", 1024), ("M", 1024 * 1024)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def parse_list(text: str, conv=int):
+    return [conv(item) for item in text.split(",") if item.strip()]
+
+def build_package(directory: str, size: int, seed: int = 0) -> str:
+    """Synthetic application package of `size` random bytes with a legacy init packet."""
+    path = os.path.join(directory, f"bench-{size}.zip")
+    if os.path.exists(path):
+        return path
+    image = random.Random(seed + size).randbytes(size)
+    manifest = {"manifest": {"application": {"bin_file": "app.bin", "dat_file": "app.dat"}}}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("manifest.json", json.dumps(manifest))
+        z.writestr("app.bin", image)
+        z.writestr("app.dat", legacy_init_packet(image))
+    return path
+
+def make_profile(args, full_buffer: str = "overrun") -> SimLinkProfile:
+    return SimLinkProfile(mtu=args.mtu, data_length=args.data_length, conn_interval=args.conn_interval / 1000.0,
+                          frames_per_event=args.frames_per_event, loss=args.loss, supports_2m=not args.no_2m,
+                          write_latency=args.write_latency / 1000.0, write_cost=args.write_cost / 1000.0,
+                          max_data_length=args.max_data_length, min_conn_interval=args.min_interval / 1000.0,
+                          buffer_size=args.buffer, flash_write_delay=args.flash_delay / 1000.0,
+                          full_buffer=full_buffer, disconnect_rate=args.disconnect_rate, time_scale=args.time_scale, seed=args.seed)
+
+async def run_case(args, package: str, size: int, prn: int, chunk: int, mode: str, inflight: int = 1,
+                   full_buffer: str = "overrun") -> dict:
+    profile = make_profile(args, full_buffer)
+    world = SimWorld(profile)
+    drone = world.add("BENCH_OTA", "C0:FF:EE:00:00:01", mode="app" if args.handoff else "bootloader")
+    events = []
+    dfu = NordicLegacyDFU(package, prn, 0.0, adaptive_prn=(mode == "adaptive"), max_chunk=chunk,
+                          event_callback=events.append, client_factory=world.client,
+                          tune_link=not args.no_link_tuning, max_inflight=inflight)
+    dfu.parse_zip()
+
+    ok = True
+    error = None
+    start = time.monotonic()
+    try:
+        if args.handoff:
+            async with DeviceRegistry(scanner_factory=world.scanner) as registry:
+                await dfu.update_device(drone.device(), max_retries=args.retries, registry=registry)
+        else:
+            await dfu.perform_update(drone.device(), max_retries=args.retries)
+    except Exception as e:
+        ok = False
+        error = str(e)
+    finally:
+        dfu.close()
+    wall = time.monotonic() - start
+
+    stream = dfu.stream_stats
+    upload_s = stream.get("seconds", 0.0) / profile.time_scale
+    link = world.link_stats()
+    return {
+        "mode": mode, "prn": prn, "chunk": stream.get("chunk_size", chunk), "size": size, "inflight": inflight,
+        "full_buffer": full_buffer,
+        "ok": ok and drone.bootloader.completed > 0, "error": error,
+        "session_s": round(wall / profile.time_scale, 3),
+        "upload_s": round(upload_s, 3),
+        "bps": int(size / upload_s) if ok and upload_s > 0 else 0,
+        "pps": int(dfu.packets_sent / upload_s) if ok and upload_s > 0 else 0,
+        "retries": sum(1 for e in events if e.get("event") == "error" and e.get("reason") == "attempt_failed"),
+        "prn_timeouts": stream.get("prn_timeouts", 0),
+        "window": stream.get("window"),
+        "link": {k: dfu.link_params.get(k) for k in ("phy", "data_length", "interval_ms")},
+        "retransmits": link["retransmits"],
+        "held": link["held"],
+        "overruns": link["overruns"],
+    }
+
+def case_key(result: dict):
+    return (result["mode"], result["prn"], result["chunk"], result["size"], result.get("inflight", 1),
+            result.get("full_buffer", "overrun"))
+
+def print_table(results):
+    header = f"{'mode':<9}{'buffer':<8}{'prn':>5}{'chunk':>7}{'size':>9}{'infl':>5}{'ok':>4}{'bytes/s':>10}{'pkts/s':>8}{'upload s':>10}" \
+             f"{'session s':>11}{'retries':>9}{'prn t/o':>9}{'held':>7}{'overrun':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['mode']:<9}{r['full_buffer']:<8}{r['prn']:>5}{r['chunk']:>7}{r['size']:>9}{r['inflight']:>5}{'y' if r['ok'] else 'n':>4}"
+              f"{r['bps']:>10}{r['pps']:>8}{r['upload_s']:>10.2f}{r['session_s']:>11.2f}{r['retries']:>9}"
+              f"{r['prn_timeouts']:>9}{r['held']:>7}{r['overruns']:>9}")
+
+def compare_baseline(results, baseline_path: str, tolerance: float) -> int:
+    """Number of cases that got slower than the baseline by more than `tolerance`."""
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in json.load(f)["results"]}
+    regressions = 0
+    for r in results:
+        base = baseline.get(case_key(r))
+        if not base or not base["ok"]:
+            continue
+        if not r["ok"] or r["bps"] < base["bps"] * (1.0 - tolerance):
+            regressions += 1
+            print(f"REGRESSION {case_key(r)}: {r['bps']} B/s vs baseline {base['bps']} B/s")
+    return regressions
+
+async def main():
+    parser = argparse.ArgumentParser(description="Legacy DFU throughput benchmark against a simulated bootloader")
+    parser.add_argument("--prn", default="0,4,8,16", help="PRN values to sweep (default 0,4,8,16)")
+    parser.add_argument("--chunk", default="20,244", help="Max chunk sizes to sweep (default 20,244)")
+    parser.add_argument("--size", default="64K", help="Image sizes to sweep, e.g. 64K,256K (default 64K)")
+    parser.add_argument("--mode", default="fixed,adaptive", help="PRN window modes: fixed, adaptive")
+    parser.add_argument("--inflight", default="1", help="Packet writes kept in flight to sweep, e.g. 1,8 (default 1)")
+    parser.add_argument("--retries", type=int, default=3, help="DFU connection attempts per case (default 3)")
+    parser.add_argument("--handoff", action="store_true", help="Start from the application and include the jump")
+    parser.add_argument("--no-link-tuning", action="store_true", help="Do not request 2M PHY, data length or interval")
+    # Link model
+    parser.add_argument("--mtu", type=int, default=247, help="ATT MTU (default 247)")
+    parser.add_argument("--data-length", type=int, default=27, help="Initial link-layer payload size (default 27)")
+    parser.add_argument("--max-data-length", type=int, default=251, help="Largest data length the target accepts (default 251)")
+    parser.add_argument("--conn-interval", type=float, default=30.0, help="Initial connection interval in ms (default 30)")
+    parser.add_argument("--min-interval", type=float, default=7.5, help="Shortest interval the target accepts in ms (default 7.5)")
+    parser.add_argument("--no-2m", action="store_true", help="Target does not support LE 2M PHY")
+    parser.add_argument("--write-latency", type=float, default=2.0, help="D-Bus write round trip in ms (default 2)")
+    parser.add_argument("--write-cost", type=float, default=0.3, help="bluetoothd time per write in ms (default 0.3)")
+    parser.add_argument("--frames-per-event", type=int, default=6, help="Max frames per connection event (default 6)")
+    parser.add_argument("--loss", type=float, default=0.0, help="Frame loss probability (default 0)")
+    parser.add_argument("--buffer", type=int, default=4096, help="Bootloader receive buffer in bytes (default 4096)")
+    parser.add_argument("--flash-delay", type=float, default=45.0, help="Flash write time per 4 KB page in ms (default 45)")
+    parser.add_argument("--full-buffer", default="overrun,hold",
+                        help="Target behaviour on a full buffer to sweep: overrun (fails the upload), "
+                             "hold (link-layer flow control) (default overrun,hold)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Chance a connection drops mid-upload")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Wall seconds per simulated second (default 0.1)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default 1)")
+    # Output
+    parser.add_argument("--json", metavar="FILE", help="Write results as JSON (use as a later --baseline)")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against a previous --json run")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed throughput drop vs baseline (default 0.15)")
+    parser.add_argument("--verbose", action="store_true", help="Show engine logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(name)s: %(message)s")
+    if not args.verbose:
+        logging.getLogger("DFU_LIB").setLevel(logging.CRITICAL)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="dfu_bench_") as tmp:
+        for size in parse_list(args.size, parse_size):
+            package = build_package(tmp, size, args.seed)
+            for mode in parse_list(args.mode, str):
+                for prn in parse_list(args.prn):
+                    for chunk in parse_list(args.chunk):
+                        for inflight in parse_list(args.inflight):
+                            for full_buffer in parse_list(args.full_buffer, str):
+                                result = await run_case(args, package, size, prn, chunk, mode.strip(), inflight,
+                                                        full_buffer.strip())
+                                results.append(result)
+                                if args.verbose:
+                                    print(json.dumps(result))
+
+    print_table(results)
+
+    if args.json:
+        params = {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "verbose")}
+        with open(args.json, "w") as f:
+            json.dump({"params": params, "results": results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+    if not all(r["ok"] for r in results):
+        sys.exit(2)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
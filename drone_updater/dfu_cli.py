@@ -3,12 +3,14 @@
 
 import asyncio
 import argparse
+import json
 import logging
+import os
 import sys
 import time
 
 # Update import to include the new find_any_device function
-from dfu_lib import NordicLegacyDFU, find_any_device, find_device_by_name_or_address, DfuException, DFU_SERVICE_UUID
+from dfu_lib import NordicLegacyDFU, DeviceRegistry, find_any_device, DfuException
 
 # --- Custom Logger for CLI ---
 class MsFormatter(logging.Formatter):
@@ -24,6 +26,20 @@ class MsFormatter(logging.Formatter):
 
 logger = logging.getLogger("DFU_CLI")
 
+class EventWriter:
+    """Writes engine events as newline-delimited JSON to a dedicated file descriptor."""
+    def __init__(self, fd: int):
+        self.stream = os.fdopen(fd, "w", buffering=1)
+
+    def __call__(self, event):
+        try:
+            self.stream.write(json.dumps(event, separators=(",", ":")) + "\n")
+        except (OSError, ValueError):
+            pass  # Reader went away; events are best effort
+
+    def result(self, ok: bool, message: str = None):
+        self({"event": "result", "ts": round(time.time(), 3), "ok": ok, "message": message})
+
 def cli_progress_handler(pct):
     sys.stdout.write(f"\rUploading: {pct}%")
     sys.stdout.flush()
@@ -35,17 +51,24 @@ async def main():
     parser.add_argument("file", help="Path to the ZIP firmware file")
 
     # Changed: nargs='+' allows multiple arguments to be collected into a list
-    parser.add_argument("device", nargs='+', help="Device Name(s) or BLE Address(es). You can provide multiple.")
+    parser.add_argument("device", nargs='+', help="Device Name(s), BLE Address(es) or patterns (RAK*_OTA, re:<regex>, "
+                                                  "uuid:<service uuid>, mfr:<company id>). You can provide multiple.")
 
     parser.add_argument("--scan", action="store_true", help="Force scan even if address is provided")
     parser.add_argument("--adapter", default=None, help="Bluetooth Adapter interface (Linux: hci0)")
     parser.add_argument("--prn", type=int, default=8, help="PRN interval (default 8)")
+    parser.add_argument("--adaptive-prn", action="store_true", help="Adapt packets in flight to measured PRN round trips")
+    parser.add_argument("--inflight", type=int, default=8, help="Packet writes kept in flight (default 8, 1 = one at a time)")
+    parser.add_argument("--skip-current", action="store_true",
+                        help="Read the device's firmware revision first and do nothing if it matches the package version")
     parser.add_argument("--delay", type=float, default=0.4, help="Start/Size Delay (default 0.4s)")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose debug logs")
 
     # New Arguments
     parser.add_argument("--wait", action="store_true", help="Loop indefinitely until one of the target devices is found")
     parser.add_argument("--retry", type=int, default=3, help="Number of DFU connection retries (default 3)")
+    parser.add_argument("--events-fd", type=int, default=None, metavar="FD",
+                        help="Write newline-delimited JSON events (phase, progress, prn, error, result) to this fd")
 
     args = parser.parse_args()
 
@@ -64,65 +87,54 @@ async def main():
     logger.addHandler(handler)
     logging.getLogger("DFU_LIB").addHandler(handler) # Attach handler to lib logger
 
+    events = None
     try:
+        if args.events_fd is not None:
+            try:
+                events = EventWriter(args.events_fd)
+            except (OSError, ValueError, TypeError) as e:
+                parser.error(f"--events-fd {args.events_fd} is not an open file descriptor ({e})")
+
         # Pass None for log_callback so the library uses the standard logger configured above
-        dfu = NordicLegacyDFU(args.file, args.prn, args.delay, adapter=args.adapter, progress_callback=cli_progress_handler)
+        dfu = NordicLegacyDFU(args.file, args.prn, args.delay, adapter=args.adapter,
+                              progress_callback=cli_progress_handler, event_callback=events,
+                              adaptive_prn=args.adaptive_prn, max_inflight=args.inflight,
+                              skip_if_current=args.skip_current)
         dfu.parse_zip()
 
         logger.info(f"Scanning for target(s): {args.device}...")
 
-        # --- WAIT / SCAN Loop ---
-        app_device = None
-        while True:
-            try:
-                # Use find_any_device to check all inputs in a single scan cycle
-                app_device = await find_any_device(args.device, adapter=args.adapter)
-                logger.info(f"Found target: {app_device.name} ({app_device.address})")
-                break # Found!
-            except DfuException:
-                if args.wait:
-                    logger.info("No devices found. Retrying scan...")
-                    await asyncio.sleep(2.0)
-                    continue
-                else:
-                    logger.error(f"Could not find any of: {args.device}")
-                    sys.exit(1)
-
-        await dfu.jump_to_bootloader(app_device)
-
-        logger.info("Waiting for reboot (5s)...")
-        await asyncio.sleep(5.0)
-
-        bootloader_device = None
-        try:
-            logger.info("Scanning for Bootloader (UUID)...")
-            bootloader_device = await find_device_by_name_or_address("DFU", force_scan=True, adapter=args.adapter, service_uuid=DFU_SERVICE_UUID)
-        except DfuException:
-            pass
-
-        if not bootloader_device:
-            original_mac = app_device.address
-            if ":" in original_mac and len(original_mac) == 17:
+        # One scanner for the whole run: target lookup and bootloader lookup share it
+        async with DeviceRegistry(adapter=args.adapter) as registry:
+            # --- WAIT / SCAN Loop ---
+            app_device = None
+            while True:
                 try:
-                    prefix = original_mac[:-2]
-                    last_byte = int(original_mac[-2:], 16)
-                    last_byte = (last_byte + 1) & 0xFF
-                    bootloader_mac_hint = f"{prefix}{last_byte:02X}"
-                    logger.info(f"Scanning for Bootloader (Hint: {bootloader_mac_hint})...")
-                    bootloader_device = await find_device_by_name_or_address(bootloader_mac_hint, force_scan=True, adapter=args.adapter)
-                except: pass
-
-        if not bootloader_device:
-            raise DfuException("Could not locate DFU Bootloader device.")
-
-        # Pass the custom retry count here
-        await dfu.perform_update(bootloader_device, max_retries=args.retry)
+                    # Returns as soon as any of the inputs advertises
+                    app_device = await find_any_device(args.device, registry=registry)
+                    logger.info(f"Found target: {app_device.name} ({app_device.address})")
+                    break # Found!
+                except DfuException:
+                    if args.wait:
+                        logger.info("No devices found. Still scanning...")
+                        continue
+                    else:
+                        logger.error(f"Could not find any of: {args.device}")
+                        if events: events.result(False, f"Could not find any of: {args.device}")
+                        sys.exit(1)
+
+            # Jump, locate the bootloader and flash (same engine the drone service runs in-process)
+            if not await dfu.update_device(app_device, max_retries=args.retry, registry=registry):
+                logger.info(f"Already running {dfu.installed_version}; nothing to do.")
+            if events: events.result(True)
 
     except KeyboardInterrupt:
         logger.info("\nOperation Cancelled by User.")
+        if events: events.result(False, "cancelled")
         sys.exit(0)
     except Exception as e:
         logger.error(f"Failed: {e}")
+        if events: events.result(False, str(e))
         sys.exit(1)
 
 if __name__ == "__main__":
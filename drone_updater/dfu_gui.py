@@ -11,8 +11,7 @@ from datetime import datetime
 # Import BleakScanner directly to handle real-time callbacks in the GUI
 from bleak import BleakScanner
 
-import dfu_lib
-from dfu_lib import NordicLegacyDFU, DFU_SERVICE_UUID
+from dfu_lib import NordicLegacyDFU
 
 class AsyncHelper:
     def __init__(self):
@@ -47,26 +46,21 @@ class DfuApp:
         style = ttk.Style()
         style.configure("Bold.TLabel", font=("Helvetica", 10, "bold"))
 
-        # --- Section 1: Settings (PRN, Timeout, Force Scan) ---
+        # --- Section 1: Settings (PRN, Timeout) ---
         settings_frame = ttk.LabelFrame(root, text="Settings", padding=10)
         settings_frame.pack(fill="x", padx=10, pady=5)
 
-        # Force Scan
-        self.force_scan_var = tk.BooleanVar(value=True)
-        self.chk_force = ttk.Checkbutton(settings_frame, text="Force Scan", variable=self.force_scan_var)
-        self.chk_force.grid(row=0, column=0, sticky="w", padx=5)
-
         # PRN
-        ttk.Label(settings_frame, text="PRN:").grid(row=0, column=1, sticky="e", padx=5)
+        ttk.Label(settings_frame, text="PRN:").grid(row=0, column=0, sticky="e", padx=5)
         self.prn_var = tk.StringVar(value="8")
         self.spin_prn = ttk.Spinbox(settings_frame, from_=0, to=100, textvariable=self.prn_var, width=5)
-        self.spin_prn.grid(row=0, column=2, sticky="w")
+        self.spin_prn.grid(row=0, column=1, sticky="w")
 
         # Scan Timeout
-        ttk.Label(settings_frame, text="Scan Timeout (s):").grid(row=0, column=3, sticky="e", padx=5)
+        ttk.Label(settings_frame, text="Scan Timeout (s):").grid(row=0, column=2, sticky="e", padx=5)
         self.timeout_var = tk.StringVar(value="5")
         self.spin_timeout = ttk.Spinbox(settings_frame, from_=1, to=60, textvariable=self.timeout_var, width=5)
-        self.spin_timeout.grid(row=0, column=4, sticky="w")
+        self.spin_timeout.grid(row=0, column=3, sticky="w")
 
         # --- Section 2: Firmware File ---
         file_frame = ttk.LabelFrame(root, text="Firmware", padding=10)
@@ -236,13 +230,11 @@ class DfuApp:
         except ValueError:
             prn_val = 8
 
-        force_scan = self.force_scan_var.get()
-
         self.start_btn.config(state="disabled")
         self.scan_btn.config(state="disabled")
 
         # We start the update process, which includes ensuring scan is stopped
-        self.async_helper.run_task(self._async_perform_dfu(zip_path, self.selected_device, prn_val, force_scan))
+        self.async_helper.run_task(self._async_perform_dfu(zip_path, self.selected_device, prn_val))
 
     async def _stop_scan_if_running(self):
         """Helper to stop the scanner if it is currently running."""
@@ -253,12 +245,12 @@ class DfuApp:
             while self.scanner is not None:
                 await asyncio.sleep(0.1)
 
-    async def _async_perform_dfu(self, zip_path, device, prn_val, force_scan):
+    async def _async_perform_dfu(self, zip_path, device, prn_val):
         try:
             # 1. Stop any active scan before starting DFU
             await self._stop_scan_if_running()
 
-            self.log(f"Starting DFU (PRN={prn_val}, ForceScan={force_scan})...")
+            self.log(f"Starting DFU (PRN={prn_val})...")
 
             dfu = NordicLegacyDFU(
                 zip_path,
@@ -269,47 +261,8 @@ class DfuApp:
             )
             dfu.parse_zip()
 
-            # 2. Jump to Bootloader
-            await dfu.jump_to_bootloader(device)
-
-            self.log("Waiting for reboot (5s)...")
-            await asyncio.sleep(5.0)
-
-            # 3. Find Bootloader
-            self.log("Scanning for Bootloader...")
-            bootloader_device = None
-
-            # A. Try searching for DFU Service UUID
-            try:
-                bootloader_device = await dfu_lib.find_device_by_name_or_address(
-                    "DFU",
-                    force_scan=force_scan,
-                    service_uuid=DFU_SERVICE_UUID
-                )
-            except Exception:
-                pass
-
-            # B. Try MAC Address Hint (Increment last byte)
-            if not bootloader_device:
-                original_mac = device.address
-                if ":" in original_mac and len(original_mac) == 17:
-                    try:
-                        prefix = original_mac[:-2]
-                        last_byte = int(original_mac[-2:], 16)
-                        last_byte = (last_byte + 1) & 0xFF
-                        bootloader_mac_hint = f"{prefix}{last_byte:02X}"
-                        self.log(f"Trying Address Hint: {bootloader_mac_hint}")
-                        bootloader_device = await dfu_lib.find_device_by_name_or_address(
-                            bootloader_mac_hint,
-                            force_scan=force_scan
-                        )
-                    except: pass
-
-            if not bootloader_device:
-                raise Exception("Could not locate Bootloader device. Try putting device in DFU mode manually.")
-
-            # 4. Perform Update
-            await dfu.perform_update(bootloader_device)
+            # 2. Jump to Bootloader, wait for it to advertise and perform the update
+            await dfu.update_device(device)
             self.log("SUCCESS! Firmware Updated.")
             messagebox.showinfo("Success", "Firmware updated successfully!")
 
@@ -1,20 +1,35 @@
 # --- START OF FILE dfu_lib.py ---
 import asyncio
+import base64
+import fnmatch
+import hashlib
 import logging
+import re
 import struct
+import sys
 import zipfile
 import json
+import mmap
 import os
+import time
+import threading
+import tracemalloc
 import warnings
-from typing import Optional, Callable, List
+from collections import deque, OrderedDict
+from typing import Optional, Callable, List, Dict, Any, Union, Tuple
 
 from bleak import BleakScanner, BleakClient, BleakError
 from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+
+import hci_link
 
 # --- UUID Constants ---
 DFU_SERVICE_UUID = "00001530-1212-efde-1523-785feabcd123"
 DFU_CONTROL_POINT_UUID = "00001531-1212-efde-1523-785feabcd123"
 DFU_PACKET_UUID = "00001532-1212-efde-1523-785feabcd123"
+DIS_FIRMWARE_REVISION_UUID = "00002a26-0000-1000-8000-00805f9b34fb"
+DIS_SOFTWARE_REVISION_UUID = "00002a28-0000-1000-8000-00805f9b34fb"
 
 # --- Op Codes ---
 OP_CODE_START_DFU = 0x01
@@ -29,43 +44,616 @@ OP_CODE_PACKET_RECEIPT_NOTIF = 0x11
 OP_CODE_ENTER_BOOTLOADER = 0x01
 UPLOAD_MODE_APPLICATION = 0x04
 
+# --- Link Parameters Requested For Uploads ---
+LINK_PHY = "2M"
+LINK_DATA_LENGTH = 251     # Link-layer payload octets (data length extension)
+LINK_INTERVAL_MS = 7.5     # Shortest connection interval the spec allows
+L2CAP_ATT_OVERHEAD = 7     # L2CAP header (4) + ATT write command header (3)
+
+# --- Wire Formats ---
+RESPONSE_FORMAT = struct.Struct('<BBB')          # 0x10, request op code, status
+PRN_NOTIFICATION_FORMAT = struct.Struct('<BI')   # 0x11, bytes received
+IMAGE_SIZES_FORMAT = struct.Struct('<III')       # SoftDevice, bootloader, application
+PRN_REQUEST_FORMAT = struct.Struct('<BH')        # 0x08, packets per notification
+
 logger = logging.getLogger("DFU_LIB")
 
 class DfuException(Exception):
     pass
 
+class FirmwareCurrent(DfuException):
+    """The device already runs the package's version; raised instead of jumping to the bootloader."""
+    pass
+
+# "v1.9.0", "1.9.0-abc1234", "v1.9.0 (Build: abc1234)": dotted version, optional commit id
+VERSION_PATTERN = re.compile(r'(?<![\d.])v?(\d+(?:\.\d+)+)(?:[-_+ ]+\(?(?:build:?\s*)?([0-9a-f]{7,40})\b)?', re.I)
+
+def parse_version(text: Optional[str]) -> Optional[Tuple[Tuple[int, ...], Optional[str]]]:
+    """
+    (numbers padded to three, commit id or None) from a revision string or file name.
+
+    Package names can carry a hardware revision before the release, as in
+    "t1000e_v2.0_repeater-v1.9.0.zip" -> (1, 9, 0): the "-v<version>" release suffix is
+    used, else the last version in the string.
+    """
+    text = text or ""
+    matches = list(VERSION_PATTERN.finditer(text))
+    if not matches:
+        return None
+    suffixed = [m for m in matches if text[m.start():m.start() + 1] in "vV" and text[m.start() - 1:m.start()] == "-"]
+    match = (suffixed or matches)[-1]
+    numbers = tuple(int(n) for n in match.group(1).split("."))
+    numbers += (0,) * (3 - len(numbers))
+    return numbers, match.group(2).lower() if match.group(2) else None
+
+def versions_match(installed: Optional[str], packaged: Optional[str]) -> bool:
+    """Same version number, and the same commit when both strings carry one."""
+    a, b = parse_version(installed), parse_version(packaged)
+    if a is None or b is None or a[0] != b[0]:
+        return False
+    return a[1] is None or b[1] is None or a[1].startswith(b[1]) or b[1].startswith(a[1])
+
+class PrnWindowController:
+    """
+    Decides how many packets may run ahead of the bytes the bootloader has acknowledged.
+
+    The bootloader only accepts the PRN interval once per session, so instead of changing
+    PRN we change the window: in adaptive mode it grows by one packet for every PRN that
+    comes back without the round trip inflating, shrinks by one when queueing delay builds
+    up and halves on a PRN timeout. It never drops below PRN packets, otherwise the
+    notification we wait for would never be triggered.
+    """
+    def __init__(self, prn: int, adaptive: bool = False, max_window: int = None):
+        self.prn = prn
+        self.adaptive = adaptive
+        self.min_window = max(1, prn)
+        self.max_window = max(self.min_window, max_window or prn * 4)
+        self.window = self.min_window
+        self.srtt = None
+        self.rttvar = None
+        self.acks = 0
+        self.timeouts = 0
+
+    @property
+    def timeout(self) -> float:
+        """PRN wait timeout; the historic PRN * 65 ms guess until round trips have been measured."""
+        if not self.adaptive or self.srtt is None:
+            return max(1.0, self.prn * 0.065 * self.window / self.min_window)
+        return min(5.0, max(0.25, self.srtt + 4 * self.rttvar))
+
+    def on_ack(self, rtt: float):
+        self.acks += 1
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        if not self.adaptive:
+            return
+        if rtt > self.srtt + 2 * self.rttvar:
+            self.window = max(self.min_window, self.window - 1)
+        elif self.window < self.max_window:
+            self.window += 1
+
+    def on_timeout(self):
+        self.timeouts += 1
+        if self.adaptive:
+            self.window = max(self.min_window, self.window // 2)
+
+class PacketPipeline:
+    """
+    Issues write-without-response calls in order while keeping up to `limit` of them in flight,
+    so packets stop paying one bleak/D-Bus round trip each. Backends that flow-control these
+    writes (CoreBluetooth waits for canSendWriteWithoutResponse, the simulator for TX queue
+    space) block inside the call; the limit bounds how many writes may be parked there.
+    A limit of 1 awaits every write, as before.
+    """
+    def __init__(self, client, uuid: str, limit: int = 1):
+        self.client = client
+        self.uuid = uuid
+        self.limit = max(1, limit)
+        self.in_flight = deque()
+        self.peak = 0
+
+    async def write(self, data, limit: int = None):
+        limit = max(1, min(self.limit, limit or self.limit))
+        if self.limit == 1:
+            await self.client.write_gatt_char(self.uuid, data, response=False)
+            return
+        # Tasks start in creation order, so the backend sees the packets in order
+        self.in_flight.append(asyncio.ensure_future(self.client.write_gatt_char(self.uuid, data, response=False)))
+        self.peak = max(self.peak, len(self.in_flight))
+        while self.in_flight and (len(self.in_flight) >= limit or self.in_flight[0].done()):
+            await self.in_flight.popleft()
+
+    async def drain(self):
+        while self.in_flight:
+            await self.in_flight.popleft()
+
+    def cancel(self):
+        while self.in_flight:
+            task = self.in_flight.popleft()
+            if task.done():
+                task.exception()  # Retrieved, so a failed write is not reported again at shutdown
+            else:
+                task.cancel()
+
+class SessionTimer:
+    """
+    Monotonic timeline of one update session: a span per phase and attempt, upload bytes/s
+    over sliding windows, PRN wait totals and the cause of every failed attempt.
+    record() turns it into the structured record emitted once per session.
+    """
+    def __init__(self, address: str = None, image_bytes: int = 0, window: float = 2.0):
+        self.address = address
+        self.image_bytes = image_bytes
+        self.window = window
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.spans = []       # [phase, attempt, start, end]
+        self.throughput = []  # [offset, bytes/s] per window while streaming
+        self.retries = []
+        self.prn_waits = 0
+        self.prn_wait_time = 0.0
+        self.prn_timeouts = 0
+        self._window_start = None
+        self._window_bytes = 0
+
+    @property
+    def current(self) -> Optional[str]:
+        return self.spans[-1][0] if self.spans else None
+
+    def phase(self, phase: str, attempt: int = None):
+        now = time.monotonic()
+        if self.spans and self.spans[-1][3] is None:
+            self.spans[-1][3] = now
+        self.spans.append([phase, attempt, now, None])
+
+    def stream_started(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    def sample(self, bytes_sent: int, final: bool = False):
+        if self._window_start is None:
+            return
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self.window or (final and elapsed > 0):
+            self.throughput.append([round(now - self.start, 3), int((bytes_sent - self._window_bytes) / elapsed)])
+            self._window_start, self._window_bytes = now, bytes_sent
+        if final:
+            self._window_start = None
+
+    def prn_wait(self, seconds: float, timed_out: bool):
+        self.prn_waits += 1
+        self.prn_wait_time += seconds
+        if timed_out:
+            self.prn_timeouts += 1
+
+    def retry(self, attempt: int, error: Exception):
+        self.retries.append({"attempt": attempt, "phase": self.current, "at": round(time.monotonic() - self.start, 3),
+                             "cause": f"{type(error).__name__}: {error}"})
+
+    def record(self, ok: bool, error: str = None, stream: Dict[str, Any] = None) -> Dict[str, Any]:
+        end = time.monotonic()
+        phases = []
+        totals: Dict[str, float] = {}
+        for phase, attempt, start, stop in self.spans:
+            duration = (stop or end) - start
+            phases.append({"phase": phase, "attempt": attempt, "start": round(start - self.start, 3),
+                           "duration": round(duration, 3)})
+            totals[phase] = totals.get(phase, 0.0) + duration
+        rates = [bps for _, bps in self.throughput]
+        return {
+            "address": self.address, "image_bytes": self.image_bytes, "ok": ok, "error": error,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duration": round(end - self.start, 3),
+            "attempts": max((attempt for _, attempt, _, _ in self.spans if attempt), default=0),
+            "phases": phases,
+            "phase_totals": {phase: round(total, 3) for phase, total in totals.items()},
+            "throughput": {"window": self.window, "samples": self.throughput,
+                           "peak": max(rates, default=0), "low": min(rates, default=0),
+                           "avg": (stream or {}).get("bps", 0)},
+            "prn": {"waits": self.prn_waits, "wait_time": round(self.prn_wait_time, 3), "timeouts": self.prn_timeouts},
+            "retries": self.retries,
+            "stream": stream or {},
+        }
+
+class ResponseDispatcher:
+    """
+    Routes control point notifications without assuming they arrive in order.
+
+    Every awaited op code gets its own future, resolved straight from the notification
+    callback. A response nobody waits for yet is parked per op code until asked for, so a
+    late or duplicate one can no longer be taken as the answer to another command.
+    PRN notifications only advance the bytes-received counter and wake the upload loop.
+    """
+    def __init__(self):
+        self.prn_event = asyncio.Event()
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._parked: Dict[int, int] = {}
+        self.reset()
+
+    def reset(self):
+        """Forgets parked responses and receipts; called for every new connection."""
+        for future in self._waiters.values():
+            future.cancel()
+        self._waiters.clear()
+        self._parked.clear()
+        self.reset_receipts()
+
+    def reset_receipts(self):
+        self.bytes_received = 0
+        self.prn_count = 0
+        self.last_prn_time = 0.0
+        self.prn_event.clear()
+
+    def feed(self, data) -> int:
+        """Handles one notification. Returns its op code."""
+        opcode = data[0]
+        if opcode == OP_CODE_PACKET_RECEIPT_NOTIF:
+            if len(data) >= PRN_NOTIFICATION_FORMAT.size:
+                received = PRN_NOTIFICATION_FORMAT.unpack_from(data)[1]
+                if received > self.bytes_received:
+                    self.bytes_received = received
+            self.prn_count += 1
+            self.last_prn_time = time.monotonic()
+            self.prn_event.set()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"<< RX PRN: {self.bytes_received}")
+
+        elif opcode == OP_CODE_RESPONSE_CODE and len(data) >= RESPONSE_FORMAT.size:
+            _, request_op, status = RESPONSE_FORMAT.unpack_from(data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"<< RX Resp: Op={request_op:#02x} Status={status}")
+            future = self._waiters.get(request_op)
+            if future is not None and not future.done():
+                future.set_result(status)
+            else:
+                self._parked[request_op] = status
+        return opcode
+
+    async def wait(self, opcode: int, timeout: float) -> int:
+        """Status of the response to `opcode`. Raises asyncio.TimeoutError."""
+        if opcode in self._parked:
+            return self._parked.pop(opcode)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[opcode] = future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if self._waiters.get(opcode) is future:
+                del self._waiters[opcode]
+
+    def fail(self, error: Exception):
+        """Fails every pending wait at once, e.g. when the link drops."""
+        for future in self._waiters.values():
+            if not future.done():
+                future.set_exception(error)
+
+def package_members(z: zipfile.ZipFile, log: Callable[[str], None] = logger.info):
+    """Returns (manifest, bin member, dat member) of an application DFU package."""
+    files = z.namelist()
+    if 'manifest.json' in files:
+        with z.open('manifest.json') as f:
+            manifest = json.load(f)
+
+        if 'manifest' in manifest and 'application' in manifest['manifest']:
+            app_info = manifest['manifest']['application']
+            return manifest, app_info['bin_file'], app_info['dat_file']
+        raise DfuException("Zip must contain an Application firmware manifest.")
+
+    log("No manifest.json. Attempting legacy compatibility mode.")
+    bin_file = next((f for f in files if f.endswith('.bin') and 'application' in f.lower()), None)
+    dat_file = next((f for f in files if f.endswith('.dat') and 'application' in f.lower()), None)
+    if bin_file and dat_file:
+        return None, bin_file, dat_file
+    raise DfuException("Could not auto-detect firmware files in ZIP.")
+
+def extract_image(z: zipfile.ZipFile, name: str, extract_dir: str, file_name: str = None) -> str:
+    """
+    Extracts a zip member once into extract_dir as an uncompressed copy and returns its path.
+    By default the file name carries the member's CRC and size, so a changed package never
+    reuses a stale copy.
+    """
+    info = z.getinfo(name)
+    if not file_name:
+        base = os.path.splitext(os.path.basename(name))[0]
+        file_name = f"{base}-{info.CRC:08x}-{info.file_size}.bin"
+    path = os.path.join(extract_dir, file_name)
+    if os.path.exists(path) and os.path.getsize(path) == info.file_size:
+        return path
+
+    os.makedirs(extract_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with z.open(info) as src, open(tmp_path, 'wb') as dst:
+        while True:
+            block = src.read(64 * 1024)
+            if not block:
+                break
+            dst.write(block)
+    os.replace(tmp_path, path)
+    return path
+
+def map_image(path: str):
+    """Memory-maps a file read-only. Returns (mmap, memoryview over it)."""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, memoryview(mapped)
+
+class FirmwarePackage:
+    """A parsed firmware package: manifest, init packet and a (usually mmap-backed) image view."""
+    def __init__(self, path: str, sha256: str, mtime: float, manifest, dat_data: bytes,
+                 bin_data: memoryview, bin_map: Optional[mmap.mmap] = None):
+        self.path = path
+        self.sha256 = sha256
+        self.mtime = mtime
+        self.manifest = manifest
+        self.dat_data = dat_data
+        self.bin_data = bin_data
+        self.bin_map = bin_map
+
+    def close(self):
+        self.bin_data.release()
+        if self.bin_map is not None:
+            try:
+                self.bin_map.close()
+            except BufferError:
+                pass  # Still streamed by a session; the GC closes the map once it is done
+
+class FirmwareCache:
+    """
+    Parses each firmware package once.
+
+    Packages are keyed by the zip's SHA-256 plus mtime and kept in a bounded LRU. The decoded
+    image is stored uncompressed as <sha256>.bin next to a <sha256>.json sidecar holding the
+    manifest and init packet, so after a restart a package is mapped without decompression.
+    The directory is bounded like the LRU: an evicted package's files are deleted, and prune()
+    (run after warm()) drops files whose source zip is gone and the least recently used ones
+    beyond max_entries.
+    """
+    def __init__(self, cache_dir: str, max_entries: int = 8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, FirmwarePackage]" = OrderedDict()
+        self._digests = {}  # (path, mtime_ns, size) -> sha256, avoids re-hashing unchanged files
+        self._lock = threading.Lock()  # warm() runs in a worker thread while sessions read
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, path: str, st: os.stat_result) -> str:
+        key = (path, st.st_mtime_ns, st.st_size)
+        sha = self._digests.get(key)
+        if sha is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(64 * 1024), b""):
+                    h.update(block)
+            sha = h.hexdigest()
+            self._digests[key] = sha
+        return sha
+
+    def digest(self, zip_path: str) -> str:
+        """SHA-256 of a package, hashed once per (path, mtime, size)."""
+        path = os.path.realpath(zip_path)
+        with self._lock:
+            return self._digest(path, os.stat(path))
+
+    def get(self, zip_path: str) -> FirmwarePackage:
+        with self._lock:
+            return self._get(zip_path)
+
+    def _get(self, zip_path: str) -> FirmwarePackage:
+        path = os.path.realpath(zip_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {zip_path}")
+        st = os.stat(path)
+        sha = self._digest(path, st)
+        key = (sha, st.st_mtime)
+
+        package = self.entries.get(key)
+        if package is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return package
+
+        self.misses += 1
+        package = self._load_sidecar(path, sha, st.st_mtime) or self._parse(path, sha, st.st_mtime)
+        self.entries[key] = package
+        while len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            evicted.close()
+            if all(p.sha256 != evicted.sha256 for p in self.entries.values()):
+                self._remove_files(evicted.sha256)
+        return package
+
+    def warm(self, paths) -> int:
+        """Parses every package in paths ahead of time. Returns how many are ready."""
+        ready = 0
+        for path in set(paths):
+            try:
+                self.get(path)
+                ready += 1
+            except Exception as e:
+                logger.error(f"Firmware cache: could not prepare {path}: {e}")
+        removed = self.prune()
+        if removed:
+            logger.info(f"Firmware cache: removed {removed} stale image(s)")
+        return ready
+
+    def _remove_files(self, sha: str):
+        for suffix in (".json", ".bin"):
+            try:
+                os.remove(os.path.join(self.cache_dir, sha + suffix))
+            except OSError:
+                pass
+
+    def prune(self) -> int:
+        """Deletes cached images outside the LRU that are orphaned or beyond max_entries. Returns how many."""
+        with self._lock:
+            live = {p.sha256 for p in self.entries.values()}
+            try:
+                names = set(os.listdir(self.cache_dir))
+            except OSError:
+                return 0
+            removed = 0
+            kept = []  # (last use, sha) of images whose source zip still exists
+            for name in names:
+                sha, ext = os.path.splitext(name)
+                if sha in live or ext not in (".json", ".bin"):
+                    continue
+                if ext == ".bin":
+                    if sha + ".json" not in names:  # Interrupted parse
+                        self._remove_files(sha)
+                        removed += 1
+                    continue
+                sidecar = os.path.join(self.cache_dir, name)
+                try:
+                    with open(sidecar, 'r') as f:
+                        source = json.load(f).get("source")
+                    used = os.path.getmtime(sidecar)
+                except (OSError, ValueError, AttributeError):
+                    source, used = None, 0.0
+                if source and os.path.exists(source):
+                    kept.append((used, sha))
+                else:
+                    self._remove_files(sha)
+                    removed += 1
+            kept.sort(reverse=True)
+            for _, sha in kept[max(0, self.max_entries - len(live)):]:
+                self._remove_files(sha)
+                removed += 1
+            return removed
+
+    def _map(self, bin_path: str):
+        try:
+            return map_image(bin_path)
+        except (OSError, ValueError):
+            with open(bin_path, 'rb') as f:
+                return None, memoryview(f.read())
+
+    def _load_sidecar(self, path: str, sha: str, mtime: float) -> Optional[FirmwarePackage]:
+        sidecar = os.path.join(self.cache_dir, f"{sha}.json")
+        bin_path = os.path.join(self.cache_dir, f"{sha}.bin")
+        try:
+            with open(sidecar, 'r') as f:
+                meta = json.load(f)
+            if os.path.getsize(bin_path) != meta["bin_size"]:
+                return None
+            dat_data = base64.b64decode(meta["dat"])
+        except (OSError, ValueError, KeyError):
+            return None
+        bin_map, bin_data = self._map(bin_path)
+        try:
+            os.utime(sidecar)  # Last use, for prune()
+        except OSError:
+            pass
+        return FirmwarePackage(path, sha, mtime, meta.get("manifest"), dat_data, bin_data, bin_map)
+
+    def _parse(self, path: str, sha: str, mtime: float) -> FirmwarePackage:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with zipfile.ZipFile(path, 'r') as z:
+            manifest, bin_name, dat_name = package_members(z)
+            dat_data = z.read(dat_name)
+            bin_path = extract_image(z, bin_name, self.cache_dir, file_name=f"{sha}.bin")
+
+        meta = {"sha256": sha, "source": path, "mtime": mtime, "manifest": manifest,
+                "dat": base64.b64encode(dat_data).decode(), "bin_size": os.path.getsize(bin_path)}
+        sidecar = os.path.join(self.cache_dir, f"{sha}.json")
+        with open(sidecar + ".tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(sidecar + ".tmp", sidecar)
+
+        bin_map, bin_data = self._map(bin_path)
+        logger.info(f"Firmware cache: parsed {os.path.basename(path)} ({len(bin_data)} bytes)")
+        return FirmwarePackage(path, sha, mtime, manifest, dat_data, bin_data, bin_map)
+
 class NordicLegacyDFU:
     def __init__(self, zip_path: str, prn: int, packet_delay: float, adapter: str = None,
                  progress_callback: Callable[[int], None] = None,
-                 log_callback: Callable[[str], None] = None):
+                 log_callback: Callable[[str], None] = None,
+                 event_callback: Callable[[Dict[str, Any]], None] = None,
+                 adaptive_prn: bool = False, extract_dir: str = None,
+                 cache: Optional[FirmwareCache] = None, max_chunk: int = 244,
+                 client_factory: Callable[..., BleakClient] = None, tune_link: bool = True,
+                 max_inflight: int = 1, skip_if_current: bool = False):
         self.zip_path = zip_path
         self.prn = prn
         self.packet_delay = packet_delay
         self.adapter = adapter
         self.progress_callback = progress_callback
         self.log_callback = log_callback
+        self.event_callback = event_callback
+        self.adaptive_prn = adaptive_prn
+        self.extract_dir = extract_dir
+        self.cache = cache
+        self.max_chunk = max_chunk
+        self.client_factory = client_factory or BleakClient  # dfu_sim.SimWorld.client in benchmarks
+        self.tune_link = tune_link
+        self.max_inflight = max_inflight  # Packet writes kept in flight while streaming; 1 awaits each
+        self.skip_if_current = skip_if_current  # Compare the DIS revision with the package before jumping
+        self.installed_version: Optional[str] = None
 
         self.manifest = None
-        self.bin_data = None
+        self.bin_data: Optional[memoryview] = None
         self.dat_data = None
+        self._bin_map: Optional[mmap.mmap] = None
+        # Allocation counters: bytes copied out of the package vs. zero-copy chunk views handed out
+        self.mem_stats = {"image_bytes": 0, "mapped": False, "copied_bytes": 0, "copies": 0,
+                          "chunk_views": 0, "traced_peak": None}
         self.client: Optional[BleakClient] = None
 
-        self.response_queue = asyncio.Queue()
-        self.pkg_receipt_event = asyncio.Event()
+        self.responses = ResponseDispatcher()
         self.bytes_sent = 0
+        self.packets_sent = 0
         self.reset_in_progress = False
+        self.stream_stats: Dict[str, Any] = {}
+        self.link_params: Dict[str, Any] = {}
+        self.timer: Optional[SessionTimer] = None
+        self.session_record: Optional[Dict[str, Any]] = None
 
     def _log(self, msg: str, level=logging.INFO):
-        """Internal helper to route logs to both logger and callback."""
-        if level == logging.ERROR:
-            logger.error(msg)
-        elif level == logging.DEBUG:
-            logger.debug(msg)
-        else:
-            logger.info(msg)
+        """Internal helper to route logs to the logger, the callback and the event stream."""
+        logger.log(level, msg)
 
         if self.log_callback:
             self.log_callback(msg)
+        self._emit("log", level=logging.getLevelName(level), message=msg)
+
+    def _emit(self, event: str, **fields):
+        """Delivers a structured event (phase, progress, prn, error, log) to the event callback."""
+        if self.event_callback:
+            self.event_callback({"event": event, "ts": round(time.time(), 3), **fields})
+
+    def _phase(self, phase: str, **fields):
+        if self.timer:
+            self.timer.phase(phase, fields.get("attempt"))
+        self._emit("phase", phase=phase, **fields)
+
+    def _begin_session(self, address: str) -> bool:
+        """Starts the session timeline unless one is already running. Returns True if it did."""
+        if self.timer is not None:
+            return False
+        self.stream_stats = {}
+        self.timer = SessionTimer(address, len(self.bin_data) if self.bin_data is not None else 0)
+        return True
+
+    def _end_session(self, ok: bool, error: Exception = None, skipped: str = None):
+        """Closes the timeline and emits it as a single "session" record."""
+        timer, self.timer = self.timer, None
+        record = timer.record(ok, str(error) if error else None, self.stream_stats)
+        record["link"] = self.link_params
+        if skipped:
+            record["skipped"] = skipped
+        self.session_record = record
+        totals = record["phase_totals"]
+        if skipped:
+            self._log(f"Session skipped after {record['duration']:.1f}s: {skipped}")
+        else:
+            self._log(f"Session {'completed' if ok else 'failed'} in {record['duration']:.1f}s: "
+                      f"upload {totals.get('upload', 0):.1f}s, flash wait {totals.get('verify', 0):.1f}s, "
+                      f"PRN waits {record['prn']['wait_time']:.1f}s, {len(record['retries'])} retries")
+        self._emit("session", **record)
 
     async def _setup_mtu(self):
         if not self.client:
@@ -86,102 +674,261 @@ class NordicLegacyDFU:
                 mtu = 23
         return mtu
 
+    async def _negotiate_link(self, client, address: str, mtu: int) -> Dict[str, Any]:
+        """
+        Asks for LE 2M PHY, the longest data length and a 7.5 ms connection interval.
+
+        A backend offering request_phy / request_data_length / request_connection_interval
+        is used as is (the simulator does, and so can a test double); on BlueZ the requests
+        go over raw HCI. Values that could not be set or read back stay None and the link
+        keeps what BlueZ negotiated.
+        """
+        params = {"phy": None, "data_length": None, "interval_ms": None, "mtu": mtu, "via": None, "errors": []}
+        backend = getattr(client, "_backend", None)
+        requests = (("phy", "request_phy", (LINK_PHY,)),
+                    ("data_length", "request_data_length", (LINK_DATA_LENGTH,)),
+                    ("interval_ms", "request_connection_interval", (LINK_INTERVAL_MS, LINK_INTERVAL_MS)))
+        methods = {key: getattr(backend, name, None) or getattr(client, name, None) for key, name, _ in requests}
+
+        if any(methods.values()):
+            params["via"] = "backend"
+            for key, _, args in requests:
+                if methods[key] is None:
+                    continue
+                try:
+                    params[key] = await methods[key](*args)
+                except Exception as e:
+                    params["errors"].append(f"{key}: {e}")
+        elif sys.platform.startswith("linux"):
+            params["via"] = "hci"
+            try:
+                obtained = await asyncio.to_thread(hci_link.negotiate, self.adapter, address, LINK_PHY,
+                                                   LINK_DATA_LENGTH, LINK_INTERVAL_MS)
+                params.update(obtained, errors=params["errors"] + obtained["errors"])
+            except Exception as e:
+                params["errors"].append(str(e))
+
+        interval = f"{params['interval_ms']:g} ms" if params["interval_ms"] else "default"
+        self._log(f"Link: PHY {params['phy'] or 'default'}, interval {interval}, "
+                  f"data length {params['data_length'] or 'default'}, MTU {mtu} (via {params['via'] or 'none'})")
+        for error in params["errors"]:
+            self._log(f"Link parameter not applied: {error}", logging.DEBUG)
+        self._emit("link", **params)
+        return params
+
+    def _chunk_size(self, mtu: int) -> int:
+        """Largest write that fits the MTU and, with a known data length, fills whole link-layer packets."""
+        limit = max(20, min(mtu - 3, self.max_chunk))
+        data_length = self.link_params.get("data_length")
+        if not data_length:
+            return limit
+        packets = (limit + L2CAP_ATT_OVERHEAD) // data_length
+        return max(20, packets * data_length - L2CAP_ATT_OVERHEAD) if packets else limit
+
     def parse_zip(self):
+        if self.cache is not None:
+            package = self.cache.get(self.zip_path)
+            self.close()
+            self.manifest = package.manifest
+            self.dat_data = package.dat_data
+            # Own view of the shared image, so an LRU eviction never pulls it from under us
+            self.bin_data = memoryview(package.bin_data)
+            self.mem_stats["mapped"] = package.bin_map is not None
+            self.mem_stats["image_bytes"] = len(self.bin_data)
+            return
+
         if not os.path.exists(self.zip_path):
             raise FileNotFoundError(f"File not found: {self.zip_path}")
 
         with zipfile.ZipFile(self.zip_path, 'r') as z:
-            if 'manifest.json' in z.namelist():
-                with z.open('manifest.json') as f:
-                    self.manifest = json.load(f)
-
-                if 'manifest' in self.manifest and 'application' in self.manifest['manifest']:
-                    app_info = self.manifest['manifest']['application']
-                    self.bin_data = z.read(app_info['bin_file'])
-                    self.dat_data = z.read(app_info['dat_file'])
-                else:
-                    raise DfuException("Zip must contain an Application firmware manifest.")
-            else:
-                self._log("No manifest.json. Attempting legacy compatibility mode.")
-                files = z.namelist()
-                bin_file = next((f for f in files if f.endswith('.bin') and 'application' in f.lower()), None)
-                dat_file = next((f for f in files if f.endswith('.dat') and 'application' in f.lower()), None)
-
-                if bin_file and dat_file:
-                    self.bin_data = z.read(bin_file)
-                    self.dat_data = z.read(dat_file)
-                else:
-                    raise DfuException("Could not auto-detect firmware files in ZIP.")
-
-    async def _notification_handler(self, sender, data):
-        data = bytearray(data)
-        opcode = data[0]
+            self.manifest, bin_name, dat_name = package_members(z, log=self._log)
+            self._load_image(z, bin_name)
+            self.dat_data = self._read_member(z, dat_name)
+
+    def _read_member(self, z: zipfile.ZipFile, name: str) -> bytes:
+        data = z.read(name)
+        self.mem_stats["copied_bytes"] += len(data)
+        self.mem_stats["copies"] += 1
+        return data
+
+    def _load_image(self, z: zipfile.ZipFile, name: str):
+        """Holds the application image as a memoryview, mmap-backed when an extract dir is configured."""
+        self.close()
+        if self.extract_dir:
+            try:
+                self._bin_map, self.bin_data = map_image(extract_image(z, name, self.extract_dir))
+                self.mem_stats["mapped"] = True
+            except (OSError, ValueError) as e:
+                self._log(f"Could not map extracted image, reading into memory: {e}", logging.WARNING)
+        if self.bin_data is None:
+            self.bin_data = memoryview(self._read_member(z, name))
+            self.mem_stats["mapped"] = False
+        self.mem_stats["image_bytes"] = len(self.bin_data)
+
+    def package_version(self) -> Optional[str]:
+        """Version the package carries: a manifest version field, else the (resolved) file name."""
+        manifest = (self.manifest or {}).get("manifest", {})
+        for section in (manifest.get("application", {}), manifest):
+            for key in ("version", "firmware_version", "fw_version"):
+                if isinstance(section.get(key), str) and parse_version(section[key]):
+                    return section[key]
+        name = os.path.basename(os.path.realpath(self.zip_path))
+        return name if parse_version(name) else None
+
+    async def read_installed_version(self, client: BleakClient) -> Optional[str]:
+        """Firmware revision (else software revision) from the Device Information Service."""
+        for uuid in (DIS_FIRMWARE_REVISION_UUID, DIS_SOFTWARE_REVISION_UUID):
+            try:
+                value = await client.read_gatt_char(uuid)
+            except Exception:
+                continue  # Not exposed by this firmware
+            text = bytes(value).decode("utf-8", "replace").strip("\x00 \r\n")
+            if text:
+                return text
+        return None
+
+    def close(self):
+        """Releases the image view and its mapping."""
+        if self.bin_data is not None:
+            self.bin_data.release()
+            self.bin_data = None
+        if self._bin_map is not None:
+            try:
+                self._bin_map.close()
+            except BufferError:
+                pass  # A chunk view is still referenced somewhere; the GC closes the map later
+            self._bin_map = None
 
-        if opcode == OP_CODE_RESPONSE_CODE:
-            request_op = data[1]
-            status = data[2]
-            logger.debug(f"<< RX Resp: Op={request_op:#02x} Status={status}")
-            await self.response_queue.put((request_op, status))
+    def _notification_handler(self, sender, data):
+        # Plain callback: runs inline in bleak's notification dispatch, no task per PRN
+        if self.responses.feed(data) == OP_CODE_PACKET_RECEIPT_NOTIF and self.event_callback:
+            self._emit("prn", bytes_received=self.responses.bytes_received)
 
-        elif opcode == OP_CODE_PACKET_RECEIPT_NOTIF:
-            if len(data) >= 5:
-                bytes_received = struct.unpack('<I', data[1:5])[0]
-                logger.debug(f"<< RX PRN: {bytes_received}")
-            self.pkg_receipt_event.set()
+    def _on_disconnect(self, client):
+        if not self.reset_in_progress:
+            # Fail waits now instead of letting them run into their 30-60 s timeouts
+            self.responses.fail(BleakError("Disconnected from bootloader"))
 
     async def _wait_for_response(self, expected_op_code, timeout=30.0):
         try:
-            request_op, status = await asyncio.wait_for(self.response_queue.get(), timeout)
-            if request_op != expected_op_code:
-                return -1
-
+            status = await self.responses.wait(expected_op_code, timeout)
             if status != 1: # 1 = SUCCESS
                 self._log(f"<< RX Error: Command {expected_op_code:#02x} failed with status {status}", logging.ERROR)
+                self._emit("error", op=expected_op_code, status=status, reason="status")
                 return status
             return 1
         except asyncio.TimeoutError:
             self._log(f"Timeout ({timeout}s) waiting for response", logging.ERROR)
+            self._emit("error", op=expected_op_code, status=None, reason="timeout")
             return -1
 
-    async def jump_to_bootloader(self, device: BLEDevice):
+    async def jump_to_bootloader(self, device: BLEDevice, registry: "DeviceRegistry" = None,
+                                 deadline: float = 20.0,
+                                 is_claimed: Callable[[str], bool] = None) -> "BootloaderWaiter":
+        """
+        Tells the application to reboot into its bootloader. Returns a waiter that resolves as
+        soon as the bootloader advertises; `deadline` bounds the whole handoff from this call.
+        `is_claimed(address)` is True for bootloaders another session owns; they are never taken.
+        """
+        self._phase("jump", address=device.address)
+        start = time.monotonic()
+        owns_registry = registry is None
+        if owns_registry:
+            # Listen before the jump so the very first bootloader advertisement is caught
+            registry = DeviceRegistry(adapter=self.adapter)
+            await registry.start()
+        # Pending from the jump on, so concurrent handoffs on this registry stop matching by UUID
+        registry.handoffs[self] = {}
+
+        connected = sent = current = None
         self._log(f"Connecting to {device.name} ({device.address}) for Jump...")
         try:
-            async with BleakClient(device, adapter=self.adapter) as client:
+            async with self.client_factory(device, adapter=self.adapter) as client:
                 self.client = client
+                connected = time.monotonic()
                 await client.start_notify(DFU_CONTROL_POINT_UUID, self._notification_handler)
                 mtu = await self._setup_mtu()
                 self._log(f"Connected. MTU: {mtu}")
 
-                payload = bytearray([OP_CODE_ENTER_BOOTLOADER, UPLOAD_MODE_APPLICATION])
+                if self.skip_if_current:
+                    current = await self._check_installed(client)
 
-                logger.debug(f">> TX Jump: {payload.hex()}")
-                try:
-                    await client.write_gatt_char(DFU_CONTROL_POINT_UUID, payload, response=True)
-                except Exception:
-                    pass
-                self._log("Jump command sent.")
+                if not current:
+                    payload = bytearray([OP_CODE_ENTER_BOOTLOADER, UPLOAD_MODE_APPLICATION])
+
+                    logger.debug(f">> TX Jump: {payload.hex()}")
+                    try:
+                        await client.write_gatt_char(DFU_CONTROL_POINT_UUID, payload, response=True)
+                    except Exception:
+                        pass
+                    sent = time.monotonic()
+                    self._log("Jump command sent.")
         except Exception as e:
             self._log(f"Jump connection sequence ended: {e}")
+        except BaseException:
+            registry.handoffs.pop(self, None)  # Cancelled
+            raise
+
+        if current:
+            registry.handoffs.pop(self, None)
+            if owns_registry:
+                await registry.stop()
+            raise FirmwareCurrent(current)
+
+        ended = time.monotonic()
+        timings = {"jump_connect": round((connected or ended) - start, 3),
+                   "jump_write": round((sent or ended) - (connected or ended), 3)}
+        return BootloaderWaiter(self, device, registry, owns_registry, since=sent or ended,
+                                deadline=start + deadline, timings=timings, is_claimed=is_claimed)
+
+    async def _check_installed(self, client: BleakClient) -> Optional[str]:
+        """Reason to skip the update when the running firmware already matches the package, else None."""
+        self.installed_version = await self.read_installed_version(client)
+        packaged = self.package_version()
+        self._log(f"Installed firmware: {self.installed_version or 'unknown'}, package: {packaged or 'unknown'}")
+        self._emit("version", installed=self.installed_version, package=packaged)
+        if versions_match(self.installed_version, packaged):
+            return f"already running {self.installed_version}"
+        return None
 
     async def perform_update(self, device: BLEDevice, max_retries: int = 3):
+        owns_session = self._begin_session(device.address)
+        try:
+            await self._perform_attempts(device, max_retries)
+        except Exception as e:
+            if owns_session:
+                self._end_session(False, e)
+            raise
+        if owns_session:
+            self._end_session(True)
+
+    async def _perform_attempts(self, device: BLEDevice, max_retries: int):
         self._log(f"Target Bootloader: {device.address}")
         self.reset_in_progress = False
 
         for attempt in range(max_retries):
             self._log(f"DFU connection attempt {attempt+1}/{max_retries}...")
+            self._phase("connect", attempt=attempt + 1, address=device.address)
 
             try:
-                async with BleakClient(device, timeout=20.0, adapter=self.adapter) as client:
+                self.responses.reset()
+                async with self.client_factory(device, timeout=20.0, adapter=self.adapter,
+                                               disconnected_callback=self._on_disconnect) as client:
                     self.client = client
+                    # BlueZ resolves services while connecting; this covers subscription and MTU exchange
+                    self._phase("discover", attempt=attempt + 1)
 
                     await client.start_notify(DFU_CONTROL_POINT_UUID, self._notification_handler)
 
                     mtu = await self._setup_mtu()
                     self._log(f"Connected to Bootloader. MTU: {mtu}")
-
-                    while not self.response_queue.empty(): self.response_queue.get_nowait()
+                    self.link_params = {}
+                    if self.tune_link:
+                        self._phase("link_setup", attempt=attempt + 1)
+                        self.link_params = await self._negotiate_link(client, device.address, mtu)
 
                     # Start DFU
+                    self._phase("start_dfu", attempt=attempt + 1)
                     start_payload = bytearray([OP_CODE_START_DFU, UPLOAD_MODE_APPLICATION])
                     await client.write_gatt_char(DFU_CONTROL_POINT_UUID, start_payload, response=True)
 
@@ -191,7 +938,7 @@ class NordicLegacyDFU:
                     sd_size = 0
                     bl_size = 0
                     app_size = len(self.bin_data)
-                    size_payload = struct.pack('<III', sd_size, bl_size, app_size)
+                    size_payload = IMAGE_SIZES_FORMAT.pack(sd_size, bl_size, app_size)
 
                     self._log(f"Sending Size: {app_size} bytes")
                     await client.write_gatt_char(DFU_PACKET_UUID, size_payload, response=False)
@@ -202,6 +949,7 @@ class NordicLegacyDFU:
                         raise DfuException("Start DFU sequence failed")
 
                     # Init Packet
+                    self._phase("init_packet", attempt=attempt + 1)
                     self._log("Sending Init Packet...")
                     await client.write_gatt_char(DFU_CONTROL_POINT_UUID, bytearray([OP_CODE_INIT_DFU_PARAMS, 0x00]), response=True)
                     await client.write_gatt_char(DFU_PACKET_UUID, self.dat_data, response=False)
@@ -212,146 +960,591 @@ class NordicLegacyDFU:
 
                     # PRN
                     if self.prn > 0:
+                        self._phase("prn_config", attempt=attempt + 1, prn=self.prn)
                         self._log(f"Configuring PRN: {self.prn}")
-                        prn_payload = bytearray([OP_CODE_PACKET_RECEIPT_NOTIF_REQ]) + struct.pack('<H', self.prn)
+                        prn_payload = PRN_REQUEST_FORMAT.pack(OP_CODE_PACKET_RECEIPT_NOTIF_REQ, self.prn)
                         await client.write_gatt_char(DFU_CONTROL_POINT_UUID, prn_payload, response=True)
 
                     # Stream
+                    self._phase("upload", attempt=attempt + 1)
                     self._log("Requesting Upload...")
                     await client.write_gatt_char(DFU_CONTROL_POINT_UUID, bytearray([OP_CODE_RECEIVE_FIRMWARE_IMAGE]), response=True)
                     await self._stream_firmware()
 
                     # Validate
+                    self._phase("verify", attempt=attempt + 1)
                     self._log("Verifying Upload...")
                     flash_write_timeout = max(60.0, len(self.bin_data) / 50000) # Longer timeout for flash write completion - ~1s per 50KB
                     status = await self._wait_for_response(OP_CODE_RECEIVE_FIRMWARE_IMAGE, timeout=flash_write_timeout)
                     if status != 1: raise DfuException(f"Upload failed. Status: {status}")
 
+                    self._phase("validate", attempt=attempt + 1)
                     self._log("Validating...")
                     await client.write_gatt_char(DFU_CONTROL_POINT_UUID, bytearray([OP_CODE_VALIDATE]), response=True)
                     status = await self._wait_for_response(OP_CODE_VALIDATE)
                     if status != 1: raise DfuException(f"Validation failed. Status: {status}")
 
                     # Reset
+                    self._phase("activate", attempt=attempt + 1)
                     self._log("Activating & Resetting...")
                     self.reset_in_progress = True
                     await client.write_gatt_char(DFU_CONTROL_POINT_UUID, bytearray([OP_CODE_ACTIVATE_AND_RESET]), response=True)
                     self._log("DFU Complete.")
+                    self._phase("complete", attempt=attempt + 1)
                     return # SUCCESS
 
             except Exception as e:
                 if self.reset_in_progress:
                     self._log(f"Device disconnected during reset. Update Successful.")
+                    self._phase("complete", attempt=attempt + 1)
                     return
                 self._log(f"Attempt {attempt+1} failed: {e}", logging.ERROR)
+                self._emit("error", attempt=attempt + 1, reason="attempt_failed", message=str(e))
+                if self.timer:
+                    self.timer.retry(attempt + 1, e)
                 if attempt < max_retries - 1:
+                    self._phase("retry_wait", attempt=attempt + 1)
                     await asyncio.sleep(3.0)
                 else:
                     raise e
 
+    async def _wait_for_prn(self, ready: Callable[[], bool], timeout: float) -> bool:
+        """Waits until ready() holds, woken by PRN notifications. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while not ready():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.responses.prn_event.clear()
+            try:
+                await asyncio.wait_for(self.responses.prn_event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return ready()
+        return True
+
     async def _stream_firmware(self):
         # Suppress warning when reading MTU for chunk calculation
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", UserWarning)
             mtu = self.client.mtu_size if self.client else 23
-        chunk_size = min(mtu - 3, 244)  # ATT overhead, cap at 244
-        if chunk_size < 20: chunk_size = 20
-        prn_timeout = max(1.0, self.prn * 0.065) # Estimate timeout based on PRN
-        self._log(f"Using chunk_size = {chunk_size} and PRN timeout = {prn_timeout:.2f}s")
+        chunk_size = self._chunk_size(mtu)
+        controller = PrnWindowController(self.prn, adaptive=self.adaptive_prn)
+        mode = "adaptive" if controller.adaptive else "fixed"
+        self._log(f"Using chunk_size = {chunk_size} and PRN timeout = {controller.timeout:.2f}s ({mode} window)")
         total_bytes = len(self.bin_data)
-        packets_since_prn = 0
         self.bytes_sent = 0
+        self.packets_sent = 0
+        self.responses.reset_receipts()
+        start_time = time.monotonic()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        views_before = self.mem_stats["chunk_views"]
+        timer = self.timer
+        if timer:
+            timer.stream_started()
+
+        pipeline = PacketPipeline(self.client, DFU_PACKET_UUID, self.max_inflight)
 
         self._log(f"Uploading {total_bytes} bytes...")
+        try:
+            await self._stream_packets(pipeline, controller, chunk_size, total_bytes, start_time)
+        finally:
+            pipeline.cancel()
+
+        if timer:
+            timer.sample(self.bytes_sent, final=True)
+        elapsed = time.monotonic() - start_time
+        self.stream_stats = {"chunk_size": chunk_size, "window": controller.window, "prn_acks": controller.acks,
+                             "prn_timeouts": controller.timeouts, "seconds": round(elapsed, 3),
+                             "bps": int(self.bytes_sent / elapsed) if elapsed > 0 else 0,
+                             "pps": int(self.packets_sent / elapsed) if elapsed > 0 else 0,
+                             "inflight": pipeline.peak or 1}
+        self._log(f"Upload streamed: window {controller.window}, {controller.acks} PRN acks, "
+                  f"{controller.timeouts} timeouts, {self.stream_stats['pps']} packets/s")
+
+        if tracing:
+            self.mem_stats["traced_peak"] = tracemalloc.get_traced_memory()[1]
+        self._emit("memory", **self.mem_stats, session_chunk_views=self.mem_stats["chunk_views"] - views_before)
+
+    async def _stream_packets(self, pipeline: PacketPipeline, controller: PrnWindowController,
+                              chunk_size: int, total_bytes: int, start_time: float):
+        receipts = self.responses
+        timer = self.timer
+        packets_sent = 0
+        acked_floor = 0       # Bytes we stopped waiting for after a PRN timeout
+        prn_expected = 0      # Fixed mode: PRN notifications we should have seen by now
+        boundaries = deque()  # (bytes at PRN boundary, send time) for round-trip measurement
+        last_pct = -1
 
         for i in range(0, total_bytes, chunk_size):
-            chunk = self.bin_data[i : i + chunk_size]
-            await self.client.write_gatt_char(DFU_PACKET_UUID, chunk, response=False)
+            chunk = self.bin_data[i : i + chunk_size]  # memoryview slice, no copy
+            self.mem_stats["chunk_views"] += 1
+            # In flight never exceeds the packets the PRN window lets run ahead of the bootloader
+            await pipeline.write(chunk, controller.window if self.prn > 0 else None)
             self.bytes_sent += len(chunk)
-            packets_since_prn += 1
+            packets_sent += 1
+            if timer:
+                timer.sample(self.bytes_sent)
 
-            if i % 2000 == 0 or i == 0:
-                pct = int((self.bytes_sent / total_bytes) * 100)
+            if self.prn > 0 and packets_sent % self.prn == 0:
+                boundaries.append((self.bytes_sent, time.monotonic()))
+                prn_expected += 1
+
+            pct = (self.bytes_sent * 100) // total_bytes
+            if pct != last_pct:
+                last_pct = pct
                 if self.progress_callback:
                     self.progress_callback(pct)
+                elapsed = time.monotonic() - start_time
+                self._emit("progress", bytes_sent=self.bytes_sent, total=total_bytes, pct=pct,
+                           window=controller.window, bps=int(self.bytes_sent / elapsed) if elapsed > 0 else 0)
 
-            if self.prn > 0 and packets_since_prn >= self.prn:
-                self.pkg_receipt_event.clear()
-                try:
-                    await asyncio.wait_for(self.pkg_receipt_event.wait(), timeout=prn_timeout)
-                except asyncio.TimeoutError:
-                    self._log("PRN Timeout, continuing anyway...", logging.WARNING)
-                packets_since_prn = 0
+            if self.prn <= 0:
+                continue
+
+            if controller.adaptive:
+                window_bytes = controller.window * chunk_size
+                ready = lambda: self.bytes_sent - max(receipts.bytes_received, acked_floor) < window_bytes
+            else:
+                ready = lambda: receipts.prn_count >= prn_expected
+
+            if ready():
+                acked = True
+            else:
+                waited = time.monotonic()
+                acked = await self._wait_for_prn(ready, controller.timeout)
+                if timer:
+                    timer.prn_wait(time.monotonic() - waited, not acked)
+            if not acked:
+                controller.on_timeout()
+                self._log(f"PRN Timeout, continuing anyway (window {controller.window})...", logging.WARNING)
+                acked_floor = self.bytes_sent
+                receipts.prn_count = prn_expected
+                boundaries.clear()
+
+            # Round trip of the newest PRN boundary the bootloader has confirmed
+            confirmed = None
+            if controller.adaptive:
+                while boundaries and boundaries[0][0] <= receipts.bytes_received:
+                    confirmed = boundaries.popleft()
+            else:
+                while boundaries and len(boundaries) > prn_expected - receipts.prn_count:
+                    confirmed = boundaries.popleft()
+            if confirmed:
+                controller.on_ack(max(0.0, receipts.last_prn_time - confirmed[1]))
+
+        await pipeline.drain()
+        self.packets_sent = packets_sent
+
+        if last_pct != 100:
+            if self.progress_callback:
+                self.progress_callback(100)
+            elapsed = time.monotonic() - start_time
+            self._emit("progress", bytes_sent=self.bytes_sent, total=total_bytes, pct=100,
+                       window=controller.window, bps=int(self.bytes_sent / elapsed) if elapsed > 0 else 0)
+
+    async def update_device(self, app_device: BLEDevice, max_retries: int = 3,
+                            registry: "DeviceRegistry" = None, handoff_timeout: float = 20.0,
+                            is_claimed: Callable[[str], bool] = None):
+        """
+        Full buttonless update of a running application: jump, locate the bootloader, flash.
+        Shared by the CLI, the GUI and the drone service so all of them drive the same engine.
+        Returns False when skip_if_current found the package already installed, True once flashed.
+        `is_claimed` excludes bootloaders owned by concurrent sessions (see jump_to_bootloader).
+        """
+        if self.bin_data is None:
+            await asyncio.to_thread(self.parse_zip)  # A cold cache hashes and unpacks; keep the loop free
+
+        owns_session = self._begin_session(app_device.address)
+        try:
+            waiter = await self.jump_to_bootloader(app_device, registry=registry, deadline=handoff_timeout,
+                                                   is_claimed=is_claimed)
+            bootloader_device = await waiter.wait()
+            await self.perform_update(bootloader_device, max_retries=max_retries)
+        except FirmwareCurrent as e:
+            self._log(f"Update skipped: {e}")
+            if owns_session:
+                self._end_session(True, skipped=str(e))
+            return False
+        except Exception as e:
+            if owns_session:
+                self._end_session(False, e)
+            raise
+        if owns_session:
+            self._end_session(True)
+        return True
+
+def bootloader_address_hint(address: str) -> Optional[str]:
+    """Legacy bootloaders advertise on the application MAC with the last byte incremented."""
+    if ":" not in address or len(address) != 17:
+        return None
+    try:
+        last_byte = (int(address[-2:], 16) + 1) & 0xFF
+    except ValueError:
+        return None
+    return f"{address[:-2]}{last_byte:02X}"
+
+class BootloaderWaiter:
+    """
+    Pending bootloader handoff returned by jump_to_bootloader.
 
-        if self.progress_callback:
-            self.progress_callback(100)
+    Resolves on the first advertisement after the jump from the incremented application MAC,
+    within one overall deadline. That address always wins; any other DFU_SERVICE_UUID
+    advertiser is only taken while no other handoff is pending on the registry and no other
+    session claims it, so concurrent sessions cannot take each other's bootloader. Only
+    sightings by the session's own adapter count, so the connection stays on that adapter.
+    """
+    def __init__(self, dfu: NordicLegacyDFU, app_device: BLEDevice, registry: "DeviceRegistry",
+                 owns_registry: bool, since: float, deadline: float, timings: Dict[str, float],
+                 is_claimed: Callable[[str], bool] = None):
+        self.dfu = dfu
+        self.app_device = app_device
+        self.registry = registry
+        self.owns_registry = owns_registry
+        self.since = since
+        self.deadline = deadline
+        self.timings = timings
+        self.address_hint = bootloader_address_hint(app_device.address)
+        self.is_claimed = is_claimed
+        self.device: Optional[BLEDevice] = None
+        self._dfu_uuid = TargetMatcher([f"uuid:{DFU_SERVICE_UUID}"])
+
+    def _first_sighting(self, device: BLEDevice) -> Optional[float]:
+        """When the session's adapter first saw `device` after the jump, None if it has not yet."""
+        sightings = self.registry.handoffs.get(self.dfu) or {}
+        address = device.address.upper()
+        if self.dfu.adapter in self.registry.adapters:
+            return sightings.get((address, self.dfu.adapter))
+        return min((t for (a, _), t in sightings.items() if a == address), default=None)  # Default adapter
+
+    def _is_hint(self, device: BLEDevice, adv: Optional[AdvertisementData]) -> bool:
+        return device.address.upper() == self.address_hint and self._first_sighting(device) is not None
+
+    def _accepts(self, device: BLEDevice, adv: Optional[AdvertisementData]) -> bool:
+        address = device.address.upper()
+        if self._first_sighting(device) is None:
+            return False  # Not reported by this session's adapter (yet)
+        if address == self.address_hint:
+            return True
+        if any(owner is not self.dfu for owner in self.registry.handoffs):
+            return False  # Ambiguous while another session waits for its bootloader
+        if self.is_claimed is not None and self.is_claimed(address):
+            return False
+        return self._dfu_uuid(device, adv)
+
+    async def wait(self) -> BLEDevice:
+        dfu = self.dfu
+        dfu._phase("bootloader_scan", hint=self.address_hint)
+        dfu._log(f"Waiting for Bootloader (UUID or hint {self.address_hint})...")
+        try:
+            seen = self.registry.find(self._is_hint, since=self.since) if self.address_hint else None
+            if seen is None:
+                seen = await self.registry.wait_for(self._accepts, since=self.since,
+                                                    timeout=max(0.0, self.deadline - time.monotonic()))
+            first_seen = self._first_sighting(seen.device)
+        except DfuException:
+            raise DfuException("Could not locate DFU Bootloader device.")
+        finally:
+            self.registry.handoffs.pop(self.dfu, None)
+            if self.owns_registry:
+                await self.registry.stop()
+
+        self.device = seen.by_adapter[dfu.adapter] if dfu.adapter in self.registry.adapters else seen.device
+        self.timings["reboot"] = round(first_seen - self.since, 3)
+        board = self.app_device.name or self.app_device.address
+        dfu._log(f"Bootloader {seen.device.address} up {self.timings['reboot']:.2f}s after jump "
+                 f"(connect {self.timings['jump_connect']:.2f}s, jump {self.timings['jump_write']:.2f}s) [{board}]")
+        dfu._phase("bootloader_found", address=seen.device.address, board=board, **self.timings)
+        return self.device
 
 async def scan_for_devices(adapter: str = None) -> List[BLEDevice]:
     """Returns a list of all found devices (simple scan)."""
     scanner = BleakScanner(adapter=adapter)
     return await scanner.discover(timeout=5.0)
 
-async def find_device_by_name_or_address(name_or_address: str, force_scan: bool, adapter: str = None, service_uuid: str = None) -> BLEDevice:
+class TargetMatcher:
+    """
+    Precompiled target patterns, evaluated against an advertisement in a single pass.
+
+    Pattern syntax:
+        RAK4631_OTA         exact advertised name (plain patterns also match as an address)
+        RAK*_OTA            glob on the name (*, ?, [...])
+        re:^T1[0-9]+_DFU$   regular expression searched in the name
+        uuid:<uuid>         advertised service UUID
+        mfr:0x0059          manufacturer data company ID
+
+    Patterns map to a value (e.g. a mapping entry); a plain list maps each pattern to itself.
+    Exact names, addresses, UUIDs and company IDs are dict lookups; all glob and regex
+    patterns are folded into one alternation so the name is scanned once.
+    """
+    def __init__(self, patterns: Union[Dict[str, Any], List[str]]):
+        if not isinstance(patterns, dict):
+            patterns = {p: p for p in patterns}
+        self.names: Dict[str, Any] = {}
+        self.addresses: Dict[str, Any] = {}
+        self.uuids: Dict[str, Any] = {}
+        self.mfr_ids: Dict[int, Any] = {}
+        self._groups: Dict[str, Any] = {}
+        self._fallback = []  # Regexes that cannot live inside the alternation (inline flags, backrefs)
+        alternatives = []
+
+        for pattern, value in patterns.items():
+            if pattern.startswith("uuid:"):
+                self.uuids.setdefault(pattern[5:].lower(), value)
+            elif pattern.startswith("mfr:"):
+                self.mfr_ids.setdefault(int(pattern[4:], 0), value)
+            elif pattern.startswith("re:"):
+                regex = re.compile(pattern[3:])  # Invalid patterns raise re.error here
+                group = f"_tm{len(alternatives)}"
+                alternatives.append((group, f".*?(?:{pattern[3:]})", regex, value))
+            elif any(c in pattern for c in "*?["):
+                group = f"_tm{len(alternatives)}"
+                alternatives.append((group, fnmatch.translate(pattern), None, value))
+            else:
+                self.names.setdefault(pattern, value)
+                self.addresses.setdefault(pattern.upper(), value)
+
+        self._regex = None
+        parts = []
+        for group, source, regex, value in alternatives:
+            # Backreferences would point at the wrong group once wrapped in the alternation
+            if regex is not None and re.search(r"\\[1-9]|\(\?P=", regex.pattern):
+                self._fallback.append((regex, value))
+                continue
+            try:
+                re.compile(source)
+                parts.append(f"(?P<{group}>{source})")
+                self._groups[group] = value
+            except re.error:
+                self._fallback.append((regex, value))
+        if parts:
+            self._regex = re.compile("|".join(parts), re.DOTALL)
+
+    def __bool__(self):
+        return bool(self.names or self.uuids or self.mfr_ids or self._groups or self._fallback)
+
+    def match(self, device: BLEDevice, adv: Optional[AdvertisementData]) -> Optional[Any]:
+        """Value of the pattern matching this advertisement, or None."""
+        if self.addresses:
+            value = self.addresses.get(device.address.upper())
+            if value is not None:
+                return value
+
+        name = (adv.local_name if adv else None) or device.name
+        if name:
+            value = self.names.get(name)
+            if value is not None:
+                return value
+            if self._regex is not None:
+                m = self._regex.match(name)
+                if m:
+                    return self._groups[m.lastgroup]
+            for regex, value in self._fallback:
+                if regex.search(name):
+                    return value
+
+        if adv is not None:
+            if self.uuids:
+                for uuid in adv.service_uuids:
+                    value = self.uuids.get(uuid.lower())
+                    if value is not None:
+                        return value
+            if self.mfr_ids and adv.manufacturer_data:
+                for company_id in adv.manufacturer_data:
+                    value = self.mfr_ids.get(company_id)
+                    if value is not None:
+                        return value
+        return None
+
+    def __call__(self, device: BLEDevice, adv: Optional[AdvertisementData]) -> bool:
+        return self.match(device, adv) is not None
+
+class SeenDevice:
+    """Latest advertisement of a device in the registry, with the BLEDevice each adapter reported."""
+    def __init__(self, device: BLEDevice, adv: AdvertisementData, seen: float, adapter: str = None):
+        self.device = device
+        self.adv = adv
+        self.first_seen = seen
+        self.last_seen = seen
+        self.by_adapter: Dict[Optional[str], BLEDevice] = {adapter: device}
+        self.rssi: Optional[float] = getattr(adv, "rssi", None)  # EWMA over advertisements, dBm
+        self.rssi_samples = 0 if self.rssi is None else 1
+
+    def observe_rssi(self, rssi: Optional[int], alpha: float):
+        if rssi is None:
+            return
+        self.rssi = rssi if self.rssi is None else self.rssi + alpha * (rssi - self.rssi)
+        self.rssi_samples += 1
+
+    def for_adapter(self, adapter: Optional[str]) -> BLEDevice:
+        """BLEDevice to connect through `adapter` (BlueZ device objects are per adapter)."""
+        return self.by_adapter.get(adapter, self.device)
+
+class DeviceRegistry:
+    """
+    Shared view of advertising devices, fed by long-lived scanners' detection callbacks
+    (one per adapter when several are given).
+
+    Lookups check what has already been seen and otherwise wait for the next matching
+    advertisement, so they return after roughly one advertising interval instead of a
+    fixed scan window. pause()/resume() stop and restart one adapter's scanner, so a
+    single-radio controller gives its airtime to a DFU connection instead of scanning.
+    """
+    def __init__(self, adapter: str = None, max_age: float = 30.0, adapters: List[str] = None,
+                 scanner_factory: Callable[..., BleakScanner] = None, rssi_alpha: float = 0.3):
+        self.adapters = list(adapters) if adapters else [adapter]
+        self.scanner_factory = scanner_factory or BleakScanner
+        self.adapter = self.adapters[0]
+        self.max_age = max_age
+        self.rssi_alpha = rssi_alpha  # Weight of the newest advertisement in SeenDevice.rssi
+        self.devices: Dict[str, SeenDevice] = {}
+        self.scanners: Dict[Optional[str], BleakScanner] = {}
+        self.paused: set = set()  # Adapters whose scanner is stopped until resume()
+        self._scan_lock = asyncio.Lock()
+        self._waiters = []  # [(predicate, since, future)]
+        # Sessions waiting for their bootloader -> {(address, adapter): first sighting since the jump}
+        self.handoffs: Dict[Any, Dict[Tuple[str, Optional[str]], float]] = {}
+
+    async def start(self):
+        if self.scanners or self.paused:
+            return
+        for adapter in self.adapters:
+            await self._start_scanner(adapter)
+
+    async def _start_scanner(self, adapter: Optional[str]):
+        callback = lambda d, adv, adapter=adapter: self._on_detection(d, adv, adapter)
+        scanner = self.scanner_factory(detection_callback=callback, adapter=adapter)
+        await scanner.start()
+        self.scanners[adapter] = scanner
+
+    async def stop(self):
+        scanners, self.scanners = self.scanners, {}
+        self.paused.clear()
+        for scanner in scanners.values():
+            await scanner.stop()
+
+    async def pause(self, adapter: Optional[str]):
+        """Stops scanning on `adapter` until resume(); the other adapters keep scanning."""
+        async with self._scan_lock:
+            scanner = self.scanners.pop(adapter, None)
+            if scanner is None:
+                return  # Already paused, or the registry is stopped
+            self.paused.add(adapter)
+            await scanner.stop()
+
+    async def resume(self, adapter: Optional[str]):
+        """Restarts scanning on an adapter stopped by pause()."""
+        async with self._scan_lock:
+            if adapter not in self.paused:
+                return
+            self.paused.discard(adapter)
+            await self._start_scanner(adapter)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def _on_detection(self, device: BLEDevice, adv: AdvertisementData, adapter: str = None):
+        now = time.monotonic()
+        key = device.address.upper()
+        seen = self.devices.get(key)
+        if seen is None:
+            self.devices[key] = seen = SeenDevice(device, adv, now, adapter)
+        else:
+            seen.device, seen.adv, seen.last_seen = device, adv, now
+            seen.by_adapter[adapter] = device
+            seen.observe_rssi(getattr(adv, "rssi", None), self.rssi_alpha)
+        for sightings in self.handoffs.values():
+            sightings.setdefault((key, adapter), now)
+
+        for predicate, since, future in self._waiters:
+            if not future.done() and predicate(device, adv):
+                future.set_result(seen)
+
+    def fresh(self) -> List[SeenDevice]:
+        """Every device advertised within max_age, expired entries dropped."""
+        now = time.monotonic()
+        for key, seen in list(self.devices.items()):
+            if now - seen.last_seen > self.max_age:
+                del self.devices[key]
+        return list(self.devices.values())
+
+    def find(self, predicate: Callable[[BLEDevice, AdvertisementData], bool],
+             since: float = None) -> Optional[SeenDevice]:
+        """Most recently seen device matching predicate, advertised after `since` (monotonic)."""
+        now = time.monotonic()
+        best = None
+        for key, seen in list(self.devices.items()):
+            if now - seen.last_seen > self.max_age:
+                del self.devices[key]
+                continue
+            if since is not None and seen.last_seen < since:
+                continue
+            if (best is None or seen.last_seen > best.last_seen) and predicate(seen.device, seen.adv):
+                best = seen
+        return best
+
+    async def wait_for(self, predicate: Callable[[BLEDevice, AdvertisementData], bool],
+                       timeout: Optional[float] = None, since: float = None) -> SeenDevice:
+        """Returns as soon as a matching advertisement is seen. Raises DfuException on timeout."""
+        seen = self.find(predicate, since)
+        if seen is not None:
+            return seen
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, since, future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise DfuException("Device not found.")
+        finally:
+            self._waiters.remove(waiter)
+
+def list_adapters() -> List[str]:
+    """Local HCI adapters (hci0, hci1, USB dongles...) known to the kernel, empty off Linux."""
+    try:
+        return sorted((a for a in os.listdir("/sys/class/bluetooth") if a.startswith("hci") and ":" not in a),
+                      key=lambda a: int(a[3:]) if a[3:].isdigit() else 0)
+    except OSError:
+        return []
+
+async def _wait_for_match(predicate, adapter: str, registry: Optional[DeviceRegistry], timeout: float) -> BLEDevice:
+    """Waits on the shared registry, or on a short-lived one when none is running."""
+    if registry is not None:
+        return (await registry.wait_for(predicate, timeout)).for_adapter(adapter)
+    async with DeviceRegistry(adapter=adapter) as temporary:
+        return (await temporary.wait_for(predicate, timeout)).device
+
+async def find_device_by_name_or_address(name_or_address: str, force_scan: bool, adapter: str = None,
+                                         service_uuid: str = None, registry: DeviceRegistry = None,
+                                         timeout: float = 5.0) -> BLEDevice:
     """
     Helper to find a specific device.
     """
-    if not force_scan and not adapter:
+    if not force_scan and not adapter and registry is None:
         try:
             device = await BleakScanner.find_device_by_address(name_or_address, timeout=10.0)
             if device: return device
         except BleakError:
             pass
 
-    scanner = BleakScanner(adapter=adapter)
-    scanned_devices = await scanner.discover(timeout=5.0, return_adv=True)
-
-    target = None
-
-    for key, (d, adv) in scanned_devices.items():
-        if d.address.upper() == name_or_address.upper():
-            target = d; break
-
-        adv_name = adv.local_name or d.name or ""
-        if adv_name == name_or_address:
-            target = d; break
+    matcher = TargetMatcher([name_or_address] + ([f"uuid:{service_uuid}"] if service_uuid else []))
+    return await _wait_for_match(matcher, adapter, registry, timeout)
 
-        if not target and service_uuid:
-            if service_uuid.lower() in [u.lower() for u in adv.service_uuids]:
-                target = d; break
-
-    if not target:
-        raise DfuException("Device not found.")
-
-    return target
-
-async def find_any_device(identifiers: List[str], adapter: str = None, service_uuid: str = None) -> BLEDevice:
+async def find_any_device(identifiers: List[str], adapter: str = None, service_uuid: str = None,
+                          registry: DeviceRegistry = None, timeout: float = 5.0) -> BLEDevice:
     """
-    Scans once and checks if ANY of the provided identifiers match found devices.
-    Returns the first device that matches.
+    Checks advertisements against ANY of the provided identifiers (TargetMatcher patterns:
+    names, globs, re:, addresses, uuid:, mfr:). Returns the first device that matches,
+    as soon as it is seen.
     """
-    scanner = BleakScanner(adapter=adapter)
-    # Perform a single broadcast scan
-    scanned_devices = await scanner.discover(timeout=5.0, return_adv=True)
-
-    for identifier in identifiers:
-        identifier_upper = identifier.upper()
-
-        for key, (d, adv) in scanned_devices.items():
-            # 1. Check Address Match
-            if d.address.upper() == identifier_upper:
-                return d
-
-            # 2. Check Name Match
-            adv_name = adv.local_name or d.name or ""
-            if adv_name == identifier:
-                return d
-
-            # 3. Check Service UUID (only if identifier matches special UUID string if applicable)
-            # (Logic handled separately usually, but here checking generally)
-            if service_uuid and service_uuid.lower() in [u.lower() for u in adv.service_uuids]:
-                # This is a bit ambiguous if multiple devices have the UUID,
-                # but this function targets specific identifiers.
-                # If identifier was "DFU_SERVICE", it would catch here.
-                pass
-
-    raise DfuException(f"No devices found matching: {identifiers}")
+    matcher = TargetMatcher(list(identifiers) + ([f"uuid:{service_uuid}"] if service_uuid else []))
+    try:
+        return await _wait_for_match(matcher, adapter, registry, timeout)
+    except DfuException:
+        raise DfuException(f"No devices found matching: {identifiers}")
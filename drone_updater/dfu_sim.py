@@ -0,0 +1,598 @@
+# --- START OF FILE dfu_sim.py ---
+import asyncio
+import logging
+import math
+import random
+import struct
+import time
+from collections import deque
+from typing import Optional, Callable, List, Dict
+
+from bleak import BleakError
+
+from dfu_lib import (
+    DFU_SERVICE_UUID, DFU_CONTROL_POINT_UUID, DFU_PACKET_UUID, DIS_FIRMWARE_REVISION_UUID,
+    OP_CODE_START_DFU, OP_CODE_INIT_DFU_PARAMS, OP_CODE_RECEIVE_FIRMWARE_IMAGE, OP_CODE_VALIDATE,
+    OP_CODE_ACTIVATE_AND_RESET, OP_CODE_RESET, OP_CODE_PACKET_RECEIPT_NOTIF_REQ,
+    OP_CODE_RESPONSE_CODE, OP_CODE_PACKET_RECEIPT_NOTIF, OP_CODE_ENTER_BOOTLOADER,
+    bootloader_address_hint,
+)
+
+logger = logging.getLogger("DFU_SIM")
+
+# Legacy DFU response status codes
+STATUS_SUCCESS = 1
+STATUS_INVALID_STATE = 2
+STATUS_NOT_SUPPORTED = 3
+STATUS_DATA_SIZE_EXCEEDS_LIMIT = 4
+STATUS_CRC_ERROR = 5
+STATUS_OPERATION_FAILED = 6
+
+BOOTLOADER_NAME = "DfuTarg"
+
+def crc16_ccitt(data, crc: int = 0xFFFF) -> int:
+    """CRC16 as computed by the Nordic SDK (crc16_compute), used in legacy init packets."""
+    for byte in data:
+        crc = ((crc >> 8) & 0xFF) | ((crc << 8) & 0xFFFF)
+        crc ^= byte
+        crc ^= (crc & 0xFF) >> 4
+        crc ^= (crc << 12) & 0xFFFF
+        crc ^= ((crc & 0xFF) << 5) & 0xFFFF
+    return crc
+
+def legacy_init_packet(image: bytes, device_type: int = 0xFFFF, app_version: int = 0xFFFFFFFF) -> bytes:
+    """Legacy (SDK <= 11) init packet: type, revision, app version, SoftDevice list, image CRC16."""
+    return struct.pack('<HHIHHH', device_type, 0xFFFF, app_version, 1, 0xFFFE, crc16_ccitt(image))
+
+class SimLinkProfile:
+    """
+    Radio and target parameters for a simulated session. Durations are in simulated seconds;
+    `time_scale` maps them onto wall time (0.1 runs the link ten times faster than real).
+
+    A connection starts on 1M PHY with `data_length` byte link-layer frames and BlueZ's default
+    `conn_interval`; the link parameter requests can raise these up to `max_data_length`,
+    `min_conn_interval` and 2M PHY (when `supports_2m`). Each connection event carries as many
+    frames as fit its airtime, capped at `frames_per_event`, and an ATT write of N bytes costs
+    ceil((N + 7) / data length) frames. A frame is lost with probability `loss` and
+    retransmitted at the next event, as the link layer would.
+    On the host, every write costs `write_cost` of bluetoothd time and returns
+    `write_latency` after it was issued, so overlapping writes hide the round trip.
+    The bootloader buffers `buffer_size` bytes and writes them to flash at one page per
+    `flash_write_delay`. A packet arriving while the buffer is full is an overrun and fails
+    the upload (`full_buffer="overrun"`, the default), so a sender running ahead of flash is
+    caught; with `full_buffer="hold"` the target stops acknowledging packet writes instead,
+    holding them back at the link layer until flash catches up. PRN receipts are sent as
+    packets are taken in, so they follow the flash rate too.
+    """
+    def __init__(self, mtu: int = 247, data_length: int = 27, conn_interval: float = 0.03,
+                 frames_per_event: int = 6, loss: float = 0.0, write_latency: float = 0.002, write_cost: float = 0.0003,
+                 supports_2m: bool = True, max_data_length: int = 251, min_conn_interval: float = 0.0075,
+                 tx_queue_depth: int = 16, buffer_size: int = 4096, page_size: int = 4096,
+                 flash_write_delay: float = 0.045, full_buffer: str = "overrun",
+                 connect_delay: float = 0.3, reboot_delay: float = 1.0,
+                 adv_interval: float = 0.1, disconnect_rate: float = 0.0, max_image: int = 512 * 1024,
+                 time_scale: float = 1.0, seed: Optional[int] = None):
+        self.mtu = mtu
+        self.data_length = data_length
+        self.conn_interval = conn_interval
+        self.frames_per_event = frames_per_event
+        self.supports_2m = supports_2m
+        self.max_data_length = max_data_length
+        self.min_conn_interval = min_conn_interval
+        self.loss = loss
+        self.write_latency = write_latency
+        self.write_cost = write_cost
+        self.tx_queue_depth = tx_queue_depth
+        self.buffer_size = buffer_size
+        self.page_size = page_size
+        self.flash_write_delay = flash_write_delay
+        if full_buffer not in ("overrun", "hold"):
+            raise ValueError(f"full_buffer must be 'overrun' or 'hold', not {full_buffer!r}")
+        self.full_buffer = full_buffer
+        self.connect_delay = connect_delay
+        self.reboot_delay = reboot_delay
+        self.adv_interval = adv_interval
+        self.disconnect_rate = disconnect_rate
+        self.max_image = max_image
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+
+    def now(self) -> float:
+        """Simulated monotonic clock."""
+        return time.monotonic() / self.time_scale
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds * self.time_scale)
+
+    def frames_per_interval(self, interval: float, data_length: int, phy: str) -> int:
+        """Frames that fit one connection event: data packet, empty ack and two inter-frame spaces."""
+        rate = 2.0 if phy == "2M" else 1.0  # bits per microsecond
+        airtime = ((10 + data_length) * 8 / rate + 80 / rate + 300) * 1e-6
+        return max(1, min(self.frames_per_event, int(interval / airtime)))
+
+    @property
+    def flash_rate(self) -> float:
+        return self.page_size / self.flash_write_delay if self.flash_write_delay > 0 else float("inf")
+
+class SimulatedBootloader:
+    """
+    Legacy DFU state machine of the target. Fed whole ATT writes by the link, it returns
+    the notifications to send back; tick() lets flash progress between connection events.
+    """
+    def __init__(self, profile: SimLinkProfile):
+        self.profile = profile
+        self.reset()
+        self.overruns = 0
+        self.completed = 0
+        self.image: Optional[bytes] = None  # Last validated image
+
+    def reset(self):
+        self.state = "idle"
+        self.app_size = 0
+        self.init_data = bytearray()
+        self.received = bytearray()
+        self.packets = 0
+        self.prn = 0
+        self.buffered = 0.0
+        self.last_flash = self.profile.now()
+
+    def _response(self, op: int, status: int) -> bytes:
+        return bytes([OP_CODE_RESPONSE_CODE, op, status])
+
+    def _drain(self):
+        now = self.profile.now()
+        self.buffered = max(0.0, self.buffered - (now - self.last_flash) * self.profile.flash_rate)
+        self.last_flash = now
+
+    def can_accept(self, length: int) -> bool:
+        if self.state != "receiving":
+            return True
+        self._drain()
+        return self.buffered + length <= self.profile.buffer_size
+
+    def on_control(self, data: bytes) -> List[bytes]:
+        op = data[0] if data else 0
+        if op == OP_CODE_START_DFU:
+            self.reset()
+            self.state = "await_size"
+        elif op == OP_CODE_INIT_DFU_PARAMS:
+            if self.state not in ("ready", "init"):
+                return [self._response(op, STATUS_INVALID_STATE)]
+            if len(data) > 1 and data[1] == 0x00:
+                self.init_data = bytearray()
+                self.state = "init"
+            elif len(data) > 1 and data[1] == 0x01:
+                self.state = "ready"
+                return [self._response(op, STATUS_SUCCESS)]
+        elif op == OP_CODE_PACKET_RECEIPT_NOTIF_REQ:
+            self.prn = struct.unpack('<H', bytes(data[1:3]))[0] if len(data) >= 3 else 0
+        elif op == OP_CODE_RECEIVE_FIRMWARE_IMAGE:
+            if self.state != "ready":
+                return [self._response(op, STATUS_INVALID_STATE)]
+            self.state = "receiving"
+            self.last_flash = self.profile.now()
+        elif op == OP_CODE_VALIDATE:
+            if self.state != "received":
+                return [self._response(op, STATUS_INVALID_STATE)]
+            if len(self.init_data) == 14:
+                expected = struct.unpack('<H', bytes(self.init_data[12:14]))[0]
+                if crc16_ccitt(self.received) != expected:
+                    return [self._response(op, STATUS_CRC_ERROR)]
+            self.state = "validated"
+            return [self._response(op, STATUS_SUCCESS)]
+        elif op in (OP_CODE_ACTIVATE_AND_RESET, OP_CODE_RESET):
+            if op == OP_CODE_ACTIVATE_AND_RESET and self.state == "validated":
+                self.image = bytes(self.received)
+                self.completed += 1
+            self.state = "reset"
+        else:
+            return [self._response(op, STATUS_NOT_SUPPORTED)]
+        return []
+
+    def on_packet(self, data: bytes) -> List[bytes]:
+        if self.state == "await_size":
+            if len(data) < 12:
+                return [self._response(OP_CODE_START_DFU, STATUS_OPERATION_FAILED)]
+            sd_size, bl_size, app_size = struct.unpack('<III', bytes(data[:12]))
+            if sd_size or bl_size or app_size > self.profile.max_image:
+                self.state = "idle"
+                return [self._response(OP_CODE_START_DFU, STATUS_DATA_SIZE_EXCEEDS_LIMIT)]
+            self.app_size = app_size
+            self.state = "ready"
+            return [self._response(OP_CODE_START_DFU, STATUS_SUCCESS)]
+
+        if self.state == "init":
+            self.init_data += data
+            return []
+
+        if self.state != "receiving":
+            return []
+
+        self._drain()
+        if self.buffered + len(data) > self.profile.buffer_size or len(self.received) + len(data) > self.app_size:
+            self.overruns += 1
+            self.state = "failed"
+            return [self._response(OP_CODE_RECEIVE_FIRMWARE_IMAGE, STATUS_OPERATION_FAILED)]
+
+        self.received += data
+        self.buffered += len(data)
+        self.packets += 1
+        out = []
+        if self.prn and self.packets % self.prn == 0:
+            out.append(bytes([OP_CODE_PACKET_RECEIPT_NOTIF]) + struct.pack('<I', len(self.received)))
+        return out
+
+    def tick(self) -> List[bytes]:
+        """Called once per connection event; reports the upload once it is in flash."""
+        if self.state == "receiving" and len(self.received) == self.app_size:
+            self._drain()
+            if self.buffered <= 0:
+                self.state = "received"
+                return [self._response(OP_CODE_RECEIVE_FIRMWARE_IMAGE, STATUS_SUCCESS)]
+        return []
+
+class SimDevice:
+    """Stand-in for bleak's BLEDevice."""
+    def __init__(self, address: str, name: Optional[str]):
+        self.address = address
+        self.name = name
+        self.details = None
+
+    def __repr__(self):
+        return f"SimDevice({self.address}, {self.name})"
+
+class SimAdvertisement:
+    """Stand-in for bleak's AdvertisementData."""
+    def __init__(self, local_name: Optional[str], service_uuids: List[str] = None,
+                 manufacturer_data: Dict[int, bytes] = None, rssi: int = -60):
+        self.local_name = local_name
+        self.service_uuids = service_uuids or []
+        self.manufacturer_data = manufacturer_data or {}
+        self.service_data = {}
+        self.tx_power = None
+        self.rssi = rssi
+
+class SimulatedDrone:
+    """A target that runs its application until told to jump, then advertises its bootloader."""
+    def __init__(self, name: str, address: str, profile: SimLinkProfile, mode: str = "app", rssi: int = -60):
+        self.name = name
+        self.address = address.upper()
+        self.bootloader_address = bootloader_address_hint(self.address)
+        self.profile = profile
+        self.mode = mode  # "app", "bootloader" or None while rebooting
+        self.rssi = rssi
+        self.firmware_revision: Optional[str] = None  # DIS firmware revision of the application, if exposed
+        self.bootloader = SimulatedBootloader(profile)
+        self._reboot: Optional[asyncio.Task] = None
+
+    def advertisement(self):
+        if self.mode == "app":
+            return SimDevice(self.address, self.name), SimAdvertisement(self.name, rssi=self.rssi)
+        if self.mode == "bootloader":
+            return (SimDevice(self.bootloader_address, BOOTLOADER_NAME),
+                    SimAdvertisement(BOOTLOADER_NAME, [DFU_SERVICE_UUID], rssi=self.rssi))
+        return None
+
+    def device(self) -> SimDevice:
+        """Device for the currently advertised identity."""
+        return self.advertisement()[0]
+
+    def reboot(self, mode: str):
+        self.mode = None
+        self.bootloader.reset()
+
+        async def come_up():
+            await self.profile.sleep(self.profile.reboot_delay)
+            self.mode = mode
+        self._reboot = asyncio.get_running_loop().create_task(come_up())
+
+class SimWorld:
+    """
+    The simulated radio environment. client() and scanner() are drop-in factories for
+    NordicLegacyDFU(client_factory=...) and DeviceRegistry(scanner_factory=...).
+    """
+    def __init__(self, profile: SimLinkProfile = None):
+        self.profile = profile or SimLinkProfile()
+        self.drones: Dict[str, SimulatedDrone] = {}
+        self.clients: List["SimClient"] = []
+
+    def add(self, name: str, address: str, mode: str = "app", rssi: int = -60) -> SimulatedDrone:
+        drone = SimulatedDrone(name, address, self.profile, mode=mode, rssi=rssi)
+        self.drones[drone.address] = drone
+        return drone
+
+    def resolve(self, address: str):
+        address = address.upper()
+        for drone in self.drones.values():
+            if drone.mode == "app" and drone.address == address:
+                return drone
+            if drone.mode == "bootloader" and drone.bootloader_address == address:
+                return drone
+        return None
+
+    def client(self, device, timeout: float = 20.0, adapter: str = None,
+               disconnected_callback: Callable = None, **kwargs) -> "SimClient":
+        client = SimClient(self, device, timeout=timeout, adapter=adapter, disconnected_callback=disconnected_callback)
+        self.clients.append(client)
+        return client
+
+    def scanner(self, detection_callback: Callable = None, adapter: str = None, **kwargs) -> "SimScanner":
+        return SimScanner(self, detection_callback, adapter)
+
+    def link_stats(self) -> Dict[str, int]:
+        stats = {"events": 0, "writes": 0, "frames": 0, "retransmits": 0, "held": 0, "queue_full_waits": 0}
+        for client in self.clients:
+            for key in stats:
+                stats[key] += client.stats[key]
+        stats["overruns"] = sum(d.bootloader.overruns for d in self.drones.values())
+        return stats
+
+class SimScanner:
+    """BleakScanner lookalike that reports every advertising drone once per advertising interval."""
+    def __init__(self, world: SimWorld, detection_callback: Callable, adapter: str = None):
+        self.world = world
+        self.detection_callback = detection_callback
+        self.adapter = adapter
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._advertise())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _advertise(self):
+        while True:
+            for drone in list(self.world.drones.values()):
+                adv = drone.advertisement()
+                if adv and self.detection_callback:
+                    self.detection_callback(*adv)
+            await self.world.profile.sleep(self.world.profile.adv_interval)
+
+class SimClient:
+    """
+    BleakClient lookalike talking to a SimulatedDrone over the simulated link.
+
+    Writes are queued in order and drained by a task that wakes once per connection event;
+    write-without-response blocks while the host queue is full, write-with-response completes
+    one event after delivery, and notifications are delivered at the next event.
+    """
+    def __init__(self, world: SimWorld, device, timeout: float = 20.0, adapter: str = None,
+                 disconnected_callback: Callable = None):
+        self.world = world
+        self.profile = world.profile
+        self.address = device.address
+        self.timeout = timeout
+        self.adapter = adapter
+        self.disconnected_callback = disconnected_callback
+        self.phy = "1M"
+        self.data_length = self.profile.data_length
+        self.conn_interval = self.profile.conn_interval
+        self.link_requests = []  # What the engine asked for, in order
+        self.drone: Optional[SimulatedDrone] = None
+        self.is_connected = False
+        self.stats = {"events": 0, "writes": 0, "frames": 0, "retransmits": 0, "held": 0, "queue_full_waits": 0}
+        self._callbacks: Dict[str, Callable] = {}
+        self._queue = deque()          # [uuid, data, future or None, frames left]
+        self._notifications = deque()
+        self._responses = []           # Write responses due at the next event
+        self._blocked = deque()  # Writers waiting for TX queue space, admitted in call order
+        self._admitted = 0       # 1 while an admitted writer has not queued its packet yet
+        self._link: Optional[asyncio.Task] = None
+        self._host_free = 0.0   # When bluetoothd can take the next call
+        self._replied_at = 0.0  # Latest reply handed back to the caller
+        self._drop_at: Optional[float] = None  # Fraction of the image after which the link drops
+
+    @property
+    def mtu_size(self) -> int:
+        return self.profile.mtu
+
+    async def connect(self):
+        drone = self.world.resolve(self.address)
+        if drone is None:
+            await asyncio.sleep(min(self.timeout, 1.0) * self.profile.time_scale)
+            raise BleakError(f"Device with address {self.address} was not found.")
+        await self.profile.sleep(self.profile.connect_delay)
+        self.drone = drone
+        self.is_connected = True
+        if drone.mode == "bootloader" and self.profile.rng.random() < self.profile.disconnect_rate:
+            self._drop_at = self.profile.rng.uniform(0.05, 0.95)
+        self._link = asyncio.get_running_loop().create_task(self._run_link())
+        return True
+
+    async def disconnect(self):
+        self._drop("Disconnected by host")
+        if self._link:
+            self._link.cancel()
+            try:
+                await self._link
+            except asyncio.CancelledError:
+                pass
+            self._link = None
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+    async def start_notify(self, uuid: str, callback: Callable):
+        self._callbacks[uuid.lower()] = callback
+
+    async def stop_notify(self, uuid: str):
+        self._callbacks.pop(uuid.lower(), None)
+
+    async def read_gatt_char(self, uuid: str) -> bytearray:
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        if self.drone.mode != "app" or str(uuid).lower() != DIS_FIRMWARE_REVISION_UUID or not self.drone.firmware_revision:
+            raise BleakError(f"Characteristic {uuid} was not found!")
+        await self.profile.sleep(2 * self.conn_interval)  # Read request and response
+        return bytearray(self.drone.firmware_revision.encode())
+
+    async def write_gatt_char(self, uuid: str, data, response: bool = False):
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        if self._blocked or self._admitted or len(self._queue) >= self.profile.tx_queue_depth:
+            # Flow control: wait for queue space without letting later calls overtake this one
+            self.stats["queue_full_waits"] += 1
+            turn = asyncio.get_running_loop().create_future()
+            self._blocked.append(turn)
+            self._admit()
+            await turn
+            self._admitted = 0
+        # bluetoothd serves one D-Bus call at a time (`write_cost`) and the caller gets its reply
+        # `write_latency` after the call went out. Kept on a logical clock, as the event loop
+        # cannot sleep for less than about a millisecond.
+        scale = self.profile.time_scale
+        issued = max(time.monotonic(), self._replied_at)
+        start = max(issued, self._host_free)
+        self._host_free = start + self.profile.write_cost * scale
+        reply_at = start + self.profile.write_latency * scale
+
+        future = asyncio.get_running_loop().create_future() if response else None
+        data = bytes(data)
+        self._queue.append([str(uuid).lower(), data, future, self.frames_for(len(data))])
+        self.stats["writes"] += 1
+        self._admit()
+        if future:
+            await future
+        delay = reply_at - time.monotonic()
+        await asyncio.sleep(delay if delay >= 0.001 else 0)
+        self._replied_at = max(self._replied_at, reply_at)
+
+    def _admit(self):
+        # One writer at a time: the next is let in once the previous one has queued its packet
+        if self._blocked and not self._admitted and len(self._queue) < self.profile.tx_queue_depth:
+            self._blocked.popleft().set_result(None)
+            self._admitted = 1
+
+    def frames_for(self, length: int) -> int:
+        # L2CAP (4) + ATT write header (3) are carried in the link-layer payload
+        return max(1, math.ceil((length + 7) / self.data_length))
+
+    # --- Link parameter requests, as NordicLegacyDFU._negotiate_link looks for them on a backend ---
+    async def request_phy(self, phy: str) -> str:
+        self.link_requests.append(("phy", phy))
+        await self.profile.sleep(6 * self.conn_interval)  # LL procedures take effect a few events later
+        if phy == "2M" and self.profile.supports_2m:
+            self.phy = "2M"
+        return self.phy
+
+    async def request_data_length(self, octets: int) -> int:
+        self.link_requests.append(("data_length", octets))
+        await self.profile.sleep(2 * self.conn_interval)
+        self.data_length = max(27, min(octets, self.profile.max_data_length))
+        return self.data_length
+
+    async def request_connection_interval(self, min_ms: float, max_ms: float) -> float:
+        self.link_requests.append(("interval_ms", min_ms, max_ms))
+        await self.profile.sleep(6 * self.conn_interval)
+        self.conn_interval = max(min_ms / 1000.0, self.profile.min_conn_interval)
+        return round(self.conn_interval * 1000.0, 3)
+
+    def _drop(self, reason: str):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        error = BleakError(reason)
+        for _, _, future, _ in self._queue:
+            if future and not future.done():
+                future.set_exception(error)
+        for future in self._responses:
+            if not future.done():
+                future.set_exception(error)
+        self._queue.clear()
+        self._responses = []
+        while self._blocked:
+            turn = self._blocked.popleft()
+            if not turn.done():
+                turn.set_exception(error)
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
+
+    def _deliver(self, uuid: str, data: bytes) -> bool:
+        """Hands a complete write to the target. Returns False when the target reset."""
+        bootloader = self.drone.bootloader
+        if self.drone.mode == "app":
+            if uuid == DFU_CONTROL_POINT_UUID and data[:1] == bytes([OP_CODE_ENTER_BOOTLOADER]):
+                self.drone.reboot("bootloader")
+                return False
+            return True
+
+        if uuid == DFU_PACKET_UUID:
+            self._notifications.extend(bootloader.on_packet(data))
+            if self._drop_at is not None and len(bootloader.received) >= self._drop_at * bootloader.app_size:
+                self._drop_at = None
+                self.drone.reboot("bootloader")
+                return False
+        else:
+            self._notifications.extend(bootloader.on_control(data))
+            if bootloader.state == "reset":
+                self.drone.reboot("app" if bootloader.image is not None else "bootloader")
+                return False
+        return True
+
+    async def _notify(self, data: bytes):
+        callback = self._callbacks.get(DFU_CONTROL_POINT_UUID)
+        if callback is None:
+            return
+        result = callback(DFU_CONTROL_POINT_UUID, bytearray(data))
+        if asyncio.iscoroutine(result):
+            await result
+
+    async def _run_link(self):
+        next_event = time.monotonic()
+        while self.is_connected:
+            next_event += self.conn_interval * self.profile.time_scale
+            await asyncio.sleep(max(0.0, next_event - time.monotonic()))
+            self.stats["events"] += 1
+
+            # Target -> host: responses and notifications queued during the previous event
+            for future in self._responses:
+                if not future.done():
+                    future.set_result(None)
+            self._responses = []
+            while self._notifications and self.is_connected:
+                await self._notify(self._notifications.popleft())
+
+            # Host -> target
+            frames = self.profile.frames_per_interval(self.conn_interval, self.data_length, self.phy)
+            reset = False
+            while frames > 0 and self._queue and not reset:
+                item = self._queue[0]
+                uuid, data, future, _ = item
+                if self.profile.full_buffer == "hold" and uuid == DFU_PACKET_UUID \
+                        and item[3] == self.frames_for(len(data)) \
+                        and self.drone.mode == "bootloader" and not self.drone.bootloader.can_accept(len(data)):
+                    self.stats["held"] += 1  # Target buffer full: not acknowledged, retried next event
+                    break
+                if self.profile.loss > 0 and self.profile.rng.random() < self.profile.loss:
+                    self.stats["retransmits"] += 1
+                    break
+                frames -= 1
+                self.stats["frames"] += 1
+                item[3] -= 1
+                if item[3] > 0:
+                    continue
+                self._queue.popleft()
+                self._admit()
+                reset = not self._deliver(uuid, data)
+                if future:
+                    self._responses.append(future)
+            self._notifications.extend(self.drone.bootloader.tick())
+
+            if reset:
+                for future in self._responses:
+                    if not future.done():
+                        future.set_result(None)
+                self._responses = []
+                self._drop("Disconnected: target reset")
@@ -0,0 +1,89 @@
+# --- START OF FILE display_model.py ---
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Set
+
+class DisplayModel:
+    """
+    What the status screen shows, and which of it the panel does not show yet.
+
+    Callers update() named fields (clock, battery, status lines, progress, counters, IP...)
+    as often as they like; a refresh is only due when a field differs from what was last
+    drawn. The first change starts a `coalesce` window so a burst of updates (progress
+    ticks, a status line and a counter changing together) lands in one refresh, and
+    refreshes are at least `min_interval` apart, `busy_interval` while `busy` is set (a
+    flash is running and progress changes all the time). A field that changes and changes
+    back before the refresh costs nothing.
+    """
+    def __init__(self, coalesce: float = 0.5, min_interval: float = 2.0, window: float = 60.0,
+                 busy_interval: float = None):
+        self.coalesce = coalesce
+        self.min_interval = min_interval
+        self.busy_interval = min_interval if busy_interval is None else busy_interval
+        self.busy = False
+        self.window = window
+        self.fields: Dict[str, Any] = {}
+        self.drawn: Optional[Dict[str, Any]] = None  # Fields as last sent to the panel
+        self.dirty_since: Optional[float] = None
+        self.last_refresh = float("-inf")
+        self.history = deque()  # (monotonic time, SPI bytes) per refresh within `window`
+        self.refreshes = 0
+        self.spi_bytes = 0
+        self.skipped = 0
+
+    def update(self, **values) -> Set[str]:
+        """Sets fields; returns the names whose value changed."""
+        changed = {key for key, value in values.items() if key not in self.fields or self.fields[key] != value}
+        if changed:
+            self.fields.update((key, values[key]) for key in changed)
+            if self.dirty_since is None and self.dirty():
+                self.dirty_since = time.monotonic()
+        return changed
+
+    def dirty(self) -> Set[str]:
+        if self.drawn is None:
+            return set(self.fields)
+        return {key for key, value in self.fields.items() if self.drawn.get(key) != value}
+
+    def due(self, now: float = None) -> Optional[float]:
+        """Seconds until a refresh is due (0: now), None while the panel is up to date."""
+        if self.dirty_since is None:
+            return None
+        if not self.dirty():
+            self.dirty_since = None  # Changed back before it was drawn
+            return None
+        now = time.monotonic() if now is None else now
+        interval = self.busy_interval if self.busy else self.min_interval
+        ready = max(self.dirty_since + self.coalesce, self.last_refresh + interval)
+        return max(0.0, ready - now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.fields)
+
+    def drawn_as(self, fields: Dict[str, Any], spi_bytes: Optional[int]):
+        """
+        Records that `fields` (a snapshot) is now on the panel, at the cost of `spi_bytes`.
+        None means the frame came out pixel-identical and no refresh was made.
+        """
+        now = time.monotonic()
+        self.drawn = fields
+        self.dirty_since = now if self.dirty() else None  # Updates made while the refresh ran
+        if spi_bytes is None:
+            self.skipped += 1
+            return
+        self.last_refresh = now
+        self.refreshes += 1
+        self.spi_bytes += spi_bytes
+        self.history.append((now, spi_bytes))
+
+    def skip(self):
+        """Counts a refresh the fixed-interval loop would have made with nothing to show."""
+        self.skipped += 1
+
+    def rates(self):
+        """(refreshes per minute, SPI bytes per minute) over the last `window` seconds."""
+        cutoff = time.monotonic() - self.window
+        while self.history and self.history[0][0] < cutoff:
+            self.history.popleft()
+        scale = 60.0 / self.window
+        return len(self.history) * scale, sum(b for _, b in self.history) * scale
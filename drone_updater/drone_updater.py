@@ -2,12 +2,10 @@
 import asyncio
 import os
 import sys
+import json
 import logging
-import re
-import subprocess
-from bleak import BleakScanner
 import time
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw
 import os
 import sys
 import socket
@@ -18,6 +16,14 @@ libdir = os.path.join(os.path.dirname(os.path.realpath(__file__)),'lib')
 if os.path.exists(libdir):
     sys.path.append(libdir)
 from waveshare_epd import epd2in13_V4
+from mapping_index import MappingIndex, MAPPING_DFU, MAPPING_STANDARD
+from target_queue import LinkModel, TargetQueue
+from flash_ledger import FlashLedger
+from display_model import DisplayModel
+from render_assets import RenderAssets
+from pisugar import PiSugarClient
+from net_watch import AddressWatcher
+from dfu_lib import NordicLegacyDFU, FirmwareCache, DeviceRegistry, DfuException, list_adapters, bootloader_address_hint
 
 # --- Configuration ---
 WORK_DIR = "/opt/drone_updater/"
@@ -30,13 +36,31 @@ OVERRIDE_FW = os.path.join(CONFIG_DIR, "firmware.zip")
 DFU_OVERRIDE_FW = os.path.join(CONFIG_DIR, "dfu.zip")
 
 LOG_FILE = "/var/log/drone_updater.log"
-DFU_SCRIPT = os.path.join(WORK_DIR, "dfu_cli.py")
-
-PRN_VALUE = "8"
-RETRY_N = "5"
-extra_params = "--scan"
-
-SCREEN_UPDATE_INT = 5
+SESSION_LOG = os.path.join(WORK_DIR, "sessions.jsonl") # One timing record per DFU session
+FIRMWARE_CACHE_DIR = os.path.join(WORK_DIR, "cache") # Uncompressed, mmap-able firmware images
+LEDGER_FILE = os.path.join(WORK_DIR, "ledger.jsonl") # Append-only log of which device got which firmware
+
+PRN_VALUE = 8
+RETRY_N = 5
+PACKET_DELAY = 0.4
+ADAPTIVE_PRN = True # Let packets run ahead of PRN acks, sized from measured round trips
+MAX_INFLIGHT = 8 # Packet writes queued to bluetoothd at once (1 = wait for each write)
+SKIP_IF_CURRENT = True # Read the node's firmware revision before the jump and skip it if already on the package version
+
+SCREEN_UPDATE_INT = 5 # Battery and temperature are re-read this often (the IP is pushed by netlink)
+PISUGAR_HOST = "127.0.0.1" # pisugar-server TCP API
+PISUGAR_PORT = 8423
+DISPLAY_POLL = 0.25 # How often the service state is compared with what the panel shows
+DISPLAY_COALESCE = 0.5 # Changes arriving within this window share one refresh
+DISPLAY_MIN_INTERVAL = 2.0 # Minimum seconds between partial refreshes
+DISPLAY_BUSY_INTERVAL = 5.0 # ...while a flash is running, as with the old fixed cadence
+DISPLAY_METRICS_INT = 300 # Seconds between display refresh rate log lines
+PARTIAL_COMMAND_BYTES = 25 # Command and parameter bytes around each partial refresh's frame data
+SCAN_WAIT = 4.0 # Max time to wait for a matching advertisement before re-reading the mappings
+MIN_RSSI = -88 # Smoothed RSSI (dBm) below which a session is not started; the display asks to move closer
+MIN_SUCCESS = 0.3 # Predicted success probability below which a session is not started
+SUCCESS_COOLDOWN = 600 # Seconds before a flashed device may be flashed again (with a different package)
+FAILURE_COOLDOWN = 60 # Seconds before retrying a device whose session failed, doubled per failure in a row
 
 # --- Configure Logging ---
 logging.basicConfig(
@@ -52,69 +76,35 @@ logging.getLogger('').addHandler(console)
 service_running = False
 totAttempts = 0
 totSuccess = 0
+totSkipped = 0 # Sessions that found the node already up to date; not counted as attempts
+activeSessions = 0 # DFU sessions running now; the display refreshes less often meanwhile
 pct = 0
 log1 = ""
 log2 = ""
 log3 = ""
+log_stats = "" # Footer summary of the last session
 
 shutdown_event = asyncio.Event()
 epd = None
+firmware_cache = FirmwareCache(FIRMWARE_CACHE_DIR, max_entries=16)
+# DFU names take priority over standard names, as before
+mapping_index = MappingIndex([(MAPPING_DFU, DFU_MAPPING_FILE, DFU_OVERRIDE_FW),
+                              (MAPPING_STANDARD, MAPPING_FILE, OVERRIDE_FW)])
+# Go/no-go and ordering of matched targets, learned from SESSION_LOG
+link_model = LinkModel()
+target_queue = TargetQueue(link_model, MIN_RSSI, MIN_SUCCESS)
+ledger = FlashLedger(LEDGER_FILE, SUCCESS_COOLDOWN, FAILURE_COOLDOWN)
+ledger_skips = set() # Addresses whose current skip has been logged
+display_model = DisplayModel(DISPLAY_COALESCE, DISPLAY_MIN_INTERVAL, busy_interval=DISPLAY_BUSY_INTERVAL)
+render_assets = None # Fonts, labels and glyph sprites, built once the display is found
+prewarm_tasks = set() # Background prewarms after a mapping change, referenced until they finish
+pisugar = PiSugarClient(PISUGAR_HOST, PISUGAR_PORT) # One connection, values cached per field
+address_watcher = AddressWatcher(lambda address: display_model.update(ip=address or "-")) # Pushes IP changes to the display
 
 
 
-def get_battery_percentage():
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(2)
-            s.connect(("127.0.0.1", 8423))
-            s.sendall(b"get battery\n")
-            response = s.recv(1024).decode().strip()
-    except (socket.error, ConnectionRefusedError, TimeoutError):
-        return "-"  # Port closed. Service likely not running
-    try:
-        value = response.split(":")[1].strip()
-        return int(float(value))  # Convert to float first, then int
-    except (IndexError, ValueError):
-        return "-"  # Problem decoding response
-
-def get_temperature():
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(2)
-            s.connect(("127.0.0.1", 8423))
-            s.sendall(b"get temperature\n")
-            response = s.recv(1024).decode().strip()
-    except (socket.error, ConnectionRefusedError, TimeoutError):
-        return "-"  # Port closed. Service likely not running
-
-    try:
-        value = response.split(":")[1].strip()
-        return int(float(value))  # Convert to float first, then int
-    except (IndexError, ValueError):
-        return "-"  # Problem decoding response
-    
-def get_charge_status():
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(2)
-            s.connect(("127.0.0.1", 8423))
-            s.sendall(b"get battery_power_plugged\n")
-            response = s.recv(1024).decode().strip()
-    except (socket.error, ConnectionRefusedError, TimeoutError):
-        return "-"  # Port closed. Service likely not running
-
-    try:
-        value = response.split(":")[1].strip().lower()
-        if value == "false":
-            return "🔋"
-        elif value == "true":
-            return "🔌"
-        else:
-            return "-"
-    except (IndexError, ValueError):
-        return "-"  # Problem decoding response
-
 def get_active_ip():
+    """Fallback for address_watcher where rtnetlink is not available."""
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             # Doesn't need to be reachable
@@ -126,75 +116,105 @@ def get_active_ip():
 def is_spi_enabled():
     return os.path.exists("/dev/spidev0.0")
 
-async def update_eink_display():
-    global service_running, log1, log2, log3, totAttempts, totSuccess, epd
+def display_fields():
+    """Service state shown on the screen, as plain values the display model can compare."""
+    return {"clock": time.strftime('%H:%M'), "service": service_running, "log1": log1, "log3": log3,
+            "pct": pct, "counts": f"{totSuccess}/{totAttempts}", "stats": log_stats}
+
+async def read_telemetry():
+    power = await pisugar.snapshot()
+    fields = {"battery": "-" if power["battery"] is None else power["battery"],
+              "charge": {True: "🔌", False: "🔋"}.get(power["plugged"], "-"),
+              "temperature": "-" if power["temperature"] is None else power["temperature"]}
+    if not address_watcher.running:
+        fields["ip"] = await asyncio.to_thread(get_active_ip)
+    return fields
+
+def draw_status(eink_image, eink_draw, f, assets):
+    """Draws the status screen for the fields `f` onto the landscape frame."""
+    width, height = eink_image.size
+    text = lambda xy, value, font, fill: assets.text(eink_image, eink_draw, xy, value, font, fill)
+    eink_draw.rectangle((0, 0, width, 15), fill = 0) #Draw background behind clock
+    eink_draw.rectangle((0, 16, width, height), fill = 255) #Draw background behind everything else
+    text((110, 2), f["clock"], "bold", 255) #draw time
+    text((210,2), f"{f['battery']}%", "regular", 255) #draw battery percentage
+    text((200,2), f["charge"], "symbol", 255) #draw charging state
+    eink_draw.line((0,40,width,40), width=2) #draw divider for status area
+    text((50,20), "Service Running" if f["service"] else "Service Stopped", "bold", 0) #draw service status
+    eink_draw.line((0,height-15,width,height-15), width=2) #draw divider for nerd stats
+    text((0,45), f["log1"], "regular", 0) #draw log line 1
+    if f["pct"] >0:
+        eink_draw.rectangle((60, 65, width-20, 80), outline = 0, width=1) #draw progress bar outline
+        eink_draw.rectangle((60, 65, ((f["pct"]*(width-80))/100)+60, 80), fill = 0) #draw progress fill
+        text((120,65), f"{f['pct']}%", "regular", 0 if f["pct"] <50 else 255) #draw log line 2
+        text((0,65), "Progress:", "regular", 0) #draw log line 2
+
+    text((0,85), f["log3"], "regular", 0) #draw log line 3
+    text((0,height-15), f["counts"], "small", 0)  #draw successes/attempts
+    text((30,height-15), f["stats"], "small", 0)  #draw last session time and speed
+    text((110,height-15), f"{f['temperature']}°C", "small", 0)  #draw temperature
+    text((100,height-15), "🌡️", "small_symbol", 0)  #draw temperature
+    text((180,height-15), f["ip"], "small", 0)  #draw IP address
 
-    font24 = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 12)
-    font25 = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
-    font26 = ImageFont.truetype("/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 12)
-    font27 = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 10)
-    font28 = ImageFont.truetype("/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 10)
+async def update_eink_display():
+    global epd
 
     eink_image = Image.new('1', (epd.height, epd.width), 255)
     eink_draw = ImageDraw.Draw(eink_image)
     #epd.display(epd.getbuffer(eink_image))
     #epd.displayPartBaseImage(epd.getbuffer(eink_image))
 
+    last_frame = None # Frame on the panel; None until the first refresh
+    render_time = 0.0 # Drawing and packing time since the last metrics line
+    renders = 0
+    next_telemetry = last_metrics = time.monotonic()
     while not shutdown_event.is_set():
-        eink_draw.rectangle((0, 0, epd.height, 15), fill = 0) #Draw background behind clock
-        eink_draw.rectangle((0, 16, epd.height, epd.width), fill = 255) #Draw background behind everything else
-        eink_draw.text((100, 2), time.strftime('%H:%M:%S'), font = font24, fill = 255) #draw time
-        eink_draw.text((210,2), f"{await asyncio.to_thread(get_battery_percentage)}%", font= font25, fill=255) #draw battery percentage
-        eink_draw.text((200,2), await asyncio.to_thread(get_charge_status), font= font26, fill=255) #draw battery percentage    
-        eink_draw.line((0,40,epd.height,40), width=2) #draw divider for status area
-        eink_draw.text((50,20), "Service Running" if service_running else "Service Stopped", font= font24, fill=0) #draw service status       
-        eink_draw.line((0,epd.width-15,epd.height,epd.width-15), width=2) #draw divider for nerd stats
-        eink_draw.text((0,45), log1, font= font25, fill=0) #draw log line 1
-        if pct >0:
-            eink_draw.rectangle((60, 65, epd.height-20, 80), outline = 0, width=1) #draw progress bar outline
-            eink_draw.rectangle((60, 65, ((pct*(epd.height-80))/100)+60, 80), fill = 0) #draw progress fill     
-            eink_draw.text((120,65), f"{pct}%", font= font25, fill=0 if pct <50 else 255) #draw log line 2
-            eink_draw.text((0,65), "Progress:", font= font25, fill=0) #draw log line 2
-
-        eink_draw.text((0,85), log3, font= font25, fill=0) #draw log line 3
-        eink_draw.text((0,epd.width-15), f"{totSuccess}/{totAttempts}", font= font27, fill=0)  #draw successes/attempts   
-        eink_draw.text((110,epd.width-15), f"{await asyncio.to_thread(get_temperature)}°C", font= font27, fill=0)  #draw temperature   
-        eink_draw.text((100,epd.width-15), "🌡️", font= font28, fill=0)  #draw temperature   
-        eink_draw.text((180,epd.width-15), await asyncio.to_thread(get_active_ip), font= font27, fill=0)  #draw temperature   
-        await asyncio.to_thread(epd.displayPartial, epd.getbuffer(eink_image))
-        await asyncio.sleep(SCREEN_UPDATE_INT)
+        now = time.monotonic()
+        if now >= next_telemetry:
+            display_model.update(**await read_telemetry())
+            next_telemetry = now + SCREEN_UPDATE_INT
+            if display_model.due() is None:
+                display_model.skip()
+        display_model.update(**display_fields())
+
+        if display_model.due() == 0:
+            fields = display_model.snapshot()
+            started = time.perf_counter()
+            draw_status(eink_image, eink_draw, fields, render_assets)
+            # Only the rectangle whose pixels changed is uploaded (landscape, right/bottom exclusive)
+            bbox = ImageChops.logical_xor(last_frame, eink_image).getbbox() if last_frame else (0, 0, epd.height, epd.width)
+            if bbox is None:
+                display_model.drawn_as(fields, None) # Different values, same pixels
+                render_time += time.perf_counter() - started
+                renders += 1
+            else:
+                buffer = epd.getbuffer(eink_image)
+                render_time += time.perf_counter() - started
+                renders += 1
+                sent = await epd.displayPartialRectAsync(buffer, (bbox[0], bbox[1], bbox[2] - 1, bbox[3] - 1)) # Yields while BUSY
+                display_model.drawn_as(fields, sent + PARTIAL_COMMAND_BYTES)
+                last_frame = eink_image.copy()
+
+        if now >= last_metrics + DISPLAY_METRICS_INT:
+            last_metrics = now
+            per_min, spi_per_min = display_model.rates()
+            logging.info(f"Display: {per_min:.1f} refreshes/min, {spi_per_min / 1000:.1f} kB/min SPI, "
+                         f"{display_model.refreshes} refreshes made and {display_model.skipped} skipped so far, "
+                         f"render {1000 * render_time / max(1, renders):.1f} ms/frame")
+            render_time, renders = 0.0, 0
+        await asyncio.sleep(DISPLAY_POLL)
 
 
 async def show_service_stopped():
-    global service_running, log1, log2, log3, totAttempts, totSuccess, epd
-    font24 = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 12)
-    font25 = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
-    font26 = ImageFont.truetype("/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 12)
-    font27 = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 10)
-    font28 = ImageFont.truetype("/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 10)
+    global epd, render_assets
     try:
+        if render_assets is None:
+            render_assets = RenderAssets()
+        display_model.update(**await read_telemetry())
+        display_model.update(**display_fields())
         eink_image = Image.new('1', (epd.height, epd.width), 255)
         eink_draw = ImageDraw.Draw(eink_image)
-        eink_draw.rectangle((0, 0, epd.height, 15), fill = 0) #Draw background behind clock
-        eink_draw.rectangle((0, 16, epd.height, epd.width), fill = 255) #Draw background behind everything else
-        eink_draw.text((100, 2), time.strftime('%H:%M:%S'), font = font24, fill = 255) #draw time
-        eink_draw.text((210,2), f"{await asyncio.to_thread(get_battery_percentage)}%", font= font25, fill=255) #draw battery percentage
-        eink_draw.text((200,2), await asyncio.to_thread(get_charge_status), font= font26, fill=255) #draw battery percentage    
-        eink_draw.line((0,40,epd.height,40), width=2) #draw divider for status area
-        eink_draw.text((50,20), "Service Running" if service_running else "Service Stopped", font= font24, fill=0) #draw service status       
-        eink_draw.line((0,epd.width-15,epd.height,epd.width-15), width=2) #draw divider for nerd stats
-        eink_draw.text((0,45), log1, font= font25, fill=0) #draw log line 1
-        if pct >0:
-            eink_draw.rectangle((60, 65, epd.height-20, 80), outline = 0, width=1) #draw progress bar outline
-            eink_draw.rectangle((60, 65, ((pct*(epd.height-80))/100)+60, 80), fill = 0) #draw progress fill     
-            eink_draw.text((120,65), f"{pct}%", font= font25, fill=0 if pct <50 else 255) #draw log line 2
-            eink_draw.text((0,65), "Progress:", font= font25, fill=0) #draw log line 2
-
-        eink_draw.text((0,85), log3, font= font25, fill=0) #draw log line 3
-        eink_draw.text((0,epd.width-15), f"{totSuccess}/{totAttempts}", font= font27, fill=0)  #draw successes/attempts   
-        eink_draw.text((110,epd.width-15), f"{await asyncio.to_thread(get_temperature)}°C", font= font27, fill=0)  #draw temperature   
-        eink_draw.text((100,epd.width-15), "🌡️", font= font28, fill=0)  #draw temperature   
-        eink_draw.text((180,epd.width-15), await asyncio.to_thread(get_active_ip), font= font27, fill=0)  #draw temperature   
+        draw_status(eink_image, eink_draw, display_model.snapshot(), render_assets)
         epd.display(epd.getbuffer(eink_image))
 
         time.sleep(2)
@@ -221,126 +241,264 @@ async def wait_for_downloader():
         except:
             break
 
-def load_mapping(mapping_file_path, force_override_path=None):
-    """Loads device mappings, prioritizing .zip override files if they exist."""
-    mapping = {}
-    if not os.path.exists(mapping_file_path):
-        return mapping
-
-    active_override = force_override_path if (force_override_path and os.path.exists(force_override_path)) else None
-
+def warm_packages(paths):
+    """Worker thread: parses the packages and returns their digests (path -> SHA-256)."""
+    ready = firmware_cache.warm(paths)
+    digests = {}
+    for path in paths:
+        sha = package_digest(path) # Already hashed by warm()
+        if sha:
+            digests[path] = sha
+    return ready, digests
+
+async def prewarm_firmware_cache():
+    """
+    Parses every package referenced by the mapping files so the first target pays no parse
+    cost, and stores their digests on the mapping entries for the ledger check.
+    """
+    paths = mapping_index.paths()
+    start = time.monotonic()
+    ready, digests = await asyncio.to_thread(warm_packages, paths)
+    mapping_index.set_digests(digests)
+    logging.info(f"Firmware cache: {ready} package(s) ready in {time.monotonic() - start:.1f}s")
+
+def prewarm_done(task):
+    """Done callback of a background prewarm: drops its reference and reports a failure."""
+    prewarm_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Firmware cache prewarm failed: {task.exception()}")
+
+def package_digest(firmware_path):
     try:
-        with open(mapping_file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"): continue
-                parts = line.split(None, 1)
-                if len(parts) >= 1:
-                    device_name = parts[0]
-                    raw_path = active_override if active_override else (parts[1] if len(parts) == 2 else "")
-                    if raw_path:
-                        real_path = os.path.realpath(raw_path)
-                        if os.path.exists(real_path):
-                            mapping[device_name] = real_path
-    except Exception as e:
-        logging.error(f"Error reading mapping {mapping_file_path}: {e}")
-    return mapping
-
-async def run_dfu(target_name, address, firmware_path):
-    global pct, totAttempts,totSuccess, log1, log2, log3
-    """Executes the DFU process with real-time progress logging and log cleaning."""
-    logging.info(f"STARTING OTA: {target_name} [{address}]")
+        return firmware_cache.digest(firmware_path)
+    except OSError:
+        return None
+
+def ledger_allows(address, name, entry):
+    """
+    Ledger check before scheduling a device; each skip is logged once. Runs in the scanner's
+    detection callback, so it only uses the digest cached on the mapping entry (None until
+    the cache is warm: then only the cooldowns apply).
+    """
+    if ledger.get(address) is None:
+        ledger_skips.discard(address)
+        return True
+    reason = ledger.skip_reason(address, entry.sha256)
+    if reason is None:
+        ledger_skips.discard(address)
+        return True
+    if address not in ledger_skips:
+        ledger_skips.add(address)
+        logging.info(f"SKIP: {name} [{address}]: {reason}")
+    return False
+
+def record_session(target_name, firmware_path, record, rssi=None):
+    """Appends a session timing record to SESSION_LOG, feeds the link model and summarises it for the footer."""
+    global log_stats
+    entry = {"target": target_name, "firmware": os.path.basename(firmware_path), **record}
+    entry.pop("event", None)
+    entry["rssi"] = round(rssi, 1) if rssi is not None else None
+    link_model.add(entry) # Ignores skipped sessions, as when SESSION_LOG is loaded at startup
+    if record.get("skipped"):
+        log_stats = "up to date"
+    try:
+        with open(SESSION_LOG, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        logging.error(f"Could not write session record: {e}")
+    if not record.get("skipped"):
+        log_stats = f"{record['duration']:.0f}s {record['throughput']['avg'] / 1000:.1f}kB/s"
+
+async def run_dfu(target_name, device, firmware_path, registry=None, adapter=None, on_event_hook=None, rssi=None,
+                  is_claimed=None):
+    global pct, totAttempts,totSuccess,totSkipped,activeSessions, log1, log2, log3
+    """Runs the DFU engine in-process, feeding progress and status lines to the display."""
+    logging.info(f"STARTING OTA: {target_name} [{device.address}] via {adapter or 'default adapter'}"
+                 + (f" at {rssi:.0f} dBm" if rssi is not None else ""))
     logging.info(f"FIRMWARE: {firmware_path}")
     log1 = f"Found OTA: {target_name}"
     totAttempts +=1
+    started = time.monotonic()
+    sha256 = await asyncio.to_thread(package_digest, firmware_path) # Before an override package is removed
+
+    def on_event(event):
+        global pct, log3
+        kind = event["event"]
+        if kind == "progress":
+            if event["pct"] != pct:
+                logging.info(f"DFU: Flashing Progress: {event['pct']}%")
+            pct = event["pct"]
+        elif kind == "log" and event["level"] != "DEBUG":
+            # DFU_LIB already logs through the root logger; only mirror the line on the display
+            log3 = event["message"]
+        elif kind == "session":
+            record_session(target_name, firmware_path, event, rssi)
+        if on_event_hook:
+            on_event_hook(event)
+
+    dfu = NordicLegacyDFU(firmware_path, PRN_VALUE, PACKET_DELAY, adapter=adapter, event_callback=on_event,
+                          adaptive_prn=ADAPTIVE_PRN, cache=firmware_cache,
+                          max_inflight=MAX_INFLIGHT, skip_if_current=SKIP_IF_CURRENT)
+    activeSessions +=1
+    display_model.busy = True
+    try:
+        flashed = await dfu.update_device(device, max_retries=RETRY_N, registry=registry, is_claimed=is_claimed)
+        ledger.record(device.address, target_name, firmware_path, sha256, time.monotonic() - started, True)
+
+        if not flashed:
+            totAttempts -=1 # Counted as a skip instead, so the success ratio only covers real flashes
+            totSkipped +=1
+            logging.info(f"CURRENT: {target_name} already runs {dfu.installed_version}, not flashed "
+                         f"({totSkipped} up to date so far)")
+            log3 = f"Up to date: {target_name}"
+            return True
 
-    # Force the sub-process to flush output immediately
-    env = os.environ.copy()
-    env["PYTHONUNBUFFERED"] = "1"
+        logging.info(f"SUCCESS: Flashing finished for {target_name}")
+        log3 = f"Success: {target_name}"
+        totSuccess +=1
 
-    cmd = [sys.executable, DFU_SCRIPT, "--prn", PRN_VALUE, "--retry", RETRY_N, extra_params, firmware_path, address]
-    # Patterns for cleaning redundant timestamps and finding percentages
-    cleanup_pattern = re.compile(r"^\d{2}:\d{2}:\d{2}\s+\[\w+\]\s+")
-    percent_pattern = re.compile(r"(\d{1,3})\s?%")
-    last_logged_percent = -1
-    char_buffer = []
+        # Delete override files after successful flash
+        if firmware_path in (os.path.realpath(OVERRIDE_FW), os.path.realpath(DFU_OVERRIDE_FW)):
+            if os.path.exists(firmware_path):
+                os.remove(firmware_path)
+                logging.info(f"Cleanup: Removed override file {os.path.basename(firmware_path)}")
+        return True
 
-    try:
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-            env=env
-        )
-        while True:
-            char_bytes = await process.stdout.read(1)
-            if not char_bytes:
-                break
-            char = char_bytes.decode('utf-8', errors='ignore')
-            # If we hit a line delimiter (\n or \r), process the accumulated text
-            if char == '\n' or char == '\r':
-                line = "".join(char_buffer).strip()
-                char_buffer = []
-                if not line: continue
-
-                # Check if this line is a progress update we haven't logged yet
-                match_pct = percent_pattern.search(line)
-                if match_pct:
-                    pct = int(match_pct.group(1))
-                    if pct != last_logged_percent:
-                        logging.info(f"DFU: Flashing Progress: {pct}%")
-                        last_logged_percent = pct
-                else:
-                    # Log standard status messages, cleaning redundant info
-                    clean_line = cleanup_pattern.sub("", line)
-                    if any(k in line for k in ["Target", "Connect", "Jump", "Upload", "Success", "Error", "Exception", "Timeout", "Verifying", "Successful"]):
-                        logging.info(f"DFU: {clean_line}")
-                        log3 = clean_line
-            else:
-                # Add character to buffer
-                char_buffer.append(char)
-                # IMMEDIATE PERCENTAGE CHECK:
-                # Check the buffer as it grows so we don't wait for the next \r
-                current_buffer_str = "".join(char_buffer)
-                match_pct = percent_pattern.search(current_buffer_str)
-                if match_pct:
-                    pct = int(match_pct.group(1))
-                    if pct != last_logged_percent:
-                        logging.info(f"DFU: Flashing Progress: {pct}%")
-                        last_logged_percent = pct
-                        # Note: We do NOT clear the buffer here, we let \r or \n do that
-                        # to ensure we don't chop off non-percentage text.
-
-        await process.wait()
-
-        if process.returncode == 0:
-            logging.info(f"SUCCESS: Flashing finished for {target_name}")
-            log3 = f"Success: {target_name}"
-            totSuccess +=1
-
-            # Delete override files after successful flash
-            if firmware_path == OVERRIDE_FW or firmware_path == DFU_OVERRIDE_FW:
-                if os.path.exists(firmware_path):
-                    os.remove(firmware_path)
-                    logging.info(f"Cleanup: Removed override file {os.path.basename(firmware_path)}")
+    except Exception as e:
+        logging.error(f"FAILED: Flashing {target_name}: {e}")
+        ledger.record(device.address, target_name, firmware_path, sha256, time.monotonic() - started, False)
+        log3 = f"Failed: {target_name}"
+        return False
+    finally:
+        activeSessions -=1
+        display_model.busy = activeSessions > 0
+        dfu.close()
+
+class FlashScheduler:
+    """
+    Runs one DFU session per local Bluetooth adapter concurrently in this event loop.
+
+    Matched targets are assigned to a free adapter that received their advertisements
+    itself; every adapter feeds the same DeviceRegistry, and a session connects through the
+    BLEDevice of its own adapter. Each session claims its bootloader address (the app MAC+1
+    hint, then the address actually found) so no other session's handoff can take it.
+    Once the bootloader is found, the adapter stops scanning until its session ends, so the
+    upload connection gets the radio's airtime; the other adapters keep scanning.
+    """
+    def __init__(self, adapters, registry):
+        self.adapters = list(adapters)
+        self.registry = registry
+        self.free = list(self.adapters)
+        self.sessions = {}   # app address -> (adapter, task)
+        self.claimed = {}    # bootloader address -> app address of the session using it
+        self.finished = {}   # app address -> monotonic time its last session ended
+        self.pausing = {}    # adapter -> task pausing its scanner for the upload
+        self.slot_freed = asyncio.Event()
+
+    def has_free_adapter(self):
+        return bool(self.free)
+
+    async def wait_for_free_adapter(self):
+        while not self.free:
+            self.slot_freed.clear()
+            await self.slot_freed.wait()
+
+    def adapter_for(self, seen):
+        """A free adapter that has seen the device itself (BlueZ connects through that adapter), or None."""
+        return next((adapter for adapter in self.free if adapter in seen.by_adapter), None)
+
+    def is_eligible(self, address):
+        """
+        False for devices owned by a running session, not re-advertised since their last one,
+        or not seen by any free adapter.
+        """
+        address = address.upper()
+        if address in self.sessions or address in self.claimed:
+            return False
+        seen = self.registry.devices.get(address)
+        if seen is None:
             return True
-        else:
-            logging.error(f"FAILED: Flashing ended with code {process.returncode}")
+        return seen.last_seen > self.finished.get(address, float("-inf")) and self.adapter_for(seen) is not None
+
+    def start(self, name, seen, firmware_path):
+        """Starts a session on a free adapter that saw the device. False when there is none."""
+        adapter = self.adapter_for(seen)
+        if adapter is None:
             return False
+        self.free.remove(adapter)
+        address = seen.device.address.upper()
+        hint = bootloader_address_hint(address)
+        if hint:
+            self.claimed[hint] = address
+
+        def on_event(event):
+            if event.get("phase") == "bootloader_found":
+                self.claimed.setdefault(event["address"].upper(), address)
+                if adapter not in self.pausing: # The handoff no longer needs this adapter's scanner
+                    self.pausing[adapter] = asyncio.create_task(self.registry.pause(adapter))
+
+        def is_claimed(bootloader):
+            return self.claimed.get(bootloader.upper(), address) != address
+
+        task = asyncio.create_task(self._run(name, seen.by_adapter[adapter], firmware_path, adapter, on_event,
+                                             seen.rssi, is_claimed))
+        self.sessions[address] = (adapter, task)
+        return True
+
+    async def _run(self, name, device, firmware_path, adapter, on_event, rssi=None, is_claimed=None):
+        address = device.address.upper()
+        try:
+            await run_dfu(name, device, firmware_path, self.registry, adapter, on_event, rssi, is_claimed)
+        finally:
+            await self._resume_scanning(adapter)
+            self.sessions.pop(address, None)
+            for bootloader, owner in list(self.claimed.items()):
+                if owner == address:
+                    del self.claimed[bootloader]
+            self.finished[address] = time.monotonic()
+            self.free.append(adapter)
+            self.slot_freed.set()
+
+    async def _resume_scanning(self, adapter):
+        pausing = self.pausing.pop(adapter, None)
+        if pausing is None:
+            return
+        await asyncio.gather(pausing, return_exceptions=True)
+        try:
+            await self.registry.resume(adapter)
+        except Exception as e:
+            logging.error(f"Could not resume scanning on {adapter or 'default adapter'}: {e}")
 
-    except Exception as e:
-        logging.error(f"Execution Exception: {e}")
-        return False
+    async def drain(self):
+        tasks = [task for _, task in self.sessions.values()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 async def service_loop():
-    global service_running, log1, log2, log3, epd
+    global service_running, log1, log2, log3, epd, render_assets
 
     await wait_for_downloader()
+    mapping_index.refresh(force=True)
+    await prewarm_firmware_cache()
+    loaded = await asyncio.to_thread(link_model.load, SESSION_LOG)
+    logging.info(f"Link model: {loaded} past session(s) with RSSI")
+    known = await asyncio.to_thread(ledger.load)
+    logging.info(f"Flash ledger: {known} device(s) known")
 
     if is_spi_enabled():
         epd = epd2in13_V4.EPD()
         epd.init()
         epd.Clear(0xFF)
+        started = time.monotonic()
+        render_assets = RenderAssets()
+        logging.info(f"Render assets built in {1000 * (time.monotonic() - started):.0f} ms: "
+                     f"{len(render_assets.labels)} labels, {sum(map(len, render_assets.glyphs.values()))} glyph sprites")
+
+        try:
+            address_watcher.start()
+            display_model.update(ip=address_watcher.address or "-") # Until the address dump arrives
+        except OSError as e:
+            logging.warning(f"Netlink address watch unavailable ({e}), reading the IP with each telemetry update")
 
         screen_update_task = asyncio.create_task(update_eink_display())
         logging.info("SPI bus enabled. Starting E-Ink update task")
@@ -348,37 +506,76 @@ async def service_loop():
     logging.info("--- Drone Auto-Updater Service Started ---")
     service_running = True
 
+    adapters = list_adapters() or [None]
+    registry = DeviceRegistry(adapters=adapters)
+    await registry.start()
+    scheduler = FlashScheduler(adapters, registry)
+    logging.info(f"Bluetooth adapters: {', '.join(a or 'default' for a in adapters)}")
+    since = None # Set while every target is refused, to wait for their next advertisement
+    refused = None
+
     while not shutdown_event.is_set():
         try:
-            dfu_mapping = load_mapping(DFU_MAPPING_FILE, DFU_OVERRIDE_FW)
-            standard_mapping = load_mapping(MAPPING_FILE, OVERRIDE_FW)
-            devices = await BleakScanner.discover(timeout=3.0)
-
-            for dev in devices:
-                name = dev.name
-                if not name:
-                    continue
-
+            if not scheduler.has_free_adapter():
+                await scheduler.wait_for_free_adapter()
+                continue
+
+            if mapping_index.refresh():
+                task = asyncio.create_task(prewarm_firmware_cache())
+                prewarm_tasks.add(task)
+                task.add_done_callback(prewarm_done)
+            if not scheduler.sessions:
                 log1 = "SCANNING ..."
 
-                if name in dfu_mapping:
-                    logging.info(f"DFU MATCH: {name}")
-                    log1 = f"DFU: {name}"
-                    await run_dfu(name, dev.address, dfu_mapping[name])
-                    break
-
-                elif name in standard_mapping:
-                    logging.info(f"STANDARD MATCH: {name}")
-                    log1 = f"OTA: {name}"
-                    await run_dfu(name, dev.address, standard_mapping[name])
-                    break
-
-            await asyncio.sleep(1)
+            def is_target(dev, adv):
+                entry = mapping_index.match(dev, adv)
+                return (entry is not None and scheduler.is_eligible(dev.address)
+                        and ledger_allows(dev.address.upper(), adv.local_name or dev.name, entry))
+
+            try:
+                await registry.wait_for(is_target, timeout=SCAN_WAIT, since=since)
+            except DfuException:
+                continue # Nothing in range yet; refresh mappings and keep listening
+
+            ranked = target_queue.rank((s, mapping_index.match(s.device, s.adv)) for s in registry.fresh()
+                                       if is_target(s.device, s.adv))
+            if not ranked:
+                continue
+            best = ranked[0]
+            seen, entry = best.seen, best.entry
+            name = seen.adv.local_name or seen.device.name
+
+            if not best.go:
+                if refused != (name, best.reason):
+                    logging.info(f"NOT STARTING {name}: {best.reason}")
+                    refused = (name, best.reason)
+                if not scheduler.sessions:
+                    log1 = f"Move closer: {name}"
+                    log3 = best.reason
+                since = time.monotonic()
+                continue
+            since = None
+            refused = None
+            logging.info(f"TARGET: {name} at {best.rssi if best.rssi is not None else '?'} dBm, "
+                         f"{best.success:.0%} predicted, ~{best.bps / 1000:.1f} kB/s ({len(ranked)} candidate(s))")
+
+            if entry.kind == MAPPING_DFU:
+                logging.info(f"DFU MATCH: {name}")
+                log1 = f"DFU: {name}"
+            else:
+                logging.info(f"STANDARD MATCH: {name}")
+                log1 = f"OTA: {name}"
+            if not scheduler.start(name, seen, entry.firmware_path):
+                logging.info(f"NOT STARTING {name}: no free adapter has seen it")
 
         except Exception as e:
             logging.error(f"Main Loop Error: {e}")
             await asyncio.sleep(5)
 
+    await scheduler.drain()
+    await asyncio.gather(*prewarm_tasks, return_exceptions=True)
+    await registry.stop()
+
     # Wait for display task to exit cleanly
     if is_spi_enabled():
         await screen_update_task
@@ -402,6 +599,8 @@ async def main():
 
         if epd:
             await show_service_stopped()
+        await pisugar.close()
+        address_watcher.stop()
 
 
 if __name__ == "__main__":
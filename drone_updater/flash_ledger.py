@@ -0,0 +1,118 @@
+# --- START OF FILE flash_ledger.py ---
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("FLASH_LEDGER")
+
+class LedgerEntry:
+    """Latest flash of one device, and how many of its sessions failed in a row since."""
+    def __init__(self, address: str, name: str, firmware: str, sha256: str, flashed_at: float,
+                 duration: float, ok: bool, failures: int = 0):
+        self.address = address
+        self.name = name
+        self.firmware = firmware
+        self.sha256 = sha256
+        self.flashed_at = flashed_at
+        self.duration = duration
+        self.ok = ok
+        self.failures = failures
+
+    def to_json(self) -> dict:
+        return {"address": self.address, "name": self.name, "firmware": self.firmware, "sha256": self.sha256,
+                "flashed_at": round(self.flashed_at, 1), "duration": round(self.duration, 1), "ok": self.ok}
+
+class FlashLedger:
+    """
+    Which device received which firmware, when and how long it took.
+
+    The file is an append-only JSONL log (one line per session) replayed into a dict keyed by
+    address at startup, so lookups are a single dict hit and an update never rewrites the SD
+    card. The log is only compacted at load time, once it holds far more lines than devices.
+
+    A device is skipped while it already runs the mapped package (same SHA-256, last session
+    ok), for `success_cooldown` seconds after a successful flash, and after failures for
+    `failure_cooldown` seconds doubling per consecutive failure (capped at `max_cooldown`).
+    """
+    def __init__(self, path: str, success_cooldown: float = 600.0, failure_cooldown: float = 60.0,
+                 max_cooldown: float = 1800.0):
+        self.path = path
+        self.success_cooldown = success_cooldown
+        self.failure_cooldown = failure_cooldown
+        self.max_cooldown = max_cooldown
+        self.entries: Dict[str, LedgerEntry] = {}
+        self.lines = 0
+
+    def load(self) -> int:
+        """Replays the log. Returns the number of devices known."""
+        self.entries = {}
+        self.lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._apply(LedgerEntry(record["address"].upper(), record.get("name"), record.get("firmware"),
+                                                record.get("sha256"), record["flashed_at"],
+                                                record.get("duration", 0.0), bool(record.get("ok"))))
+                        self.lines += 1
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue  # Torn last line after a power cut
+        except OSError:
+            return 0
+        if self.lines > 1000 and self.lines > 4 * len(self.entries):
+            self._compact()
+        return len(self.entries)
+
+    def _apply(self, entry: LedgerEntry):
+        previous = self.entries.get(entry.address)
+        if not entry.ok:
+            entry.failures = previous.failures + 1 if previous and not previous.ok else 1
+        self.entries[entry.address] = entry
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry.to_json()) + "\n")
+            os.replace(tmp_path, self.path)
+            logger.info(f"Ledger compacted: {self.lines} lines -> {len(self.entries)}")
+            self.lines = len(self.entries)
+        except OSError as e:
+            logger.error(f"Ledger compaction failed: {e}")
+
+    def get(self, address: str) -> Optional[LedgerEntry]:
+        return self.entries.get(address.upper())
+
+    def record(self, address: str, name: str, firmware_path: str, sha256: str, duration: float, ok: bool):
+        """Appends one session outcome."""
+        entry = LedgerEntry(address.upper(), name, os.path.basename(firmware_path), sha256,
+                            time.time(), duration, ok)
+        line = json.dumps(entry.to_json()) + "\n"
+        self._apply(entry)
+        try:
+            with open(self.path, "a") as f:
+                f.write(line)
+            self.lines += 1
+        except OSError as e:
+            logger.error(f"Could not append to ledger: {e}")
+
+    def cooldown(self, entry: LedgerEntry) -> float:
+        if entry.ok:
+            return self.success_cooldown
+        return min(self.max_cooldown, self.failure_cooldown * 2 ** (entry.failures - 1))
+
+    def skip_reason(self, address: str, sha256: Optional[str], now: float = None) -> Optional[str]:
+        """Why `address` should not be flashed with the package `sha256` now, or None."""
+        entry = self.entries.get(address.upper())
+        if entry is None:
+            return None
+        if entry.ok and sha256 and entry.sha256 == sha256:
+            return f"already on {entry.firmware}"
+        remaining = entry.flashed_at + self.cooldown(entry) - (now if now is not None else time.time())
+        if remaining > 0:
+            return f"cooldown {remaining:.0f}s after {'flash' if entry.ok else f'{entry.failures} failure(s)'}"
+        return None
@@ -0,0 +1,200 @@
+# --- START OF FILE hci_link.py ---
+import fcntl
+import logging
+import select
+import socket
+import struct
+import time
+from typing import Optional, Callable, Dict, Any, Tuple
+
+logger = logging.getLogger("HCI_LINK")
+
+# --- Socket Constants (missing from Python builds without Bluetooth headers) ---
+AF_BLUETOOTH = getattr(socket, "AF_BLUETOOTH", 31)
+BTPROTO_HCI = getattr(socket, "BTPROTO_HCI", 1)
+SOL_HCI = getattr(socket, "SOL_HCI", 0)
+HCI_FILTER = getattr(socket, "HCI_FILTER", 2)
+HCIGETCONNLIST = 0x800448D4  # _IOR('H', 212, int)
+
+# --- HCI Packets ---
+HCI_COMMAND_PKT = 0x01
+HCI_EVENT_PKT = 0x04
+EVT_CMD_COMPLETE = 0x0E
+EVT_CMD_STATUS = 0x0F
+EVT_LE_META = 0x3E
+LE_CONN_UPDATE_COMPLETE = 0x03
+LE_DATA_LENGTH_CHANGE = 0x07
+LE_PHY_UPDATE_COMPLETE = 0x0C
+OGF_LE = 0x08
+OCF_LE_CONN_UPDATE = 0x0013
+OCF_LE_SET_DATA_LENGTH = 0x0022
+OCF_LE_READ_PHY = 0x0030
+OCF_LE_SET_PHY = 0x0032
+LE_LINK = 0x80
+
+PHY_NAMES = {1: "1M", 2: "2M", 3: "Coded"}
+PHY_BITS = {"1M": 0x01, "2M": 0x02, "Coded": 0x04}
+
+class HciError(Exception):
+    pass
+
+def adapter_index(adapter: Optional[str]) -> int:
+    """hci0 -> 0; None means the first adapter, as in BlueZ."""
+    if adapter and adapter.startswith("hci") and adapter[3:].isdigit():
+        return int(adapter[3:])
+    return 0
+
+class HciLink:
+    """
+    Raw HCI access to one LE connection, for the link parameters BlueZ's D-Bus API does not
+    expose: PHY, data length and connection interval. Needs CAP_NET_RAW (the service runs as
+    root). Calls block for at most `timeout` each; run them in a thread.
+    """
+    def __init__(self, adapter: Optional[str], address: str, timeout: float = 2.0):
+        self.dev_id = adapter_index(adapter)
+        self.address = address.upper()
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self.handle: Optional[int] = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        try:
+            sock = socket.socket(AF_BLUETOOTH, socket.SOCK_RAW, BTPROTO_HCI)
+        except (OSError, AttributeError) as e:
+            raise HciError(f"HCI socket unavailable: {e}")
+        try:
+            sock.bind((self.dev_id,))
+            event_mask = ((1 << EVT_CMD_COMPLETE) | (1 << EVT_CMD_STATUS), 1 << (EVT_LE_META - 32))
+            sock.setsockopt(SOL_HCI, HCI_FILTER, struct.pack("<IIIH", 1 << HCI_EVENT_PKT, *event_mask, 0))
+            self.sock = sock
+            self.handle = self._find_handle()
+        except Exception:
+            sock.close()
+            self.sock = None
+            raise
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _find_handle(self) -> int:
+        max_conns = 16
+        request = bytearray(struct.pack("<HH", self.dev_id, max_conns) + bytes(16 * max_conns))
+        try:
+            fcntl.ioctl(self.sock.fileno(), HCIGETCONNLIST, request)
+        except OSError as e:
+            raise HciError(f"Cannot list connections: {e}")
+        count = struct.unpack_from("<H", request, 2)[0]
+        for i in range(count):
+            handle, bdaddr, link_type = struct.unpack_from("<H6sB", request, 4 + 16 * i)
+            address = ":".join(f"{b:02X}" for b in reversed(bdaddr))
+            if address == self.address and link_type == LE_LINK:
+                return handle
+        raise HciError(f"No LE connection to {self.address} on hci{self.dev_id}")
+
+    def _send(self, ocf: int, params: bytes):
+        opcode = (OGF_LE << 10) | ocf
+        self.sock.send(struct.pack("<BHB", HCI_COMMAND_PKT, opcode, len(params)) + params)
+
+    def _wait(self, match: Callable[[int, bytes], Any], timeout: float):
+        """Reads events until match(event, payload) returns something. None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return None
+            packet = self.sock.recv(260)
+            if len(packet) < 3 or packet[0] != HCI_EVENT_PKT:
+                continue
+            result = match(packet[1], packet[3:3 + packet[2]])
+            if result is not None:
+                return result
+
+    def _command(self, ocf: int, params: bytes) -> bytes:
+        """Sends an LE command; returns the Command Complete parameters (b"" for Command Status)."""
+        opcode = (OGF_LE << 10) | ocf
+        self._send(ocf, params)
+
+        def match(event, payload):
+            if event == EVT_CMD_STATUS and len(payload) >= 4 and struct.unpack_from("<H", payload, 2)[0] == opcode:
+                return payload[0], b""
+            if event == EVT_CMD_COMPLETE and len(payload) >= 4 and struct.unpack_from("<H", payload, 1)[0] == opcode:
+                return payload[3], payload[3:]
+            return None
+
+        result = self._wait(match, self.timeout)
+        if result is None:
+            raise HciError(f"No response to LE command {ocf:#06x}")
+        status, returned = result
+        if status != 0:
+            raise HciError(f"LE command {ocf:#06x} rejected, status {status:#04x}")
+        return returned
+
+    def _meta(self, subevent: int, timeout: float) -> Optional[bytes]:
+        def match(event, payload):
+            if event == EVT_LE_META and payload and payload[0] == subevent:
+                return payload[1:]
+            return None
+        return self._wait(match, timeout)
+
+    def read_phy(self) -> Tuple[str, str]:
+        returned = self._command(OCF_LE_READ_PHY, struct.pack("<H", self.handle))
+        _, _, tx, rx = struct.unpack_from("<BHBB", returned)
+        return PHY_NAMES.get(tx, str(tx)), PHY_NAMES.get(rx, str(rx))
+
+    def set_phy(self, phy: str) -> Tuple[str, str]:
+        bits = PHY_BITS[phy]
+        self._command(OCF_LE_SET_PHY, struct.pack("<HBBBH", self.handle, 0, bits, bits, 0))
+        update = self._meta(LE_PHY_UPDATE_COMPLETE, self.timeout)
+        if update and update[0] == 0:
+            _, _, tx, rx = struct.unpack_from("<BHBB", update)
+            return PHY_NAMES.get(tx, str(tx)), PHY_NAMES.get(rx, str(rx))
+        return self.read_phy()  # Unchanged, refused by the peer, or already in use
+
+    def set_data_length(self, octets: int, wait: float = 0.3) -> Optional[int]:
+        """Requests `octets` per link-layer packet. Returns the new TX length, None if no change was reported."""
+        tx_time = (octets + 14) * 8  # 1M PHY airtime, the value the spec requires us to assume
+        self._command(OCF_LE_SET_DATA_LENGTH, struct.pack("<HHH", self.handle, octets, tx_time))
+        change = self._meta(LE_DATA_LENGTH_CHANGE, wait)
+        if change:
+            return struct.unpack_from("<HHHHH", change)[1]
+        return None
+
+    def set_interval(self, min_ms: float, max_ms: float, supervision_ms: int = 4000) -> Optional[float]:
+        """Requests a connection interval. Returns the interval in effect afterwards, if reported."""
+        params = struct.pack("<HHHHHHH", self.handle, round(min_ms / 1.25), round(max_ms / 1.25), 0,
+                             supervision_ms // 10, 0, 0)
+        self._command(OCF_LE_CONN_UPDATE, params)
+        update = self._meta(LE_CONN_UPDATE_COMPLETE, self.timeout)
+        if update and update[0] == 0:
+            return struct.unpack_from("<BHH", update)[2] * 1.25
+        return None
+
+def negotiate(adapter: Optional[str], address: str, phy: str, data_length: int,
+              interval_ms: float) -> Dict[str, Any]:
+    """
+    Requests each parameter in turn, keeping whatever the controller and peer accept.
+    Values stay None when a request failed or no outcome was reported.
+    """
+    obtained: Dict[str, Any] = {"phy": None, "data_length": None, "interval_ms": None, "errors": []}
+    with HciLink(adapter, address) as link:
+        for key, request in (("phy", lambda: link.set_phy(phy)[0]),
+                             ("data_length", lambda: link.set_data_length(data_length)),
+                             ("interval_ms", lambda: link.set_interval(interval_ms, interval_ms))):
+            try:
+                obtained[key] = request()
+            except (HciError, OSError) as e:
+                logger.debug(f"{key} request failed: {e}")
+                obtained["errors"].append(f"{key}: {e}")
+    return obtained
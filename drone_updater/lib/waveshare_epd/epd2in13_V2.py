@@ -28,13 +28,18 @@
 #
 
 
+import asyncio
 import logging
+import time
 from . import epdconfig
+from . import framebuffer
 
 # Display resolution
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+BUSY_TIMEOUT    = 10.0 # Seconds an async refresh waits for BUSY to drop
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -45,6 +50,7 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.packer = framebuffer.make_packer(self.width, self.height, "V2")
         
     FULL_UPDATE = 0
     PART_UPDATE = 1
@@ -116,6 +122,21 @@ class EPD:
         while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
             epdconfig.delay_ms(100)    
 
+    # Waits for BUSY to drop without blocking the event loop (edge events where epdconfig
+    # has them, else polling); False when still busy after timeout
+    async def ReadBusyAsync(self, timeout=BUSY_TIMEOUT):
+        wait_release = getattr(epdconfig, "wait_busy_release_async", None)
+        if wait_release is not None:
+            released = await wait_release(timeout)
+        else:
+            deadline = time.monotonic() + timeout
+            while epdconfig.digital_read(self.busy_pin) == 1 and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            released = epdconfig.digital_read(self.busy_pin) == 0
+        if not released:
+            logger.warning("e-Paper still busy after %.1fs" % timeout)
+        return released
+
     def TurnOnDisplay(self):
         self.send_command(0x22)
         self.send_data(0xC7)
@@ -127,6 +148,12 @@ class EPD:
         self.send_data(0x0c)
         self.send_command(0x20)        
         self.ReadBusy()
+
+    async def TurnOnDisplayPartAsync(self):
+        self.send_command(0x22)
+        self.send_data(0x0c)
+        self.send_command(0x20)
+        await self.ReadBusyAsync()
         
     def init(self, update):
         if (epdconfig.module_init() != 0):
@@ -219,6 +246,11 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
+        if self.packer:
+            # Reused buffer, overwritten by the next getbuffer call
+            buf = self.packer.pack(image)
+            if buf is not None:
+                return buf
         if self.width%8 == 0:
             linewidth = int(self.width/8)
         else:
@@ -252,17 +284,42 @@ class EPD:
         self.send_command(0x24)
         self.send_data2(image)   
         self.TurnOnDisplay()
+        self._shown(image)
+
+    def _shown(self, image):
+        if self.packer:
+            self.packer.mark_shown(image)
         
     def displayPartial(self, image):
-        if self.width%8 == 0:
-            linewidth = int(self.width/8)
+        sent = self._loadPartial(image)
+        if sent:
+            self.TurnOnDisplayPart()
+            self._shown(image)
+        return sent
+
+    async def displayPartialAsync(self, image):
+        sent = self._loadPartial(image)
+        if sent:
+            await self.TurnOnDisplayPartAsync()
+            self._shown(image)
+        return sent
+
+    # Writes the frame and its inverse to RAM; returns bytes sent, 0 when already on screen
+    def _loadPartial(self, image):
+        if self.packer:
+            if self.packer.unchanged(image):
+                return 0 # Same frame as on screen: no SPI transfer, no refresh
+            buf = self.packer.inverted(image)
         else:
-            linewidth = int(self.width/8) + 1
+            if self.width%8 == 0:
+                linewidth = int(self.width/8)
+            else:
+                linewidth = int(self.width/8) + 1
 
-        buf = [0x00] * self.height * linewidth
-        for j in range(0, self.height):
-            for i in range(0, linewidth):
-                buf[i + j * linewidth] = ~image[i + j * linewidth]
+            buf = [0x00] * self.height * linewidth
+            for j in range(0, self.height):
+                for i in range(0, linewidth):
+                    buf[i + j * linewidth] = ~image[i + j * linewidth]
 
         self.send_command(0x24)
         self.send_data2(image)   
@@ -270,7 +327,7 @@ class EPD:
                 
         self.send_command(0x26)
         self.send_data2(buf)  
-        self.TurnOnDisplayPart()
+        return len(image) + len(buf)
 
     def displayPartBaseImage(self, image):
         self.send_command(0x24)
@@ -279,6 +336,7 @@ class EPD:
         self.send_command(0x26)
         self.send_data2(image)  
         self.TurnOnDisplay()
+        self._shown(image)
     
     def Clear(self, color=0xFF):
         if self.width%8 == 0:
@@ -294,6 +352,7 @@ class EPD:
 
         self.send_command(0x24)
         self.send_data2(buf)
+        self._shown(None)
                 
         # self.send_command(0x26)
         # for j in range(0, self.height):
@@ -28,13 +28,18 @@
 #
 
 
+import asyncio
 import logging
+import time
 from . import epdconfig
+from . import framebuffer
 
 # Display resolution
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+BUSY_TIMEOUT    = 10.0 # Seconds an async refresh waits for BUSY to drop
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -45,6 +50,7 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.packer = framebuffer.make_packer(self.width, self.height, "V4")
         
     '''
     function :Hardware reset
@@ -97,6 +103,28 @@ class EPD:
             epdconfig.delay_ms(10)  
         logger.debug("e-Paper busy release")
 
+    '''
+    function : Wait until the busy_pin goes LOW, yielding to the event loop meanwhile.
+               Uses the board's edge events where epdconfig has them, else polls.
+    parameter:
+        timeout : seconds
+    return    : False when still busy after timeout
+    '''
+    async def ReadBusyAsync(self, timeout=BUSY_TIMEOUT):
+        logger.debug("e-Paper busy")
+        wait_release = getattr(epdconfig, "wait_busy_release_async", None)
+        if wait_release is not None:
+            released = await wait_release(timeout)
+        else:
+            deadline = time.monotonic() + timeout
+            while epdconfig.digital_read(self.busy_pin) == 1 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            released = epdconfig.digital_read(self.busy_pin) == 0
+        if not released:
+            logger.warning("e-Paper still busy after %.1fs" % timeout)
+        logger.debug("e-Paper busy release")
+        return released
+
     '''
     function : Turn On Display
     parameter:
@@ -127,6 +155,12 @@ class EPD:
         self.send_command(0x20) # Activate Display Update Sequence
         self.ReadBusy()
 
+    async def TurnOnDisplayPartAsync(self):
+        self.send_command(0x22) # Display Update Control
+        self.send_data(0xff)
+        self.send_command(0x20) # Activate Display Update Sequence
+        await self.ReadBusyAsync()
+
 
     '''
     function : Setting the display window
@@ -245,6 +279,11 @@ class EPD:
         image : Image data
     '''
     def getbuffer(self, image):
+        if self.packer:
+            # Reused buffer, overwritten by the next getbuffer call
+            buf = self.packer.pack(image)
+            if buf is not None:
+                return buf
         img = image
         imwidth, imheight = img.size
         if(imwidth == self.width and imheight == self.height):
@@ -269,6 +308,11 @@ class EPD:
         self.send_command(0x24)
         self.send_data2(image)  
         self.TurnOnDisplay()
+        self._shown(image)
+
+    def _shown(self, image):
+        if self.packer:
+            self.packer.mark_shown(image)
     
     '''
     function : Sends the image buffer in RAM to e-Paper and fast displays
@@ -279,12 +323,31 @@ class EPD:
         self.send_command(0x24)
         self.send_data2(image) 
         self.TurnOnDisplay_Fast()
+        self._shown(image)
     '''
     function : Sends the image buffer in RAM to e-Paper and partial refresh
     parameter:
         image : Image data
     '''
     def displayPartial(self, image):
+        sent = self._loadPartial(image)
+        if sent:
+            self.TurnOnDisplayPart()
+            self._shown(image)
+        return sent
+
+    async def displayPartialAsync(self, image):
+        sent = self._loadPartial(image)
+        if sent:
+            await self.TurnOnDisplayPartAsync()
+            self._shown(image)
+        return sent
+
+    # Writes the frame to RAM for a partial refresh; returns bytes sent, 0 when already on screen
+    def _loadPartial(self, image):
+        if self.packer and self.packer.unchanged(image):
+            return 0 # Same frame as on screen: no SPI transfer, no refresh
+
         epdconfig.digital_write(self.reset_pin, 0)
         epdconfig.delay_ms(1)
         epdconfig.digital_write(self.reset_pin, 1)  
@@ -305,7 +368,101 @@ class EPD:
         
         self.send_command(0x24) # WRITE_RAM
         self.send_data2(image)  
-        self.TurnOnDisplayPart()
+        return len(image)
+
+    '''
+    function : Map a rectangle of a landscape image (height x width, as passed to getbuffer
+               and rotated 90 degrees there) to a RAM window
+    parameter:
+        x0, y0, x1, y1 : inclusive landscape corners
+    return    : (first x byte, first row, last x byte, last row)
+    '''
+    def landscape_window(self, x0, y0, x1, y1):
+        x0, x1 = max(0, min(x0, x1)), min(self.height - 1, max(x0, x1))
+        y0, y1 = max(0, min(y0, y1)), min(self.width - 1, max(y0, y1))
+        # Landscape (x, y) lands on RAM column y, row height-1-x
+        return (y0 // 8, self.height - 1 - x1, y1 // 8, self.height - 1 - x0)
+
+    '''
+    function : Partial refresh that uploads only a window of the frame; RAM outside it
+               already holds the frame on screen. Falls back to displayPartial when the
+               window covers most of the frame.
+    parameter:
+        image  : full frame buffer from getbuffer
+        window : (first x byte, first row, last x byte, last row), inclusive
+    return    : frame bytes sent
+    '''
+    def displayPartialWindow(self, image, window):
+        sent = self._loadPartialWindow(image, window)
+        if sent is None:
+            return self.displayPartial(image)
+        if sent:
+            self.TurnOnDisplayPart()
+            self._shown(image)
+            self._fullWindow()
+        return sent
+
+    async def displayPartialWindowAsync(self, image, window):
+        sent = self._loadPartialWindow(image, window)
+        if sent is None:
+            return await self.displayPartialAsync(image)
+        if sent:
+            await self.TurnOnDisplayPartAsync()
+            self._shown(image)
+            self._fullWindow()
+        return sent
+
+    # Writes the window's rows to RAM; returns bytes sent, 0 when there is nothing to
+    # refresh, None when the window is too large and displayPartial should be used
+    def _loadPartialWindow(self, image, window):
+        linewidth = (self.width + 7) // 8
+        xb0, y0, xb1, y1 = window
+        xb0, xb1 = max(0, xb0), min(linewidth - 1, xb1)
+        y0, y1 = max(0, y0), min(self.height - 1, y1)
+        if xb1 < xb0 or y1 < y0 or (self.packer and self.packer.unchanged(image)):
+            return 0
+        if (xb1 - xb0 + 1) * (y1 - y0 + 1) * 2 > linewidth * self.height:
+            return None
+
+        # No reset pulse: registers and RAM are kept from the previous refresh
+        self.send_command(0x3C) # BorderWavefrom
+        self.send_data(0x80)
+
+        self.send_command(0x01) # Driver output control
+        self.send_data(0xF9)
+        self.send_data(0x00)
+        self.send_data(0x00)
+
+        self.send_command(0x11) # data entry mode
+        self.send_data(0x03)
+
+        self.SetWindow(xb0 * 8, y0, xb1 * 8 + 7, y1)
+        self.SetCursor(xb0, y0)
+
+        data = bytearray()
+        for y in range(y0, y1 + 1):
+            data += bytes(image[y * linewidth + xb0 : y * linewidth + xb1 + 1])
+        self.send_command(0x24) # WRITE_RAM
+        self.send_data2(data)
+        return len(data)
+
+    # Full-frame writes (display, Clear) expect the whole RAM as window
+    def _fullWindow(self):
+        self.SetWindow(0, 0, self.width - 1, self.height - 1)
+        self.SetCursor(0, 0)
+
+    '''
+    function : Partial refresh of a rectangle of the landscape image
+    parameter:
+        image : full frame buffer from getbuffer
+        rect  : (x0, y0, x1, y1) inclusive, in landscape image coordinates
+    return    : frame bytes sent
+    '''
+    def displayPartialRect(self, image, rect):
+        return self.displayPartialWindow(image, self.landscape_window(*rect))
+
+    async def displayPartialRectAsync(self, image, rect):
+        return await self.displayPartialWindowAsync(image, self.landscape_window(*rect))
 
     '''
     function : Refresh a base image
@@ -319,6 +476,7 @@ class EPD:
         self.send_command(0x26)
         self.send_data2(image)  
         self.TurnOnDisplay()
+        self._shown(image)
     
     '''
     function : Clear screen
@@ -334,6 +492,7 @@ class EPD:
         self.send_command(0x24)
         self.send_data2([color] * int(self.height * linewidth))  
         self.TurnOnDisplay()
+        self._shown(None)
 
     '''
     function : Enter sleep mode
@@ -28,6 +28,7 @@
 #
 
 import os
+import asyncio
 import logging
 import sys
 import time
@@ -98,6 +99,26 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    async def wait_busy_release_async(self, timeout):
+        """
+        Waits for the BUSY falling edge without polling: gpiozero's release callback (on its
+        own thread) resolves a future on the event loop. Returns False on timeout.
+        """
+        loop = asyncio.get_running_loop()
+        released = loop.create_future()
+        def on_release():
+            loop.call_soon_threadsafe(lambda: released.done() or released.set_result(True))
+        self.GPIO_BUSY_PIN.when_released = on_release
+        try:
+            if not self.GPIO_BUSY_PIN.is_pressed:  # Released before the callback was in place
+                return True
+            await asyncio.wait_for(released, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.GPIO_BUSY_PIN.when_released = None
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -0,0 +1,92 @@
+# --- START OF FILE framebuffer.py ---
+import hashlib
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # Drivers fall back to their per-pixel PIL path
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# --- Pixel mappings from the image the caller draws onto the controller RAM canvas (rows x columns) ---
+def _v4_portrait(pixels, canvas):
+    canvas[:, :pixels.shape[1]] = pixels
+
+def _v4_landscape(pixels, canvas):
+    canvas[:, :pixels.shape[0]] = np.rot90(pixels)  # 90 degrees counter-clockwise, as PIL rotate(90)
+
+def _v2_portrait(pixels, canvas):
+    canvas[:, 1:pixels.shape[1] + 1] = pixels[:, ::-1]  # Mirrored, starting at RAM column 1
+
+def _v2_landscape(pixels, canvas):
+    canvas[:, :pixels.shape[0]] = pixels.T
+
+MAPPINGS = {"V4": {"portrait": _v4_portrait, "landscape": _v4_landscape},
+            "V2": {"portrait": _v2_portrait, "landscape": _v2_landscape}}
+
+class FramePacker:
+    """
+    Packs PIL images into the 1-bit frame a 2.13" controller expects, with NumPy.
+
+    The image is thresholded once, mapped onto a reused boolean canvas (white = 1, the
+    padding columns stay white) and packed row-wise into one bytearray that every call
+    returns, so a frame costs no per-pixel Python work and no new buffers. The previous
+    frame is overwritten by the next pack(). Each packed frame is hashed; drivers compare
+    the hash with the frame last shown to skip identical partial refreshes.
+    """
+    def __init__(self, width: int, height: int, mapping: dict):
+        self.width = width
+        self.height = height
+        self.mapping = mapping
+        self.linewidth = (width + 7) // 8
+        self.canvas = np.ones((height, self.linewidth * 8), dtype=bool)
+        self.buffer = bytearray(self.linewidth * height)
+        self.rows = np.frombuffer(self.buffer, dtype=np.uint8).reshape(height, self.linewidth)
+        self.digest = None  # Hash of self.buffer as last packed
+        self.last_orientation = None
+        self.shown = None   # Hash of the frame on the panel, None when unknown
+
+    def orientation(self, image):
+        size = image.size
+        if size == (self.width, self.height):
+            return "portrait"
+        if size == (self.height, self.width):
+            return "landscape"
+        return None
+
+    def pack(self, image):
+        """Frame bytes for `image`, or None when its size matches neither orientation."""
+        orientation = self.orientation(image)
+        if orientation is None:
+            return None
+        pixels = np.asarray(image if image.mode == '1' else image.convert('1'), dtype=bool)
+        if orientation != self.last_orientation:
+            self.canvas[:] = True  # Orientations cover different columns; reset the padding
+            self.last_orientation = orientation
+        self.mapping[orientation](pixels, self.canvas)
+        self.rows[:] = np.packbits(self.canvas, axis=1)
+        self.digest = hashlib.blake2b(self.buffer, digest_size=16).digest()
+        return self.buffer
+
+    def hash(self, frame) -> bytes:
+        if frame is self.buffer and self.digest is not None:
+            return self.digest
+        return hashlib.blake2b(bytes(frame), digest_size=16).digest()
+
+    def unchanged(self, frame) -> bool:
+        """True when `frame` is what the panel already shows."""
+        return self.shown is not None and self.hash(frame) == self.shown
+
+    def mark_shown(self, frame):
+        self.shown = self.hash(frame) if frame is not None else None
+
+    def inverted(self, frame) -> bytes:
+        return (np.frombuffer(bytes(frame), dtype=np.uint8) ^ 0xFF).tobytes()
+
+def make_packer(width: int, height: int, model: str):
+    """FramePacker for a driver model ("V2", "V4"), or None when NumPy is not installed."""
+    if np is None:
+        logger.warning("NumPy not available, using the per-pixel frame packing")
+        return None
+    return FramePacker(width, height, MAPPINGS[model])
@@ -0,0 +1,127 @@
+# --- START OF FILE mapping_index.py ---
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dfu_lib import TargetMatcher
+
+logger = logging.getLogger("MAPPING")
+
+MAPPING_DFU = "dfu"
+MAPPING_STANDARD = "standard"
+
+class MappingEntry:
+    """One compiled mapping line: target pattern (see TargetMatcher) -> firmware package."""
+    def __init__(self, name: str, firmware_path: str, kind: str, source: str):
+        self.name = name
+        self.firmware_path = firmware_path
+        self.kind = kind
+        self.source = source
+        self.sha256: Optional[str] = None  # Package digest, set once the firmware cache has hashed it
+
+class MappingIndex:
+    """
+    Compiled view of the mapping files and their .zip overrides.
+
+    Each source is a (kind, mapping file, override zip) tuple, listed from highest to lowest
+    priority. Files are parsed once; refresh() only re-reads them when the mtime of a mapping
+    file or the presence of an override changes. lookup() is a single dict hit on exact names;
+    match() runs the compiled TargetMatcher, so one line can cover a hardware family
+    (RAK*_OTA, re:..., uuid:..., mfr:...).
+    Firmware paths are resolved at load time (the downloader's `latest` symlinks only move
+    while the service is waiting for it), and a missing one is reported as an error then.
+    """
+    def __init__(self, sources: List[Tuple[str, str, Optional[str]]], check_interval: float = 2.0):
+        self.sources = sources
+        self.check_interval = check_interval
+        self.entries: Dict[str, MappingEntry] = {}
+        self.matcher = TargetMatcher({})
+        self.errors: List[str] = []
+        self._signature = None
+        self._last_check = float("-inf")
+
+    def _stat_signature(self):
+        signature = []
+        for _, mapping_file, override in self.sources:
+            for path in (mapping_file, override):
+                try:
+                    st = os.stat(path) if path else None
+                    signature.append((st.st_mtime_ns, st.st_size) if st else None)
+                except OSError:
+                    signature.append(None)
+        return tuple(signature)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reloads when something changed on disk. Returns True if the index was rebuilt."""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        signature = self._stat_signature()
+        if not force and signature == self._signature:
+            return False
+        self._signature = signature
+        self._load()
+        return True
+
+    def _load(self):
+        entries = {}
+        errors = []
+        # Highest priority first; a pattern already claimed by an earlier source is kept
+        for kind, mapping_file, override in self.sources:
+            if not os.path.exists(mapping_file):
+                continue
+            active_override = override if (override and os.path.exists(override)) else None
+
+            try:
+                with open(mapping_file, 'r') as f:
+                    for line_no, line in enumerate(f, 1):
+                        line = line.strip()
+                        if not line or line.startswith("#"): continue
+                        parts = line.split(None, 1)
+                        device_name = parts[0]
+                        raw_path = active_override if active_override else (parts[1].strip() if len(parts) == 2 else "")
+                        if not raw_path:
+                            errors.append(f"{mapping_file}:{line_no}: no firmware for {device_name}")
+                            continue
+                        if device_name.startswith(("re:", "mfr:")):
+                            try:
+                                TargetMatcher([device_name])  # Compiled alone, so one bad line only drops itself
+                            except (re.error, ValueError) as e:
+                                errors.append(f"{mapping_file}:{line_no}: invalid target pattern {device_name}: {e}")
+                                continue
+                        real_path = os.path.realpath(raw_path)
+                        if not os.path.exists(real_path):
+                            errors.append(f"{mapping_file}:{line_no}: firmware for {device_name} missing: {raw_path}")
+                            continue
+                        if device_name not in entries:
+                            entries[device_name] = MappingEntry(device_name, real_path, kind, mapping_file)
+            except Exception as e:
+                errors.append(f"Error reading mapping {mapping_file}: {e}")
+
+        matcher = TargetMatcher(entries)
+
+        for error in errors:
+            logger.error(error)
+        self.entries = entries
+        self.matcher = matcher
+        self.errors = errors
+        logger.info(f"Mapping index loaded: {len(entries)} target(s), {len(errors)} error(s)")
+
+    def lookup(self, name: Optional[str]) -> Optional[MappingEntry]:
+        return self.entries.get(name) if name else None
+
+    def match(self, device, adv) -> Optional[MappingEntry]:
+        """Entry for an advertisement, evaluated in a single pass over all patterns."""
+        return self.matcher.match(device, adv)
+
+    def paths(self) -> List[str]:
+        return sorted({e.firmware_path for e in self.entries.values()})
+
+    def set_digests(self, digests: Dict[str, str]):
+        """Stores package digests (firmware path -> SHA-256) on the current entries."""
+        for entry in self.entries.values():
+            entry.sha256 = digests.get(entry.firmware_path, entry.sha256)
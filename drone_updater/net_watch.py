@@ -0,0 +1,158 @@
+# --- START OF FILE net_watch.py ---
+import asyncio
+import errno
+import logging
+import socket
+import struct
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("NET_WATCH")
+
+# --- Netlink Constants (linux/netlink.h, linux/rtnetlink.h, linux/if_addr.h) ---
+AF_NETLINK = getattr(socket, "AF_NETLINK", 16)
+NETLINK_ROUTE = 0
+RTMGRP_IPV4_IFADDR = 0x10
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+RT_SCOPE_UNIVERSE = 0
+
+NLMSG_HEADER = struct.Struct("=IHHII")  # length, type, flags, sequence, port id
+IFADDRMSG = struct.Struct("=BBBBI")     # family, prefix length, flags, scope, interface index
+RTATTR = struct.Struct("=HH")           # length, type
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+def parse_addr(payload: bytes) -> Optional[Tuple[int, str, str, int]]:
+    """ifaddrmsg payload -> (interface index, address, label, scope), None unless IPv4."""
+    family, _, _, scope, index = IFADDRMSG.unpack_from(payload)
+    if family != socket.AF_INET:
+        return None
+    attrs = {}
+    offset = IFADDRMSG.size
+    while offset + RTATTR.size <= len(payload):
+        length, kind = RTATTR.unpack_from(payload, offset)
+        if length < RTATTR.size:
+            break
+        attrs[kind] = payload[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)  # IFA_LOCAL is ours on point-to-point links
+    if raw is None or len(raw) != 4:
+        return None
+    label = attrs.get(IFA_LABEL, b"").split(b"\0", 1)[0].decode(errors="replace")
+    return index, socket.inet_ntoa(raw), label, scope
+
+class AddressWatcher:
+    """
+    Tracks the host's IPv4 address from rtnetlink address events instead of asking for it.
+
+    start() dumps the current addresses once and subscribes to RTM_NEWADDR/RTM_DELADDR; the
+    socket is read from the event loop, so nothing runs until an address actually comes or
+    goes (WiFi associating, DHCP renewing with a new lease, rfkill taking wlan0 down).
+    `address` is the newest global-scope address still present, None when there is none,
+    and on_change(address) is called whenever that changes. If the kernel drops events
+    (ENOBUFS), the addresses are dumped again.
+    """
+    def __init__(self, on_change: Callable[[Optional[str]], None] = None):
+        self.on_change = on_change
+        self.sock: Optional[socket.socket] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.addresses: Dict[Tuple[int, str], str] = {}  # (interface index, address) -> label, oldest first
+        self.address: Optional[str] = None
+        self.sequence = 0
+        self.dump: Optional[Dict[Tuple[int, str], str]] = None  # Addresses of a dump in progress
+        self.events = 0
+
+    def start(self):
+        """Opens the netlink socket on the running loop. Raises OSError where rtnetlink is unavailable."""
+        self.loop = asyncio.get_running_loop()
+        self.sock = socket.socket(AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            self.sock.bind((0, RTMGRP_IPV4_IFADDR))
+            self.sock.setblocking(False)
+            self._request_dump()
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
+        self.loop.add_reader(self.sock.fileno(), self._readable)
+
+    @property
+    def running(self) -> bool:
+        return self.sock is not None
+
+    def stop(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def _request_dump(self):
+        self.sequence += 1
+        request = NLMSG_HEADER.pack(NLMSG_HEADER.size + IFADDRMSG.size, RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP,
+                                    self.sequence, 0) + IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        self.sock.send(request)
+        self.dump = {}
+
+    def _readable(self):
+        while self.sock is not None:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    logger.warning("Netlink events were dropped, re-reading the addresses")
+                    self._request_dump()
+                    continue
+                logger.error(f"Netlink socket failed: {e}")
+                self.stop()
+                break
+            self._parse(data)
+        self._publish()
+
+    def _parse(self, data: bytes):
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, kind, _, sequence, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if length < NLMSG_HEADER.size:
+                break
+            payload = data[offset + NLMSG_HEADER.size:offset + length]
+            offset += _align(length)
+            if kind == NLMSG_DONE and self.dump is not None and sequence == self.sequence:
+                self.addresses, self.dump = self.dump, None
+            elif kind == NLMSG_ERROR:
+                logger.warning(f"Netlink error reply: {payload[:4].hex()}")
+            elif kind in (RTM_NEWADDR, RTM_DELADDR) and len(payload) >= IFADDRMSG.size:
+                parsed = parse_addr(payload)
+                if parsed is None:
+                    continue
+                index, address, label, scope = parsed
+                if scope != RT_SCOPE_UNIVERSE:
+                    continue  # Loopback and link-local
+                self.events += 1
+                for table in (self.addresses, self.dump):
+                    if table is None:
+                        continue
+                    table.pop((index, address), None)
+                    if kind == RTM_NEWADDR:
+                        table[(index, address)] = label
+
+    def _publish(self):
+        if self.dump is not None:
+            return  # Wait for the complete dump
+        latest = next(reversed(self.addresses.items()), None)
+        address = latest[0][1] if latest else None
+        if address != self.address:
+            logger.info(f"Address: {address} ({latest[1]})" if latest else "Address: none")
+            self.address = address
+            if self.on_change:
+                self.on_change(address)
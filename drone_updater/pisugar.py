@@ -0,0 +1,130 @@
+# --- START OF FILE pisugar.py ---
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("PISUGAR")
+
+# Field name -> pisugar-server property ("get <property>" answers "<property>: <value>")
+PROPERTIES = {"battery": "battery", "temperature": "temperature", "plugged": "battery_power_plugged"}
+# Seconds a value is reused before it is asked for again
+DEFAULT_TTLS = {"battery": 30.0, "temperature": 30.0, "plugged": 5.0}
+
+def parse_value(field: str, value: str):
+    """Reply value -> int percentage / °C, bool for plugged, None when it cannot be decoded."""
+    value = value.strip()
+    if field == "plugged":
+        return {"true": True, "false": False}.get(value.lower())
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+class PiSugarClient:
+    """
+    asyncio client for the pisugar-server TCP API (127.0.0.1:8423 by default).
+
+    One connection is kept open and every stale field is asked for in a single write, the
+    replies being read back in one round trip. Values are cached per field for its TTL, so
+    a snapshot() between expiries costs nothing. A field left unanswered when `timeout`
+    runs out reads as None for its TTL while the fields that did answer are kept. When the
+    server is unreachable or answers nothing, the connection is dropped and not retried for
+    `min_backoff` seconds, doubling per failure up to `max_backoff`; fields whose TTL ran
+    out meanwhile read as None.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8423, timeout: float = 2.0,
+                 ttls: Dict[str, float] = None, min_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.values: Dict[str, Any] = {}
+        self.expires: Dict[str, float] = {}
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.lock = asyncio.Lock()
+        self.round_trips = 0
+        self.failures = 0
+        self.unanswered = set()  # Fields the last request for went without a reply
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """Current value of every field (None when unknown), refreshing the stale ones."""
+        async with self.lock:
+            now = time.monotonic()
+            stale = [field for field in PROPERTIES if self.expires.get(field, 0.0) <= now]
+            if stale and now >= self.retry_at:
+                try:
+                    missing = await self._fetch(stale)
+                    if len(missing) == len(stale):
+                        raise asyncio.TimeoutError(f"no reply within {self.timeout}s")
+                    if self.backoff:
+                        logger.info(f"PiSugar server at {self.host}:{self.port} reachable again")
+                    self.backoff = 0.0
+                    self._unanswered(stale, missing)
+                except (OSError, EOFError, asyncio.TimeoutError) as e:
+                    self._failed(e)
+            now = time.monotonic()
+            return {field: self.values.get(field) if self.expires.get(field, 0.0) > now else None
+                    for field in PROPERTIES}
+
+    async def _fetch(self, fields) -> List[str]:
+        """Asks for `fields` in one write; returns those still unanswered after `timeout`."""
+        deadline = time.monotonic() + self.timeout
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                              self.timeout)
+        self.writer.write(b"".join(f"get {PROPERTIES[field]}\n".encode() for field in fields))
+        await asyncio.wait_for(self.writer.drain(), max(0.0, deadline - time.monotonic()))
+        fields_by_property = {PROPERTIES[field]: field for field in fields}
+        while fields_by_property:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break  # A late reply is skipped as unsolicited, or taken by the next request
+            if not line:
+                raise EOFError("connection closed by pisugar-server")
+            name, _, value = line.decode(errors="replace").partition(":")
+            field = fields_by_property.pop(name.strip(), None)
+            if field is None:
+                continue  # Button events and other unsolicited lines
+            self.values[field] = parse_value(field, value)
+            self.expires[field] = time.monotonic() + self.ttls[field]
+        self.round_trips += 1
+        return list(fields_by_property.values())
+
+    def _unanswered(self, asked, missing):
+        """Missing fields read as unknown for a TTL, so one silent property does not stall the others."""
+        for field in missing:
+            if field not in self.unanswered:
+                logger.warning(f"PiSugar server did not answer 'get {PROPERTIES[field]}'")
+            self.values[field] = None
+            self.expires[field] = time.monotonic() + self.ttls[field]
+        self.unanswered = (self.unanswered - set(asked)) | set(missing)
+
+    def _failed(self, error):
+        self.failures += 1
+        if not self.backoff:  # First failure of a streak; the retries stay quiet
+            logger.warning(f"PiSugar server at {self.host}:{self.port} unavailable ({error!r}), backing off")
+        self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else self.min_backoff)
+        self.retry_at = time.monotonic() + self.backoff
+        self._drop()
+
+    def _drop(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def close(self):
+        async with self.lock:
+            writer = self.writer
+            self._drop()
+            if writer is not None:
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
@@ -0,0 +1,91 @@
+# --- START OF FILE render_assets.py ---
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_FILES = {
+    "bold": ("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 12),
+    "regular": ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12),
+    "symbol": ("/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 12),
+    "small": ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 10),
+    "small_symbol": ("/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 10),
+}
+
+# Strings drawn on every frame, rasterised once: (font, text)
+STATIC_LABELS = [("bold", "Service Running"), ("bold", "Service Stopped"), ("regular", "Progress:"),
+                 ("symbol", "🔋"), ("symbol", "🔌"), ("symbol", "-"), ("small_symbol", "🌡️")]
+
+# Characters of the changing values (clock, percentages, counters, temperature, IP, session stats)
+SPRITE_CHARSETS = {"bold": "0123456789:", "regular": "0123456789%-",
+                   "small": "0123456789/.:-°CkBs "}
+
+class Sprite:
+    """1-bit mask of rendered text and where it sits relative to the text origin."""
+    def __init__(self, font: ImageFont.FreeTypeFont, text: str):
+        # Metrics in mode '1': the frame is 1-bit, and mono hinting changes glyph advances
+        left, top, right, bottom = font.getbbox(text, mode='1')
+        self.advance = font.getlength(text, mode='1')
+        self.offset = (0, 0)
+        self.mask: Optional[Image.Image] = None
+        # Hinted glyphs can ink a pixel or two past getbbox: render with a margin, crop to the ink.
+        # Rendered on a '1' image, like ImageDraw does for the '1' frame: no anti-aliasing.
+        pad = max(2, font.size // 3)
+        canvas = Image.new('1', (right - left + 2 * pad, bottom - top + 2 * pad), 0)
+        ImageDraw.Draw(canvas).text((pad - left, pad - top), text, font=font, fill=255)
+        ink = canvas.getbbox()
+        if ink:
+            self.mask = canvas.crop(ink)
+            self.offset = (left - pad + ink[0], top - pad + ink[1])
+
+    def paste(self, image: Image.Image, x: float, y: float, fill: int):
+        if self.mask is None:
+            return
+        x0, y0 = round(x) + self.offset[0], round(y) + self.offset[1]
+        image.paste(fill, (x0, y0, x0 + self.mask.width, y0 + self.mask.height), self.mask)
+
+class RenderAssets:
+    """
+    Fonts, pre-rasterised static labels and per-font glyph sprite sheets for the status
+    screen, built once at startup. text() pastes a label or a run of glyph sprites as a
+    solid colour through their masks; strings with other characters (log lines, names) go
+    through FreeType as before.
+    """
+    def __init__(self, font_files: Dict[str, Tuple[str, int]] = None,
+                 labels: Iterable[Tuple[str, str]] = STATIC_LABELS, charsets: Dict[str, str] = None):
+        self.fonts = {name: ImageFont.truetype(path, size) for name, (path, size) in (font_files or FONT_FILES).items()}
+        self.labels = {(font, text): Sprite(self.fonts[font], text) for font, text in labels}
+        self.glyphs = {font: {ch: Sprite(self.fonts[font], ch) for ch in chars}
+                       for font, chars in (charsets or SPRITE_CHARSETS).items()}
+        # Pen adjustment per glyph pair (kerning, advance rounding), so a run lands where FreeType puts it
+        self.kerning = {font: self._pairs(self.fonts[font], glyphs) for font, glyphs in self.glyphs.items()}
+        self.blits = 0
+        self.rasterised = 0
+
+    @staticmethod
+    def _pairs(font: ImageFont.FreeTypeFont, glyphs: Dict[str, Sprite]) -> Dict[str, float]:
+        pairs = {}
+        for a, first in glyphs.items():
+            for b, second in glyphs.items():
+                adjust = font.getlength(a + b, mode='1') - first.advance - second.advance
+                if adjust:
+                    pairs[a + b] = adjust
+        return pairs
+
+    def text(self, image: Image.Image, draw: ImageDraw.ImageDraw, xy, text: str, font: str, fill: int):
+        label = self.labels.get((font, text))
+        if label is not None:
+            label.paste(image, xy[0], xy[1], fill)
+            self.blits += 1
+            return
+        glyphs = self.glyphs.get(font)
+        if glyphs is not None and all(ch in glyphs for ch in text):
+            x, y = xy
+            kerning = self.kerning[font]
+            for i, ch in enumerate(text):
+                sprite = glyphs[ch]
+                sprite.paste(image, x, y, fill)
+                x += sprite.advance + kerning.get(text[i:i + 2], 0.0)
+            self.blits += 1
+            return
+        draw.text(xy, text, font=self.fonts[font], fill=fill)
+        self.rasterised += 1
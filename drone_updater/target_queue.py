@@ -0,0 +1,125 @@
+# --- START OF FILE target_queue.py ---
+import json
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("TARGET_QUEUE")
+
+# --- Prior used until session records cover an RSSI range ---
+PRIOR_FLOOR_RSSI = -100.0  # Sessions started here almost never finish
+PRIOR_GOOD_RSSI = -70.0    # ...and almost always do from here up
+PRIOR_BPS = 20000.0        # Upload rate assumed before any session succeeded
+
+class LinkModel:
+    """
+    Predicts a session's chance of success and its upload rate from the smoothed RSSI it
+    starts at. Past session records are bucketed by RSSI; a bucket's figures are blended with
+    its neighbours and a linear prior, so a handful of sessions already shift the estimate
+    without one lucky or unlucky session deciding it.
+    """
+    def __init__(self, bucket_db: float = 5.0, prior_weight: float = 2.0):
+        self.bucket_db = bucket_db
+        self.prior_weight = prior_weight
+        self.buckets: Dict[int, List[float]] = {}  # bucket -> [sessions, successes, sum of bytes/s when ok]
+        self.sessions = 0
+
+    def _bucket(self, rssi: float) -> int:
+        return int(rssi // self.bucket_db)
+
+    def add(self, record: dict):
+        """Feeds one session record (drone_updater.record_session format, with "rssi")."""
+        rssi = record.get("rssi")
+        if rssi is None or record.get("skipped"):
+            return  # Skipped sessions transfer nothing, so they say nothing about the link
+        stats = self.buckets.setdefault(self._bucket(rssi), [0, 0, 0.0])
+        stats[0] += 1
+        if record.get("ok"):
+            stats[1] += 1
+            stats[2] += (record.get("throughput") or {}).get("avg", 0.0)
+        self.sessions += 1
+
+    def load(self, path: str) -> int:
+        """Reads a JSONL session log; returns the number of records used."""
+        before = self.sessions
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.add(json.loads(line))
+                    except (ValueError, TypeError, AttributeError):
+                        continue
+        except OSError:
+            pass
+        return self.sessions - before
+
+    def _prior_success(self, rssi: float) -> float:
+        span = (rssi - PRIOR_FLOOR_RSSI) / (PRIOR_GOOD_RSSI - PRIOR_FLOOR_RSSI)
+        return 0.05 + 0.9 * min(1.0, max(0.0, span))
+
+    def predict(self, rssi: Optional[float]) -> Tuple[float, float]:
+        """(probability the session succeeds, expected upload bytes/s)."""
+        if rssi is None:
+            rssi = PRIOR_GOOD_RSSI  # Backend reports no RSSI: nothing to hold the target back for
+        bucket = self._bucket(rssi)
+        sessions = successes = bps_sum = 0.0
+        for offset, weight in ((0, 1.0), (-1, 0.5), (1, 0.5)):
+            stats = self.buckets.get(bucket + offset)
+            if stats:
+                sessions += weight * stats[0]
+                successes += weight * stats[1]
+                bps_sum += weight * stats[2]
+
+        prior = self._prior_success(rssi)
+        success = (successes + self.prior_weight * prior) / (sessions + self.prior_weight)
+        if successes:
+            bps = bps_sum / successes
+        else:
+            bps = self.mean_bps() * prior
+        return success, bps
+
+    def mean_bps(self) -> float:
+        successes = sum(stats[1] for stats in self.buckets.values())
+        if not successes:
+            return PRIOR_BPS
+        return sum(stats[2] for stats in self.buckets.values()) / successes
+
+class Candidate:
+    """A matched device with its prediction and go/no-go decision."""
+    def __init__(self, seen, entry, success: float, bps: float, go: bool, reason: str = ""):
+        self.seen = seen
+        self.entry = entry
+        self.rssi: Optional[float] = seen.rssi
+        self.success = success
+        self.bps = bps
+        self.go = go
+        self.reason = reason
+
+    @property
+    def score(self) -> float:
+        """Expected bytes/s delivered, counting failed sessions as nothing."""
+        return self.success * self.bps
+
+class TargetQueue:
+    """
+    Orders matched devices by predicted success and upload rate, and refuses to start a
+    session on a link too weak to finish: below `min_rssi` (smoothed) or below `min_success`
+    predicted by the LinkModel.
+    """
+    def __init__(self, model: LinkModel, min_rssi: float = -88.0, min_success: float = 0.3):
+        self.model = model
+        self.min_rssi = min_rssi
+        self.min_success = min_success
+
+    def evaluate(self, seen, entry) -> Candidate:
+        success, bps = self.model.predict(seen.rssi)
+        if seen.rssi is not None and seen.rssi < self.min_rssi:
+            return Candidate(seen, entry, success, bps, False, f"RSSI {seen.rssi:.0f} dBm < {self.min_rssi:.0f}")
+        if success < self.min_success:
+            return Candidate(seen, entry, success, bps, False, f"{success:.0%} predicted success")
+        return Candidate(seen, entry, success, bps, True)
+
+    def rank(self, targets: Iterable[Tuple[object, object]]) -> List[Candidate]:
+        """Candidates for (SeenDevice, mapping entry) pairs: go before no-go, best score first."""
+        candidates = [self.evaluate(seen, entry) for seen, entry in targets]
+        candidates.sort(key=lambda c: (not c.go, -c.score, -(c.rssi if c.rssi is not None else 0.0)))
+        return candidates
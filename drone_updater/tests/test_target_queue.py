@@ -0,0 +1,25 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from target_queue import LinkModel
+
+def test_load_ignores_skipped_sessions(tmp_path):
+    log = tmp_path / "sessions.jsonl"
+    records = [
+        {"target": "A", "rssi": -62.0, "ok": True, "throughput": {"avg": 18000.0}},
+        {"target": "B", "rssi": -64.0, "ok": True, "skipped": "already running 1.9.0"},
+        {"target": "C", "rssi": -63.0, "ok": False},
+    ]
+    log.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+    model = LinkModel()
+    assert model.load(str(log)) == 2
+
+    reference = LinkModel()
+    for record in (records[0], records[2]):
+        reference.add(record)
+    assert model.buckets == reference.buckets
+    assert model.predict(-63.0) == reference.predict(-63.0)
+    assert model.mean_bps() == 18000.0